@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from src.openai.rate_limiter import rate_limit_session
+from src.pipeline.scheduler import StageEvent
+from utils.logger import logger
+
+# Analyses run at the same time by the Streamlit server, all sessions included.
+JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", "4"))
+# Seconds a finished job is kept, so that its results can still be picked up.
+JOB_TTL = float(os.getenv("ANALYSIS_JOB_TTL", "3600"))
+
+
+@dataclass(eq=False)
+class Job:
+    """
+    An analysis running in the background, and its progress.
+
+    The job function updates the job from its worker threads while the page
+    reads it on every rerun, so updates go through the methods below. `handle`
+    can be passed as the listener of a pipeline run.
+    """
+
+    id: str
+    stages: tuple[str, ...]
+    session_id: Optional[str] = None
+    status: str = "pending"  # pending, running, done or failed
+    current_stages: list[str] = field(default_factory=list)
+    completed_stages: list[str] = field(default_factory=list)
+    # (completed, total) work items of the running stages that report them
+    stage_progress: dict[str, tuple[int, Optional[int]]] = field(
+        default_factory=dict
+    )
+    # Text generated so far by the streamed stages
+    partial_outputs: dict[str, str] = field(default_factory=dict)
+    warnings: list[str] = field(default_factory=list)
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    @property
+    def progress(self) -> float:
+        """
+        Fraction of the work done, between 0 and 1: the completed stages, plus
+        the completed part of the running stages whose total work is known.
+        """
+        if self.status == "done" or not self.stages:
+            return 1.0
+        with self.lock:
+            done = len(self.completed_stages) + sum(
+                completed / total
+                for stage, (completed, total) in self.stage_progress.items()
+                if total and stage in self.current_stages
+            )
+        return min(1.0, done / len(self.stages))
+
+    def start_stage(self, stage: str):
+        with self.lock:
+            self.current_stages.append(stage)
+
+    def finish_stage(self, stage: str):
+        with self.lock:
+            if stage in self.current_stages:
+                self.current_stages.remove(stage)
+            self.completed_stages.append(stage)
+
+    def set_stage_progress(self, stage: str, completed: int, total: Optional[int]):
+        with self.lock:
+            self.stage_progress[stage] = (completed, total)
+
+    def add_partial_output(self, stage: str, text: str):
+        with self.lock:
+            self.partial_outputs[stage] = self.partial_outputs.get(stage, "") + text
+
+    def handle(self, event: StageEvent):
+        """Update the job from a pipeline `StageEvent`."""
+        if event.kind == "started":
+            self.start_stage(event.stage)
+        elif event.kind in ("finished", "skipped"):
+            self.finish_stage(event.stage)
+        elif event.kind == "progress":
+            self.set_stage_progress(event.stage, *event.data)
+        elif event.kind == "partial_output":
+            self.add_partial_output(event.stage, event.data)
+
+    def warn(self, message: str):
+        logger.warning(f"Job {self.id}: {message}")
+        with self.lock:
+            self.warnings.append(message)
+
+
+class JobRunner:
+    """
+    Runs analyses on a thread pool shared by every Streamlit session, so that
+    an analysis neither blocks the page script nor stops when the user leaves
+    the page. Jobs are looked up by id until `ttl` seconds after they finish.
+
+    Example:
+        job = job_runner.submit(analyse, stages=("ocr", "scoring"), task=task)
+        ...
+        job = job_runner.get(job.id)
+        if job.finished:
+            show(job.result)
+    """
+
+    def __init__(self, max_workers: int = JOB_WORKERS, ttl: float = JOB_TTL):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="analysis"
+        )
+        self.ttl = ttl
+        self.jobs: dict[str, Job] = {}
+        self.lock = threading.Lock()
+
+    def submit(
+        self,
+        func: Callable[..., Any],
+        stages: tuple[str, ...] = (),
+        session_id: Optional[str] = None,
+        **kwargs,
+    ) -> Job:
+        """
+        Run `func(job, **kwargs)` in the background.
+
+        Args:
+            func: The job function. It receives the `Job` to report its progress
+                on, and its return value becomes the job result.
+            stages: Names of the stages the job goes through, for its progress.
+            session_id: The browser session the job belongs to, which is also
+                its rate limit session.
+
+        Returns:
+            The submitted job.
+        """
+        self.prune()
+        job = Job(id=uuid.uuid4().hex, stages=tuple(stages), session_id=session_id)
+        with self.lock:
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job, func, kwargs)
+        logger.info(f"Submitted job {job.id}")
+        return job
+
+    def _run(self, job: Job, func: Callable[..., Any], kwargs: dict[str, Any]):
+        job.status = "running"
+        try:
+            session = (
+                rate_limit_session(job.session_id) if job.session_id else nullcontext()
+            )
+            with session:
+                job.result = func(job, **kwargs)
+            job.status = "done"
+            logger.info(f"Job {job.id} completed")
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def prune(self):
+        """Forget the jobs that finished more than `ttl` seconds ago."""
+        expired_before = time.time() - self.ttl
+        with self.lock:
+            for job_id, job in list(self.jobs.items()):
+                if job.finished_at is not None and job.finished_at < expired_before:
+                    del self.jobs[job_id]
+
+
+job_runner = JobRunner()
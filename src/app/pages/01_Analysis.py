@@ -1,8 +1,8 @@
 import streamlit as st
 import tempfile
 from pathlib import Path
-import json
 import time
+import uuid
 import plotly.graph_objects as go
 from PIL import Image
 from datetime import datetime
@@ -20,8 +20,10 @@ from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.style import WD_STYLE_TYPE
 
 # Import the pipeline components
+from src.ocr.pdf import iter_page_images
 from src.pipeline.main_pipe import Pipeline
-from src.openai.client import OpenAIClient
+from src.app.jobs import job_runner
+from src.history.store import get_history_store
 
 # Page configuration
 st.set_page_config(page_title="Prof Reviewer - Analysis", page_icon="📝", layout="wide")
@@ -47,6 +49,19 @@ if "extracted_text" not in st.session_state:
 if "processing_stage" not in st.session_state:
     st.session_state.processing_stage = ""
 
+# Identifies the browser session to the rate limiter, which shares the OpenAI
+# budget fairly between sessions
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# Id of the analysis running in the background, if any. It is also kept in the
+# URL, so that the user can come back to an analysis after leaving the page.
+if "job_id" not in st.session_state:
+    st.session_state.job_id = st.query_params.get("job")
+
+# Seconds between two refreshes of the progress of a running analysis
+JOB_POLL_INTERVAL = 1
+
 
 # Function to reset the analysis
 def reset_analysis():
@@ -56,6 +71,8 @@ def reset_analysis():
     st.session_state.analysis_results = None
     st.session_state.extracted_text = ""
     st.session_state.processing_stage = ""
+    st.session_state.job_id = None
+    st.query_params.clear()
     st.rerun()
 
 
@@ -132,133 +149,136 @@ def create_bar_chart(criterion_scores):
     return fig
 
 
-# Function to run the analysis pipeline
-def run_analysis(task, image_files):
-    # Update processing stage
-    st.session_state.processing_stage = "Initializing analysis..."
-
-    # Create temporary directory for image files
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Save uploaded files to the temporary directory, converting PDFs to images
-        image_paths = []
-        for idx, uploaded_file in enumerate(image_files):
-            original_filename_stem = Path(uploaded_file.name).stem
-            original_extension = Path(uploaded_file.name).suffix.lower()
-
-            if uploaded_file.type == "application/pdf" or original_extension == ".pdf":
-                try:
-                    pdf_pages_as_images = convert_from_bytes(uploaded_file.getvalue(), fmt='png', thread_count=4) # Added thread_count for potential speedup
-                    if not pdf_pages_as_images:
-                        st.warning(f"Could not extract any pages from PDF: {uploaded_file.name}")
-                        continue # Skip this file or handle as an error
-
-                    for page_num, pil_image in enumerate(pdf_pages_as_images):
-                        # Save each page as a PNG
-                        file_path = Path(temp_dir) / f"{original_filename_stem}_page_{page_num + 1}.png"
-                        pil_image.save(file_path, "PNG")
-                        image_paths.append(file_path)
-                    st.info(f"Converted {uploaded_file.name} ({len(pdf_pages_as_images)} pages) to PNG images for analysis.")
-                except Exception as e:
-                    st.error(f"Error converting PDF {uploaded_file.name} for analysis: {e}")
-                    # Optionally, could add a placeholder or skip this file if critical
-                    continue # Skip this problematic PDF
-            else:
-                # Handle regular image files (jpg, png, etc.)
-                # Use a safe filename based on index and original extension
-                file_path = Path(temp_dir) / f"image_{idx}{original_extension}"
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                image_paths.append(file_path)
-        
-        if not image_paths and image_files: # Check if all files failed conversion
-            st.error("No valid image files could be prepared for analysis. Please check your uploaded files.")
-            st.session_state.processing_stage = "Error: File preparation failed."
-            return # Stop further processing
-
-        try:
-            # Initialize the pipeline
-            pipeline = Pipeline(task=task)
-
-            # Update processing stage
-            st.session_state.processing_stage = "Extracting text from images..."
-            time.sleep(0.5)  # Simulate processing time
-
-            # Initialize OpenAI client and extract text
-            openai_client = OpenAIClient()
+# Stages of an analysis, in the order their progress is shown
+ANALYSIS_STAGES = {
+    "understand_solution": "Extracting text from images...",
+    "task_understanding": "Analyzing task requirements...",
+    "criterion_assessment": "Assessing student solution...",
+    "general_comment": "Writing the overall assessment...",
+    "detailed_analysis": "Generating detailed feedback...",
+    "encouraging_comment": "Generating encouraging comment...",
+}
 
-            # Extract text from images
-            st.session_state.extracted_text = pipeline.understand_solution(
-                image_paths=image_paths, openai_client=openai_client
-            )
-
-            # Update processing stage
-            st.session_state.processing_stage = "Analyzing task requirements..."
-            time.sleep(0.5)  # Simulate processing time
-
-            # Process task understanding
-            task_understanding_obj = pipeline.task_understanding(
-                task=task, openai_client=openai_client
-            )
-            task_understanding = json.dumps(task_understanding_obj)
-
-            # Update processing stage
-            st.session_state.processing_stage = "Assessing student solution..."
-            time.sleep(0.5)  # Simulate processing time
 
-            # Run assessment
-            general_comment, criterion_scores, analysis = pipeline.assessment(
-                task_understanding=task_understanding,
-                students_solution=st.session_state.extracted_text,
-                openai_client=openai_client,
-            )
-
-            # Update processing stage
-            st.session_state.processing_stage = "Generating detailed feedback..."
-            time.sleep(0.5)  # Simulate processing time
-
-            # Generate detailed analysis
-            detailed_analysis = pipeline.detailed_analysis(
-                task_understanding=task_understanding,
-                students_solution=st.session_state.extracted_text,
-                analysis=json.dumps(analysis),
-                openai_client=openai_client,
-            )
+# Function to prepare the uploaded files as page images, one at a time
+def iter_uploaded_pages(files, temp_dir, job):
+    """
+    Yield the page images of the uploaded files in order. PDFs are rendered
+    page by page, so OCR can start on the first pages while the next ones are
+    still being rendered.
 
-            # Build full analysis for encouraging comment
-            full_analysis = ""
-            for analysis_item in detailed_analysis:
-                analysis_str = json.dumps(analysis_item)
-                full_analysis += analysis_str + "\n\n"
+    `files` holds the name, type and content of each uploaded file, read in the
+    page script since the analysis runs in the background.
+    """
+    upload_dir = Path(temp_dir) / "uploads"
+    upload_dir.mkdir()
+    paths = []
+    for idx, (file_name, file_type, data) in enumerate(files):
+        # Use a safe filename based on index and original name
+        extension = ".pdf" if file_type == "application/pdf" else Path(file_name).suffix
+        file_path = upload_dir / f"{idx}_{Path(file_name).stem}{extension.lower()}"
+        file_path.write_bytes(data)
+        paths.append(file_path)
 
-            # Update processing stage
-            st.session_state.processing_stage = "Generating encouraging comment..."
-            time.sleep(0.5)  # Simulate processing time
+    yield from iter_page_images(paths, Path(temp_dir), on_warning=job.warn)
 
-            # Generate encouraging comment
-            encouraging_comment = pipeline.encouraging_comment(
-                detailed_analysis=full_analysis,
-                openai_client=openai_client,
-            )
 
-            # Store results in session state
-            st.session_state.analysis_results = {
-                "general_comment": general_comment,
-                "criterion_scores": criterion_scores,
-                "detailed_analysis": detailed_analysis,
-                "analysis": analysis,
-                "task_understanding": task_understanding_obj,
-                "encouraging_comment": encouraging_comment,
-            }
+# Function to run the analysis pipeline, in a background job
+def run_analysis(job, task, files, students_solution=None):
+    # Create temporary directory for image files
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pipeline = Pipeline(task=task)
+
+        # Stage events update the job, which the page polls. Page images are
+        # produced lazily and fed straight into OCR, unless the text of the
+        # solution was entered manually.
+        result = pipeline.execute(
+            image_paths=(
+                None if students_solution else iter_uploaded_pages(files, temp_dir, job)
+            ),
+            students_solution=students_solution,
+            listener=job.handle,
+        )
 
-            # Set analysis complete
-            st.session_state.analysis_complete = True
+    return {
+        "extracted_text": result.students_solution,
+        "analysis_results": {
+            "general_comment": result.general_comment,
+            "criterion_scores": result.criterion_scores,
+            "detailed_analysis": result.detailed_analysis,
+            "analysis": result.analysis,
+            "task_understanding": result.task_understanding,
+            "encouraging_comment": result.encouraging_comment,
+        },
+    }
 
-            # Update processing stage
-            st.session_state.processing_stage = "Analysis complete!"
 
-        except Exception as e:
-            st.error(f"An error occurred during analysis: {str(e)}")
-            st.session_state.processing_stage = f"Error: {str(e)}"
+# Function to start the analysis in the background
+def start_analysis(task, uploaded_files, students_solution=None):
+    files = [
+        (uploaded_file.name, uploaded_file.type, uploaded_file.getvalue())
+        for uploaded_file in uploaded_files or []
+    ]
+    job = job_runner.submit(
+        run_analysis,
+        stages=tuple(ANALYSIS_STAGES),
+        session_id=st.session_state.session_id,
+        task=task,
+        files=files,
+        students_solution=students_solution,
+    )
+    st.session_state.job_id = job.id
+    st.session_state.analysis_complete = False
+    st.session_state.analysis_results = None
+    st.session_state.processing_stage = "Initializing analysis..."
+    # The job id in the URL lets the user come back to the analysis later
+    st.query_params["job"] = job.id
+
+
+# Function to copy the results of a finished job into the session
+def collect_job(job):
+    st.session_state.job_id = None
+    if job.status == "done":
+        st.session_state.extracted_text = job.result["extracted_text"]
+        st.session_state.analysis_results = job.result["analysis_results"]
+        st.session_state.analysis_complete = True
+        st.session_state.processing_stage = "Analysis complete!"
+    else:
+        st.session_state.processing_stage = f"Error: {job.error}"
+
+
+# Function to show the progress of the running analysis, refreshed every second
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def show_job_progress():
+    job = job_runner.get(st.session_state.job_id) if st.session_state.job_id else None
+    if job is None:
+        # The job has expired, or the server was restarted
+        st.session_state.job_id = None
+        return
+    if job.finished:
+        collect_job(job)
+        st.rerun()
+
+    statuses = []
+    for stage in list(job.current_stages):
+        status = ANALYSIS_STAGES.get(stage, stage)
+        if stage in job.stage_progress:
+            completed, total = job.stage_progress[stage]
+            status += f" ({completed}/{total})" if total else f" ({completed} done)"
+        statuses.append(status)
+    st.write("**Status:** ", " ".join(statuses) or "Initializing analysis...")
+    st.progress(job.progress)
+    for warning in job.warnings:
+        st.warning(warning)
+
+    # Comments are shown while they are being generated
+    titles = {
+        "general_comment": "Overall Assessment",
+        "encouraging_comment": "Encouraging Feedback",
+    }
+    for stage, text in list(job.partial_outputs.items()):
+        cursor = "" if stage in job.completed_stages else "▌"
+        st.markdown(f"**{titles.get(stage, stage)}**\n\n{text}{cursor}")
 
 
 # Function to save analysis to history
@@ -266,10 +286,6 @@ def save_to_history():
     if not st.session_state.analysis_complete or not st.session_state.analysis_results:
         return
 
-    # Create history directory if it doesn't exist
-    history_dir = Path("logs/history")
-    history_dir.mkdir(parents=True, exist_ok=True)
-
     # Create a history entry
     history_entry = {
         "task_description": st.session_state.task_description,
@@ -294,16 +310,7 @@ def save_to_history():
         "max_score": 5 * len(st.session_state.analysis_results["criterion_scores"]),
     }
 
-    # Save to file with timestamp
-    import time
-
-    timestamp = int(time.time())
-    file_path = history_dir / f"{timestamp}_analysis.json"
-
-    with open(file_path, "w") as f:
-        json.dump(history_entry, f)
-
-    return file_path
+    return get_history_store().add(history_entry)
 
 
 # Function to generate PDF report
@@ -753,6 +760,7 @@ with col1:
 
     # Manual text input toggle (as an alternative to OCR)
     manual_input = st.checkbox("Enter text manually instead", value=False)
+    manual_text = ""
     if manual_input:
         manual_text = st.text_area(
             "Enter the student's solution text:",
@@ -771,7 +779,8 @@ with col1:
         analyze_button = st.button(
             "Start Analysis",
             disabled=(
-                not task_description
+                bool(st.session_state.job_id)
+                or not task_description
                 or (
                     not uploaded_files
                     and not (manual_input and st.session_state.extracted_text)
@@ -784,44 +793,24 @@ with col1:
         if reset_button:
             reset_analysis()
 
-    # Show processing status if analyzing
-    if st.session_state.processing_stage:
+    # Show the status of the last analysis
+    if st.session_state.processing_stage and not st.session_state.job_id:
         st.write("**Status:** ", st.session_state.processing_stage)
 
-        # Display a progress bar to indicate processing
-        if (
-            not st.session_state.analysis_complete
-            and "Error" not in st.session_state.processing_stage
-        ):
-            progress_bar = st.progress(0)
-
-            # Simple simulation of progress - in a real app this would be tied to actual progress
-            progress_stages = [
-                "Initializing analysis...",
-                "Extracting text from images...",
-                "Analyzing task requirements...",
-                "Assessing student solution...",
-                "Generating detailed feedback...",
-                "Generating encouraging comment...",
-                "Analysis complete!",
-            ]
-
-            current_stage_idx = (
-                progress_stages.index(st.session_state.processing_stage)
-                if st.session_state.processing_stage in progress_stages
-                else 0
-            )
-            progress_value = current_stage_idx / (len(progress_stages) - 1)
-            progress_bar.progress(progress_value)
-
 # RIGHT COLUMN: Results Display
 with col2:
     # Run analysis if button is clicked
     if analyze_button:
         st.session_state.task_description = task_description
+        start_analysis(
+            task_description,
+            uploaded_files,
+            students_solution=manual_text if manual_input and manual_text else None,
+        )
 
-        with st.spinner("Processing..."):
-            run_analysis(task_description, uploaded_files)
+    # Follow the analysis running in the background
+    if st.session_state.job_id:
+        show_job_progress()
 
     # Display results if analysis is complete
     if st.session_state.analysis_complete and st.session_state.analysis_results:
@@ -938,8 +927,8 @@ with col2:
 
             with col_save:
                 if st.button("Save to History"):
-                    saved_path = save_to_history()
-                    if saved_path:
+                    entry_id = save_to_history()
+                    if entry_id:
                         st.success("Analysis saved to history!")
                         # Option to navigate to history page
                         if st.button("View in History"):
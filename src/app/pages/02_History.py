@@ -1,55 +1,36 @@
+import math
 import streamlit as st
-import os
-import json
-from datetime import datetime
-from pathlib import Path
+from datetime import datetime, time, timedelta
+
+from src.history.store import get_history_store
 
 # Page configuration
 st.set_page_config(page_title="Prof Reviewer - History", page_icon="📚", layout="wide")
 
 st.title("Analysis History")
 
-# Create a directory for storing history if it doesn't exist
-HISTORY_DIR = Path("logs/history")
-HISTORY_DIR.mkdir(parents=True, exist_ok=True)
-
-
-# Function to load history entries
-def load_history_entries():
-    entries = []
-
-    if HISTORY_DIR.exists():
-        for file_path in HISTORY_DIR.glob("*.json"):
-            try:
-                with open(file_path, "r") as f:
-                    data = json.load(f)
-
-                # Add the filename as ID and extract timestamp from filename
-                data["id"] = file_path.stem
-                timestamp = file_path.stem.split("_")[0]
-                data["timestamp"] = datetime.fromtimestamp(int(timestamp))
-
-                entries.append(data)
-            except Exception as e:
-                st.error(f"Error loading history entry {file_path}: {str(e)}")
+# Highest total score of an analysis (4 criteria scored out of 5)
+MAX_SCORE = 20
+PAGE_SIZES = [10, 20, 50, 100]
+SORT_LABELS = {
+    "newest": "Newest first",
+    "oldest": "Oldest first",
+    "highest_score": "Highest score",
+    "lowest_score": "Lowest score",
+}
 
-    # Sort entries by timestamp (newest first)
-    entries.sort(key=lambda x: x["timestamp"], reverse=True)
-    return entries
-
-
-# Load history entries
-history_entries = load_history_entries()
+# History entries are indexed in a database; the listing only queries one page
+# of the indexed fields, and an entry is only loaded in full when it is viewed
+history_store = get_history_store()
 
 # Display empty state if no history
-if not history_entries:
+if not history_store.tasks(limit=1):
     st.info("No analysis history found. Complete an analysis to see it here.")
 
     # Show demo entry option
     if st.button("Create Demo History Entry"):
         # Create a demo entry
         demo_entry = {
-            "timestamp": datetime.now(),
             "task_description": "Write an essay discussing the impact of technology on education.",
             "general_comment": "The essay presents a well-structured argument with good examples, though some language improvements could be made.",
             "criterion_scores": {
@@ -115,16 +96,84 @@ if not history_entries:
         }
 
         # Save demo entry
-        timestamp = int(datetime.now().timestamp())
-        file_path = HISTORY_DIR / f"{timestamp}_demo.json"
-        with open(file_path, "w") as f:
-            json.dump(demo_entry, f)
+        history_store.add(demo_entry)
 
         st.success("Demo entry created! Refresh the page to see it.")
         st.rerun()
 else:
+    # Filters and sort order, applied by the query of the page
+    with st.expander("Filter and sort"):
+        col_task, col_dates = st.columns([3, 2])
+        with col_task:
+            # Only the most recent matching tasks are listed
+            task_search = st.text_input("Search tasks", placeholder="Words of the task")
+            history_tasks = history_store.tasks(search=task_search or None)
+            task_labels = {
+                task_hash: f"{task[:77] + '...' if len(task) > 80 else task} ({count})"
+                for task_hash, task, count in history_tasks
+            }
+            selected_task = st.selectbox(
+                "Task",
+                [None, *task_labels],
+                format_func=lambda task_hash: (
+                    "All tasks" if task_hash is None else task_labels[task_hash]
+                ),
+            )
+        with col_dates:
+            date_range = st.date_input("Date range", value=())
+
+        col_score, col_sort, col_size = st.columns([3, 2, 1])
+        with col_score:
+            min_score, max_score = st.slider("Total score", 0, MAX_SCORE, (0, MAX_SCORE))
+        with col_sort:
+            sort = st.selectbox(
+                "Sort by", list(SORT_LABELS), format_func=SORT_LABELS.get
+            )
+        with col_size:
+            page_size = st.selectbox("Per page", PAGE_SIZES, index=1)
+
+    filters = {
+        "task_hash": selected_task,
+        # The end date is included
+        "start": datetime.combine(date_range[0], time.min) if date_range else None,
+        "end": (
+            datetime.combine(date_range[-1] + timedelta(days=1), time.min)
+            if date_range
+            else None
+        ),
+        # Only filter on the bounds the user moved
+        "min_score": min_score if min_score > 0 else None,
+        "max_score": max_score if max_score < MAX_SCORE else None,
+        "sort": sort,
+    }
+
+    # Go back to the first page when the filters change
+    if st.session_state.get("history_filters") != (filters, page_size):
+        st.session_state.history_filters = (filters, page_size)
+        st.session_state.history_page = 1
+    page_number = st.session_state.get("history_page", 1)
+
+    results = history_store.query(
+        **filters, limit=page_size, offset=(page_number - 1) * page_size
+    )
+    page_count = max(1, math.ceil(results.total / page_size))
+    if page_number > page_count:
+        # Entries were deleted since the page was opened
+        page_number = st.session_state.history_page = page_count
+        results = history_store.query(
+            **filters, limit=page_size, offset=(page_number - 1) * page_size
+        )
+    history_entries = results.entries
+
     # Display history entries in a table
-    st.write(f"Found {len(history_entries)} past analyses")
+    if results.total:
+        first = (page_number - 1) * page_size + 1
+        st.write(
+            f"Showing {first}-{first + len(history_entries) - 1} "
+            f"of {results.total} past analyses"
+        )
+    else:
+        st.info("No analyses match the filters.")
 
     # Create columns for the table header
     col1, col2, col3, col4 = st.columns([2, 6, 2, 1])
@@ -142,32 +191,44 @@ else:
         col1, col2, col3, col4 = st.columns([2, 6, 2, 1])
 
         with col1:
-            st.write(entry["timestamp"].strftime("%Y-%m-%d %H:%M"))
+            st.write(entry.timestamp.strftime("%Y-%m-%d %H:%M"))
 
         with col2:
             # Truncate task description if it's too long
-            task = entry.get("task_description", "No task")
+            task = entry.task or "No task"
             if len(task) > 100:
                 task = task[:97] + "..."
             st.write(task)
 
         with col3:
             # Display score as fraction and percentage
-            total_score = entry.get("total_score", 0)
-            max_score = entry.get("max_score", 20)
-            score_percentage = (total_score / max_score) * 100 if max_score > 0 else 0
-            st.write(f"{total_score}/{max_score} ({score_percentage:.1f}%)")
+            st.write(
+                f"{entry.total_score}/{entry.max_score} ({entry.score_percentage:.1f}%)"
+            )
 
         with col4:
             # View button
-            if st.button("View", key=f"view_{entry['id']}"):
-                st.session_state.selected_entry = entry
+            if st.button("View", key=f"view_{entry.id}"):
+                st.session_state.selected_entry = history_store.get(entry.id)
 
         # Display a separator line
         st.markdown("---")
 
+    # Page navigation
+    col_previous, col_page, col_next = st.columns([1, 6, 1])
+    with col_previous:
+        if st.button("Previous", disabled=page_number <= 1):
+            st.session_state.history_page = page_number - 1
+            st.rerun()
+    with col_page:
+        st.write(f"Page {page_number} of {page_count}")
+    with col_next:
+        if st.button("Next", disabled=page_number >= page_count):
+            st.session_state.history_page = page_number + 1
+            st.rerun()
+
     # Display selected entry details if there is one
-    if "selected_entry" in st.session_state:
+    if st.session_state.get("selected_entry"):
         entry = st.session_state.selected_entry
 
         st.header("Analysis Details")
@@ -246,11 +307,9 @@ else:
 
         with col2:
             if st.button("Delete", key=f"delete_{entry['id']}"):
-                # Delete the entry file
+                # Delete the entry
                 try:
-                    file_path = HISTORY_DIR / f"{entry['id']}.json"
-                    if file_path.exists():
-                        os.remove(file_path)
+                    if history_store.delete(entry["id"]):
                         st.success("Entry deleted successfully")
 
                         # Remove from session state and refresh
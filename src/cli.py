@@ -0,0 +1,475 @@
+import argparse
+import contextvars
+import csv
+import json
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Optional
+
+from src.history.store import parse_score
+from src.ocr.pdf import iter_page_images
+from src.openai.batch import POLL_INTERVAL, BatchClient
+from src.openai.batch_stub import serve
+from src.openai.client import get_openai_client
+from src.openai.rate_limiter import rate_limit_session
+from src.openai.usage import track_usage
+from src.pipeline.batch_runner import BatchPipelineRunner
+from src.pipeline.main_pipe import Pipeline, understand_task
+from utils.logger import log_time, logger
+from utils.run_store import atomic_write_json, new_run_id
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+SUBMISSION_EXTENSIONS = IMAGE_EXTENSIONS | {".pdf"}
+
+# Number of essays graded at the same time.
+BATCH_CONCURRENCY = 4
+
+
+def check_student_id(student_id: str) -> str:
+    """
+    Return `student_id` if it can name a result file, since results are written
+    to `<output_dir>/<student_id>.json`.
+
+    Raises:
+        ValueError: If the id is empty, `.` or `..`, or contains a path
+            separator or NUL character.
+    """
+    if student_id.strip() in {"", ".", ".."} or any(
+        char in student_id for char in "/\\\0"
+    ):
+        raise ValueError(f"Invalid student id: {student_id!r}")
+    return student_id
+
+
+def positive_int(value: str) -> int:
+    """Parse a command line argument that must be a positive integer."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer: {value!r}")
+    return number
+
+
+def discover_submissions(source: Path) -> dict[str, list[Path]]:
+    """
+    Find the student submissions to grade.
+
+    `source` is either a directory or a CSV manifest:
+
+    - In a directory, every image or PDF file is a submission named after the
+      file, and every subdirectory is a submission whose pages are the image
+      and PDF files it contains, in file name order.
+    - A CSV manifest has `student_id` and `path` columns. A path can be a file
+      or a directory and is relative to the manifest. Rows sharing a student id
+      are the pages of one submission, in row order.
+
+    Returns:
+        A dictionary mapping student ids to the files of their submission.
+
+    Raises:
+        ValueError: If a student id cannot name a result file, or two entries
+            of a directory give the same student id (e.g. `alice.jpg` and
+            `alice.pdf`).
+    """
+    submissions: dict[str, list[Path]] = {}
+    sources: dict[str, Path] = {}
+
+    def submission_files(path: Path) -> list[Path]:
+        if path.is_dir():
+            return sorted(
+                file
+                for file in path.iterdir()
+                if file.suffix.lower() in SUBMISSION_EXTENSIONS
+            )
+        return [path]
+
+    if source.is_dir():
+        for path in sorted(source.iterdir()):
+            if path.is_dir():
+                student_id = check_student_id(path.name)
+            elif path.suffix.lower() in SUBMISSION_EXTENSIONS:
+                student_id = check_student_id(path.stem)
+            else:
+                continue
+            if student_id in sources:
+                raise ValueError(
+                    f"{sources[student_id].name} and {path.name} are both "
+                    f"submissions of {student_id!r}; rename one, or put the pages "
+                    "of the submission in a directory"
+                )
+            sources[student_id] = path
+            submissions[student_id] = submission_files(path)
+    else:
+        with open(source, "r", encoding="utf-8", newline="") as file:
+            for row in csv.DictReader(file):
+                student_id = check_student_id(row["student_id"])
+                path = source.parent / row["path"]
+                submissions.setdefault(student_id, []).extend(submission_files(path))
+
+    return {student: files for student, files in submissions.items() if files}
+
+
+def write_result(
+    student_id: str,
+    files: list[Path],
+    outputs: dict[str, Any],
+    output_dir: Path,
+) -> dict:
+    """
+    Write the result of one submission to `<output_dir>/<student_id>.json`.
+
+    Scores are read with `parse_score`, as in the history: criteria without
+    a valid score are left out of the total and their summary column is empty.
+
+    Args:
+        outputs: The pipeline outputs of the submission (`run_id`,
+            `general_comment`, `criterion_scores`, `detailed_analysis` and
+            `encouraging_comment`), or its `error`.
+
+    Returns:
+        A summary row for the submission.
+
+    Raises:
+        ValueError: If the student id cannot name a result file.
+    """
+    check_student_id(student_id)
+    summary = {"student_id": student_id, "pages": len(files)}
+
+    if "error" in outputs:
+        result = {"student_id": student_id, "error": outputs["error"]}
+        summary.update(status="error", error=outputs["error"])
+    else:
+        criterion_scores = outputs["criterion_scores"]
+        scores = {}
+        for criterion, (score, _) in criterion_scores.items():
+            scores[criterion] = parse_score(score)
+            if scores[criterion] is None:
+                logger.warning(
+                    f"{student_id} has no valid score for {criterion}: {score!r}"
+                )
+        total_score = sum(score for score in scores.values() if score is not None)
+        result = {
+            "student_id": student_id,
+            "run_id": outputs["run_id"],
+            "files": [str(path) for path in files],
+            "general_comment": outputs["general_comment"],
+            "criterion_scores": {
+                criterion: {"score": score, "justification": justification}
+                for criterion, (score, justification) in criterion_scores.items()
+            },
+            "detailed_analysis": outputs["detailed_analysis"],
+            "encouraging_comment": outputs["encouraging_comment"],
+            "total_score": total_score,
+            "max_score": 5 * len(criterion_scores),
+        }
+        summary.update(
+            status="ok",
+            total_score=total_score,
+            max_score=result["max_score"],
+            **scores,
+        )
+
+    atomic_write_json(output_dir / f"{student_id}.json", result, indent=4)
+
+    return summary
+
+
+def write_error(
+    student_id: str, files: list[Path], error: str, output_dir: Path
+) -> dict:
+    """
+    Record that a submission could not be graded, writing its result file if
+    possible.
+
+    Returns:
+        An error summary row for the submission.
+    """
+    try:
+        return write_result(student_id, files, {"error": error}, output_dir)
+    except Exception as e:
+        logger.error(f"Could not write the result of {student_id}: {str(e)}")
+        return {
+            "student_id": student_id,
+            "pages": len(files),
+            "status": "error",
+            "error": error,
+        }
+
+
+def grade_submission(
+    task: str,
+    task_understanding: Any,
+    student_id: str,
+    files: list[Path],
+    output_dir: Path,
+) -> dict:
+    """
+    Run the pipeline on one submission and write its result to
+    `<output_dir>/<student_id>.json`.
+
+    Returns:
+        A summary row for the submission.
+    """
+    start_time = time.time()
+
+    try:
+        # Each essay is its own rate limit session, so essays progress evenly.
+        with tempfile.TemporaryDirectory() as work_dir, rate_limit_session(student_id):
+            pipeline = Pipeline(task=task)
+            general_comment, criterion_scores, detailed_analysis, encouraging_comment = (
+                pipeline.run(
+                    image_paths=iter_page_images(files, Path(work_dir)),
+                    task_understanding=task_understanding,
+                )
+            )
+        outputs = {
+            "run_id": pipeline.pipeline_logger.run_id,
+            "general_comment": general_comment,
+            "criterion_scores": criterion_scores,
+            "detailed_analysis": detailed_analysis,
+            "encouraging_comment": encouraging_comment,
+        }
+        summary = write_result(student_id, files, outputs, output_dir)
+    except Exception as e:
+        logger.error(f"Grading failed for {student_id}: {str(e)}")
+        summary = write_error(student_id, files, str(e), output_dir)
+
+    summary["seconds"] = round(time.time() - start_time, 1)
+    return summary
+
+
+def grade_sync(
+    args: argparse.Namespace,
+    task: str,
+    submissions: dict[str, list[Path]],
+    output_dir: Path,
+) -> list[dict]:
+    """
+    Grade submissions with regular requests, several essays at a time.
+    """
+    # The task understanding is computed once and shared by every essay.
+    try:
+        task_understanding = understand_task(task, get_openai_client())
+    except Exception as e:
+        error = f"Task understanding failed: {str(e)}"
+        logger.error(error)
+        return [
+            {**write_error(student_id, files, error, output_dir), "seconds": 0.0}
+            for student_id, files in submissions.items()
+        ]
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [
+            # Essays run with the caller's context, and so count in its usage.
+            executor.submit(
+                contextvars.copy_context().run,
+                grade_submission,
+                task,
+                task_understanding,
+                student_id,
+                files,
+                output_dir,
+            )
+            for student_id, files in submissions.items()
+        ]
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            logger.info(
+                f"[{len(rows)}/{len(submissions)}] {row['student_id']}: {row['status']}"
+            )
+    return rows
+
+
+def grade_batch_api(
+    args: argparse.Namespace,
+    task: str,
+    submissions: dict[str, list[Path]],
+    output_dir: Path,
+) -> list[dict]:
+    """
+    Grade submissions through the OpenAI Batch API, one batch job per stage.
+    """
+    start_time = time.time()
+    runner = BatchPipelineRunner(
+        task=task,
+        batch_client=BatchClient(
+            base_url=args.base_url, poll_interval=args.poll_interval
+        ),
+    )
+    results = runner.run(submissions)
+
+    # Every essay is graded in the same batches, so they share the elapsed time.
+    seconds = round(time.time() - start_time, 1)
+    rows = []
+    for student_id, files in submissions.items():
+        try:
+            row = write_result(student_id, files, results[student_id], output_dir)
+        except Exception as e:
+            logger.error(f"Grading failed for {student_id}: {str(e)}")
+            row = write_error(student_id, files, str(e), output_dir)
+        row["seconds"] = seconds
+        rows.append(row)
+    return rows
+
+
+BACKENDS = {"sync": grade_sync, "batch-api": grade_batch_api}
+
+
+def run_batch(args: argparse.Namespace) -> int:
+    task = args.task or Path(args.task_file).read_text(encoding="utf-8")
+    try:
+        submissions = discover_submissions(Path(args.submissions))
+    except ValueError as e:
+        logger.error(str(e))
+        return 1
+    if not submissions:
+        logger.error(f"No submissions found in {args.submissions}")
+        return 1
+
+    output_dir = Path(args.output or f"logs/batch/{new_run_id()}")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    with log_time(
+        f"Batch grading of {len(submissions)} submissions ({args.backend} backend)"
+    ), track_usage() as usage:
+        rows = BACKENDS[args.backend](args, task, submissions, output_dir)
+
+    rows.sort(key=lambda row: row["student_id"])
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    with open(output_dir / "summary.csv", "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"{'Student':<30} {'Status':<8} {'Score':>7} {'Seconds':>8}")
+    for row in rows:
+        score = (
+            f"{row['total_score']}/{row['max_score']}" if row["status"] == "ok" else "-"
+        )
+        print(
+            f"{row['student_id']:<30} {row['status']:<8} {score:>7} {row['seconds']:>8}"
+        )
+    print(
+        f"\n{usage.prompt_tokens} prompt tokens sent, {usage.cached_tokens} "
+        f"({usage.cache_rate:.0%}) served from the prompt cache"
+    )
+    print(f"Results written to {output_dir}")
+
+    return 0 if all(row["status"] == "ok" for row in rows) else 2
+
+
+def run_resume(args: argparse.Namespace) -> int:
+    files = [Path(path) for path in args.files]
+    with tempfile.TemporaryDirectory() as work_dir:
+        general_comment, criterion_scores, detailed_analysis, encouraging_comment = (
+            Pipeline.resume(
+                args.run_id,
+                image_paths=iter_page_images(files, Path(work_dir)) if files else None,
+            )
+        )
+
+    print(
+        json.dumps(
+            {
+                "run_id": args.run_id,
+                "general_comment": general_comment,
+                "criterion_scores": {
+                    criterion: {"score": score, "justification": justification}
+                    for criterion, (score, justification) in criterion_scores.items()
+                },
+                "detailed_analysis": detailed_analysis,
+                "encouraging_comment": encouraging_comment,
+            },
+            indent=4,
+        )
+    )
+    return 0
+
+
+def run_batch_stub(args: argparse.Namespace) -> int:
+    serve(args.host, args.port)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="prof-reviewer",
+        description="Grade Cambridge CPE writing submissions without the web app.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser(
+        "batch", help="Grade every submission of a class against one task."
+    )
+    task = batch.add_mutually_exclusive_group(required=True)
+    task.add_argument("--task", help="The task description.")
+    task.add_argument("--task-file", help="File containing the task description.")
+    batch.add_argument(
+        "submissions",
+        help="Directory of submissions, or CSV manifest with student_id and path columns.",
+    )
+    batch.add_argument(
+        "--output",
+        help="Directory for the results (default: logs/batch/<batch_id>).",
+    )
+    batch.add_argument(
+        "--concurrency",
+        type=positive_int,
+        default=BATCH_CONCURRENCY,
+        help=f"Number of essays graded at the same time (default: {BATCH_CONCURRENCY}).",
+    )
+    batch.add_argument(
+        "--backend",
+        choices=sorted(BACKENDS),
+        default="sync",
+        help="sync sends regular requests; batch-api sends one OpenAI Batch API "
+        "job per stage, which is cheaper but can take up to 24 hours (default: sync).",
+    )
+    batch.add_argument(
+        "--poll-interval",
+        type=float,
+        default=POLL_INTERVAL,
+        help=f"Seconds between two checks of a running batch job (default: {POLL_INTERVAL:g}).",
+    )
+    batch.add_argument(
+        "--base-url",
+        help="OpenAI API base URL for the batch-api backend, e.g. the batch-stub server.",
+    )
+    batch.set_defaults(handler=run_batch)
+
+    resume = commands.add_parser(
+        "resume",
+        help="Finish an interrupted run from its log in logs/, rerunning only the missing stages.",
+    )
+    resume.add_argument("run_id", help="The run id, as in logs/pipeline_run_<run_id>.jsonl.")
+    resume.add_argument(
+        "files",
+        nargs="*",
+        help="The submission's image or PDF files, needed if its text was not extracted yet.",
+    )
+    resume.set_defaults(handler=run_resume)
+
+    stub = commands.add_parser(
+        "batch-stub",
+        help="Run a local stand-in for the OpenAI Batch API, to try batch-api offline.",
+    )
+    stub.add_argument("--host", default="127.0.0.1")
+    stub.add_argument("--port", type=int, default=8765)
+    stub.set_defaults(handler=run_batch_stub)
+
+    return parser
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
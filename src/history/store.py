@@ -0,0 +1,581 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from utils.logger import logger
+from utils.run_store import new_run_id, run_id_timestamp
+
+HISTORY_DIR = Path("logs/history")
+HISTORY_DB = Path(os.getenv("HISTORY_DB", "logs/history.db"))
+
+# Seconds between two checks of the history directory for new JSON files (set
+# to -1 to only import them when the store is created).
+HISTORY_SCAN_INTERVAL = float(os.getenv("HISTORY_SCAN_INTERVAL", "2"))
+# Seconds between two checks of every JSON file of the history directory, which
+# finds the files modified in place (set to -1 to never check them).
+HISTORY_FULL_SCAN_INTERVAL = float(os.getenv("HISTORY_FULL_SCAN_INTERVAL", "60"))
+
+# Number of tasks listed by `HistoryStore.tasks` by default.
+TASK_LIMIT = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id TEXT PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    task TEXT NOT NULL,
+    task_hash TEXT NOT NULL,
+    total_score INTEGER NOT NULL,
+    max_score INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_timestamp ON entries (timestamp);
+CREATE INDEX IF NOT EXISTS entries_task_hash ON entries (task_hash, timestamp);
+CREATE INDEX IF NOT EXISTS entries_total_score ON entries (total_score);
+
+CREATE TABLE IF NOT EXISTS criterion_scores (
+    entry_id TEXT NOT NULL REFERENCES entries (id) ON DELETE CASCADE,
+    criterion TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    PRIMARY KEY (entry_id, criterion)
+);
+CREATE INDEX IF NOT EXISTS criterion_scores_score ON criterion_scores (criterion, score);
+
+-- Full entries, only read when an entry is opened
+CREATE TABLE IF NOT EXISTS bodies (
+    entry_id TEXT PRIMARY KEY REFERENCES entries (id) ON DELETE CASCADE,
+    body TEXT NOT NULL
+);
+
+-- Tasks of the entries, with their number of entries and latest entry time,
+-- kept up to date by `add` and `delete`
+CREATE TABLE IF NOT EXISTS tasks (
+    task_hash TEXT PRIMARY KEY,
+    task TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    last_timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_last_timestamp ON tasks (last_timestamp);
+
+-- JSON files of the history directory already imported, and the version
+-- (modification time and size) that was imported
+CREATE TABLE IF NOT EXISTS imported_files (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER
+);
+"""
+
+
+def task_hash(task: str) -> str:
+    """Hash of a task description, to find the entries of the same task."""
+    return hashlib.sha256(task.strip().encode("utf-8")).hexdigest()[:16]
+
+
+def parse_score(value: Any) -> Optional[int]:
+    """
+    Read a score saved in a history entry, leniently: entries come from
+    earlier versions and other tools, and scores come from model responses.
+
+    A `[score, justification]` pair gives its score, floats are rounded, and
+    text gives its leading number (e.g. "4", "4/5" or "4 - good").
+
+    Returns:
+        The score, or None when `value` holds no number.
+    """
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return round(value)
+    if isinstance(value, str):
+        match = re.match(r"\s*(-?\d+(?:\.\d+)?)", value)
+        if match:
+            return round(float(match.group(1)))
+    return None
+
+
+@dataclass
+class HistorySummary:
+    """The indexed fields of a history entry, enough to list it."""
+
+    id: str
+    timestamp: datetime
+    task: str
+    total_score: int
+    max_score: int
+    criterion_scores: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def score_percentage(self) -> float:
+        return (self.total_score / self.max_score) * 100 if self.max_score > 0 else 0
+
+
+@dataclass
+class HistoryPage:
+    """A page of the entries matching a query."""
+
+    entries: list[HistorySummary]
+    # Number of matching entries, all pages included
+    total: int
+
+
+# Sort orders of `HistoryStore.query`, with the entry id breaking ties so that
+# pages never overlap
+SORT_ORDERS = {
+    "newest": "timestamp DESC, id DESC",
+    "oldest": "timestamp ASC, id ASC",
+    "highest_score": "total_score DESC, timestamp DESC, id DESC",
+    "lowest_score": "total_score ASC, timestamp DESC, id DESC",
+}
+
+
+class HistoryStore:
+    """
+    Saved analyses, in a SQLite database.
+
+    The fields shown in the history listing (time, task, scores) are indexed
+    in their own tables, and the full entry (extracted text, comments,
+    detailed analysis) is only loaded when it is opened.
+
+    Example:
+        store = get_history_store()
+        entry_id = store.add(history_entry)
+        for summary in store.query(min_score=15, sort="highest_score").entries:
+            print(summary.timestamp, summary.total_score)
+        entry = store.get(entry_id)
+    """
+
+    def __init__(
+        self,
+        path: Path = HISTORY_DB,
+        directory: Path = HISTORY_DIR,
+        scan_interval: float = HISTORY_SCAN_INTERVAL,
+        full_scan_interval: float = HISTORY_FULL_SCAN_INTERVAL,
+    ):
+        self.path = Path(path)
+        self.directory = Path(directory)
+        self.scan_interval = scan_interval
+        self.full_scan_interval = full_scan_interval
+        # Imported version of each JSON file of `directory`, loaded on first scan
+        self.file_versions: Optional[dict[str, tuple[int, int]]] = None
+        # Modification time of `directory` at the last scan, and when it was checked
+        self.directory_version: Optional[int] = None
+        self.checked_at: Optional[float] = None
+        # When every file was last checked
+        self.scanned_at: Optional[float] = None
+        self.scan_lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as connection:
+            # Readers are not blocked while an entry is written
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            columns = {
+                row[1]
+                for row in connection.execute("PRAGMA table_info(imported_files)")
+            }
+            if "mtime_ns" not in columns:
+                # Databases created before file versions were recorded
+                connection.execute(
+                    "ALTER TABLE imported_files ADD COLUMN mtime_ns INTEGER"
+                )
+                connection.execute(
+                    "ALTER TABLE imported_files ADD COLUMN size INTEGER"
+                )
+            if connection.execute(
+                "SELECT NOT EXISTS (SELECT 1 FROM tasks) "
+                "AND EXISTS (SELECT 1 FROM entries)"
+            ).fetchone()[0]:
+                # Databases created before tasks were recorded
+                connection.execute(
+                    "INSERT INTO tasks SELECT task_hash, MAX(task), COUNT(*), "
+                    "MAX(timestamp) FROM entries GROUP BY task_hash"
+                )
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Open a connection to the database, committed when the block succeeds.
+
+        A connection is opened per operation, so that the store can be shared
+        by the threads of every Streamlit session.
+        """
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            connection.execute("PRAGMA foreign_keys=ON")
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def add(
+        self,
+        entry: dict[str, Any],
+        entry_id: Optional[str] = None,
+        timestamp: Optional[datetime] = None,
+    ) -> str:
+        """
+        Save a history entry, as written by the Analysis page.
+
+        Args:
+            entry: The entry, with `task_description`, `criterion_scores`
+                (criterion: [score, justification]), `total_score` and
+                `max_score` among its fields. Scores are read with
+                `parse_score`; criteria without a valid score are not indexed,
+                and totals without one are computed from the criteria.
+            entry_id: The id of the entry, a new run id by default.
+            timestamp: When the analysis was done, now by default.
+
+        Returns:
+            The id of the entry.
+        """
+        entry_id = entry_id or new_run_id()
+        timestamp = timestamp or datetime.now()
+        task = entry.get("task_description", "")
+        criterion_scores = {}
+        for criterion, value in (entry.get("criterion_scores") or {}).items():
+            score = parse_score(value)
+            if score is None:
+                logger.warning(
+                    f"History entry {entry_id} has no valid score for {criterion}: "
+                    f"{value!r}"
+                )
+                continue
+            criterion_scores[criterion] = score
+
+        total_score = parse_score(entry.get("total_score"))
+        if total_score is None:
+            total_score = sum(criterion_scores.values())
+        max_score = parse_score(entry.get("max_score"))
+        if max_score is None:
+            max_score = 5 * len(entry.get("criterion_scores") or {})
+
+        with self.connect() as connection:
+            replaced = connection.execute(
+                "SELECT task_hash FROM entries WHERE id = ?", (entry_id,)
+            ).fetchone()
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    entry_id,
+                    timestamp.timestamp(),
+                    task,
+                    task_hash(task),
+                    total_score,
+                    max_score,
+                ),
+            )
+            if replaced:
+                self._remove_from_task(connection, replaced[0])
+            connection.execute(
+                "INSERT INTO tasks VALUES (?, ?, 1, ?) ON CONFLICT (task_hash) "
+                "DO UPDATE SET task = excluded.task, count = count + 1, "
+                "last_timestamp = MAX(last_timestamp, excluded.last_timestamp)",
+                (task_hash(task), task, timestamp.timestamp()),
+            )
+            connection.execute(
+                "DELETE FROM criterion_scores WHERE entry_id = ?", (entry_id,)
+            )
+            connection.executemany(
+                "INSERT INTO criterion_scores VALUES (?, ?, ?)",
+                [
+                    (entry_id, criterion, score)
+                    for criterion, score in criterion_scores.items()
+                ],
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO bodies VALUES (?, ?)",
+                (entry_id, json.dumps(entry)),
+            )
+        logger.info(f"Saved history entry {entry_id}")
+        return entry_id
+
+    def query(
+        self,
+        task_hash: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        min_score: Optional[int] = None,
+        max_score: Optional[int] = None,
+        sort: str = "newest",
+        limit: int = 20,
+        offset: int = 0,
+    ) -> HistoryPage:
+        """
+        Find the entries matching the filters, one page at a time.
+
+        The filters and the sort run in the database on the indexed fields, so
+        the cost of a page does not grow with the number of entries.
+
+        Args:
+            task_hash: Only entries of this task (see `tasks`).
+            start: Only entries saved at or after this time.
+            end: Only entries saved before this time.
+            min_score: Only entries with at least this total score.
+            max_score: Only entries with at most this total score.
+            sort: One of `SORT_ORDERS`.
+            limit: The number of entries of the page.
+            offset: The number of matching entries before the page.
+
+        Raises:
+            ValueError: When `sort` is not a known sort order.
+        """
+        if sort not in SORT_ORDERS:
+            raise ValueError(
+                f"Unknown sort order {sort}, expected one of {list(SORT_ORDERS)}"
+            )
+
+        conditions = []
+        parameters: list[Any] = []
+        if task_hash is not None:
+            conditions.append("task_hash = ?")
+            parameters.append(task_hash)
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            parameters.append(start.timestamp())
+        if end is not None:
+            conditions.append("timestamp < ?")
+            parameters.append(end.timestamp())
+        if min_score is not None:
+            conditions.append("total_score >= ?")
+            parameters.append(min_score)
+        if max_score is not None:
+            conditions.append("total_score <= ?")
+            parameters.append(max_score)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self.connect() as connection:
+            total = connection.execute(
+                f"SELECT COUNT(*) FROM entries {where}", parameters
+            ).fetchone()[0]
+            rows = connection.execute(
+                "SELECT id, timestamp, task, total_score, max_score FROM entries "
+                f"{where} ORDER BY {SORT_ORDERS[sort]} LIMIT ? OFFSET ?",
+                [*parameters, limit, offset],
+            ).fetchall()
+            scores = connection.execute(
+                "SELECT entry_id, criterion, score FROM criterion_scores "
+                f"WHERE entry_id IN ({', '.join('?' * len(rows))})",
+                [row[0] for row in rows],
+            ).fetchall()
+
+        summaries = {
+            row[0]: HistorySummary(
+                id=row[0],
+                timestamp=datetime.fromtimestamp(row[1]),
+                task=row[2],
+                total_score=row[3],
+                max_score=row[4],
+            )
+            for row in rows
+        }
+        for entry_id, criterion, score in scores:
+            summaries[entry_id].criterion_scores[criterion] = score
+        return HistoryPage(entries=list(summaries.values()), total=total)
+
+    def tasks(
+        self, search: Optional[str] = None, limit: int = TASK_LIMIT
+    ) -> list[tuple[str, str, int]]:
+        """
+        The tasks of the saved entries, most recently used first.
+
+        Args:
+            search: Only tasks whose description contains this text (case
+                insensitive for ASCII letters).
+            limit: The maximum number of tasks.
+
+        Returns:
+            The hash, description and number of entries of each task.
+        """
+        where = ""
+        parameters: list[Any] = []
+        if search:
+            escaped = re.sub(r"([%_\\])", r"\\\1", search)
+            where = "WHERE task LIKE ? ESCAPE '\\'"
+            parameters.append(f"%{escaped}%")
+        with self.connect() as connection:
+            return connection.execute(
+                f"SELECT task_hash, task, count FROM tasks {where} "
+                "ORDER BY last_timestamp DESC, task_hash LIMIT ?",
+                [*parameters, limit],
+            ).fetchall()
+
+    @staticmethod
+    def _remove_from_task(connection: sqlite3.Connection, task_hash: str):
+        """Update a task after one of its entries was removed or replaced."""
+        connection.execute(
+            "UPDATE tasks SET count = count - 1, last_timestamp = COALESCE("
+            "(SELECT MAX(timestamp) FROM entries WHERE task_hash = ?), "
+            "last_timestamp) WHERE task_hash = ?",
+            (task_hash, task_hash),
+        )
+        connection.execute(
+            "DELETE FROM tasks WHERE task_hash = ? AND count <= 0", (task_hash,)
+        )
+
+    def get(self, entry_id: str) -> Optional[dict[str, Any]]:
+        """
+        Load the full entry, with its `id` and `timestamp`.
+
+        Returns:
+            The entry, or None when there is no entry `entry_id`.
+        """
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT body, timestamp FROM entries JOIN bodies "
+                "ON bodies.entry_id = entries.id WHERE id = ?",
+                (entry_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        entry = json.loads(row[0])
+        entry["id"] = entry_id
+        entry["timestamp"] = datetime.fromtimestamp(row[1])
+        return entry
+
+    def delete(self, entry_id: str) -> bool:
+        """
+        Delete an entry.
+
+        Returns:
+            Whether there was an entry `entry_id`.
+        """
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT task_hash FROM entries WHERE id = ?", (entry_id,)
+            ).fetchone()
+            deleted = connection.execute(
+                "DELETE FROM entries WHERE id = ?", (entry_id,)
+            ).rowcount
+            if row:
+                self._remove_from_task(connection, row[0])
+        if deleted:
+            logger.info(f"Deleted history entry {entry_id}")
+        return bool(deleted)
+
+    def import_json_files(self) -> int:
+        """
+        Import the entries saved as JSON files in the history directory, by
+        earlier versions or other tools.
+
+        Only new files and files modified since they were imported (by their
+        modification time and size) are read, so a scan of an unchanged
+        directory only costs a `stat` per file. The entry of a modified file
+        is replaced; files that cannot be read are only reported once per
+        version. The files are left in place.
+
+        Returns:
+            The number of imported entries.
+        """
+        if not self.directory.is_dir():
+            return 0
+
+        with self.scan_lock:
+            if self.file_versions is None:
+                with self.connect() as connection:
+                    self.file_versions = {
+                        name: (mtime_ns, size)
+                        for name, mtime_ns, size in connection.execute(
+                            "SELECT name, mtime_ns, size FROM imported_files"
+                        )
+                    }
+
+            count = 0
+            for file_path in sorted(self.directory.glob("*.json")):
+                try:
+                    stat = file_path.stat()
+                except FileNotFoundError:
+                    continue
+                version = (stat.st_mtime_ns, stat.st_size)
+                known_version = self.file_versions.get(file_path.name)
+                if known_version == version:
+                    continue
+
+                # Files imported before versions were recorded are not read again
+                if known_version != (None, None):
+                    try:
+                        with open(file_path, "r", encoding="utf-8") as f:
+                            entry = json.load(f)
+                        entry.pop("timestamp", None)
+                        timestamp = run_id_timestamp(
+                            file_path.stem.split("_")[0]
+                        ) or datetime.fromtimestamp(stat.st_mtime)
+                        self.add(entry, entry_id=file_path.stem, timestamp=timestamp)
+                        count += 1
+                    except (OSError, ValueError, TypeError, AttributeError) as e:
+                        logger.error(
+                            f"Could not import history entry {file_path}: {str(e)}"
+                        )
+
+                with self.connect() as connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO imported_files VALUES (?, ?, ?)",
+                        (file_path.name, *version),
+                    )
+                self.file_versions[file_path.name] = version
+
+        if count:
+            logger.info(f"Imported {count} history entries from {self.directory}")
+        return count
+
+    def sync_json_files(self) -> int:
+        """
+        Import the new and modified JSON files of the history directory (see
+        `import_json_files`).
+
+        Files added, removed or replaced (as by atomic writes) change the
+        modification time of the directory, which is checked at most every
+        `scan_interval` seconds. Files modified in place leave it unchanged,
+        so every file is also checked every `full_scan_interval` seconds.
+
+        Returns:
+            The number of imported entries.
+        """
+        now = time.monotonic()
+        with self.scan_lock:
+            if self.checked_at is not None and (
+                self.scan_interval < 0 or now - self.checked_at < self.scan_interval
+            ):
+                return 0
+            self.checked_at = now
+            try:
+                directory_version = self.directory.stat().st_mtime_ns
+            except FileNotFoundError:
+                return 0
+            full_scan_due = self.full_scan_interval >= 0 and (
+                self.scanned_at is None
+                or now - self.scanned_at >= self.full_scan_interval
+            )
+            if directory_version == self.directory_version and not full_scan_due:
+                return 0
+            self.directory_version = directory_version
+            self.scanned_at = now
+        return self.import_json_files()
+
+
+_store: Optional[HistoryStore] = None
+_store_lock = threading.Lock()
+
+
+def get_history_store() -> HistoryStore:
+    """
+    Return the process-wide `HistoryStore`, shared by every session, after
+    importing the JSON files added to the history directory since the last call.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore()
+    _store.sync_json_files()
+    return _store
@@ -1,34 +1,276 @@
+import contextvars
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Any, Callable, Iterable, Optional, Union
+from src.ocr.preprocess import ImagePreprocessor, default_preprocessor
+from src.openai.cache import (
+    RESPONSE_CACHE_ENABLED,
+    NoCache,
+    ResponseCache,
+    file_digest,
+    get_cache,
+    make_key,
+    resolve_cache,
+)
 from src.openai.client import OpenAIClient
+from src.openai.retry import RetryPolicy
 from utils.logger import logger
 
+OCR_PROMPT = "Extract all text visible in this image. \
+                Respond ONLY with the exact text content from the image, nothing more. \
+                No explanations, no additional context, no formatting instructions."
+
+# Number of pages that are sent to the OpenAI API at the same time.
+MAX_CONCURRENCY = 4
+
+# Number of times a page is retried after a request failed with a transient error.
+MAX_RETRIES = 2
+
 
 class OCR:
-    def __init__(self, openai_client: OpenAIClient):
+    def __init__(
+        self,
+        openai_client: OpenAIClient,
+        per_page: bool = True,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+        preprocessor: Optional[ImagePreprocessor] = None,
+        cache: Union[ResponseCache, NoCache, None] = None,
+    ):
+        """
+        Args:
+            openai_client: Client used to send the images to the OpenAI API.
+            per_page: Whether every page is extracted by its own request.
+                When False, all pages are sent in a single request.
+            max_concurrency: Maximum number of pages extracted at the same time.
+            max_retries: Number of retries of a page whose request failed with
+                a transient error.
+            preprocessor: Optional image preprocessor. Defaults to
+                `default_preprocessor()`.
+            cache: Optional cache of page texts. Defaults to the process-wide
+                OCR cache, unless caching is disabled with OPENAI_RESPONSE_CACHE=0;
+                `NO_CACHE` disables caching.
+        """
         self.openai_client = openai_client
+        self.per_page = per_page
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.retry_policy = RetryPolicy(max_attempts=max_retries + 1)
+        self.preprocessor = preprocessor or default_preprocessor()
+        self.cache = resolve_cache(
+            cache, lambda: get_cache("ocr") if RESPONSE_CACHE_ENABLED else None
+        )
+        self.metrics: dict[str, Any] = {}
+        self.metrics_lock = threading.Lock()
         logger.info("OCR processor initialized")
 
-    def extract_text(self, image_paths: List[Path]) -> str:
+    def prepare_page(
+        self, page_number: int, image_path: Path, work_dir: Path
+    ) -> tuple[Path, dict]:
+        """
+        Preprocess a page image to shrink the OCR payload.
+
+        Returns:
+            The path of the image to send and its preprocessing metrics.
+        """
+        if not self.preprocessor:
+            size = image_path.stat().st_size
+            return image_path, {"bytes_before": size, "bytes_after": size}
+
+        # Pages get their own directory, since uploads may share a file name.
+        page_dir = work_dir / f"page_{page_number}"
+        page_dir.mkdir(exist_ok=True)
+
+        start_time = time.time()
+        try:
+            prepared = self.preprocessor.process(image_path, page_dir)
+        except Exception as e:
+            logger.warning(
+                f"Preprocessing failed for {image_path.name}, sending it as is: {str(e)}"
+            )
+            size = image_path.stat().st_size
+            return image_path, {"bytes_before": size, "bytes_after": size}
+
+        return prepared.path, {
+            "bytes_before": prepared.bytes_before,
+            "bytes_after": prepared.bytes_after,
+            "preprocess_seconds": time.time() - start_time,
+        }
+
+    @staticmethod
+    def page_cache_key(image_path: Path) -> str:
+        """
+        Cache key of the text of a prepared page image.
+
+        Pages are identified by the content of the preprocessed image, so a
+        re-uploaded page is recognised whatever its file name or EXIF data.
+        """
+        return make_key(
+            image=file_digest(image_path), prompt=OCR_PROMPT, model="gpt-4o"
+        )
+
+    def extract_page(self, page_number: int, image_path: Path, work_dir: Path) -> str:
+        """
+        Extract the text of a single page, retrying failed requests.
+
+        Args:
+            page_number: 1-based position of the page, used for logging.
+            image_path: Path to the image of the page.
+            work_dir: Directory for the preprocessed image.
+
+        Returns:
+            Extracted text content of the page
+        """
+        image_path, page_metrics = self.prepare_page(
+            page_number, image_path, work_dir
+        )
+
+        cache_key = None
+        if self.cache:
+            cache_key = self.page_cache_key(image_path)
+            if (text := self.cache.get(cache_key)) is not None:
+                with self.metrics_lock:
+                    self.metrics["cache_hits"] += 1
+                self.metrics["pages"][page_number - 1] = {
+                    "page": page_number,
+                    "cached": True,
+                    "characters": len(text),
+                    **page_metrics,
+                }
+                logger.info(f"OCR of page {page_number} served from cache")
+                return text
+
+            with self.metrics_lock:
+                self.metrics["cache_misses"] += 1
+
+        start_time = time.time()
+        try:
+            text = self.openai_client.get_response(
+                prompt=OCR_PROMPT,
+                images=[image_path],
+                model="gpt-4o",
+                use_cache=False,
+                retry_policy=self.retry_policy,
+            )
+        except Exception as e:
+            logger.error(f"OCR failed for page {page_number}: {str(e)}")
+            raise
+
+        elapsed = time.time() - start_time
+        if cache_key:
+            self.cache.set(cache_key, text)
+
+        self.metrics["pages"][page_number - 1] = {
+            "page": page_number,
+            "cached": False,
+            "seconds": elapsed,
+            "characters": len(text),
+            **page_metrics,
+        }
+        logger.info(
+            f"OCR of page {page_number} completed in {elapsed:.2f} seconds "
+            f"({page_metrics['bytes_after'] / 1024:.0f} KB sent, {len(text)} characters)"
+        )
+        return text
+
+    def extract_text(
+        self,
+        image_paths: Iterable[Path],
+        on_page: Optional[Callable[[int], None]] = None,
+    ) -> str:
         """
         Extract text from images using OpenAI's vision capabilities.
 
+        The images are preprocessed first to shrink the upload, and pages that
+        were already extracted are served from the OCR cache. In per-page
+        mode each page is sent as soon as the iterable yields it (e.g. while
+        the next page of a PDF is still being rendered), pages are extracted
+        concurrently and stitched back together in page order.
+
         Args:
-            image_paths: List of paths to images to process
+            image_paths: Paths to images to process, in page order
+            on_page: Optional function called with the number of each page
+                once its text is extracted, from the thread that extracted it.
 
         Returns:
             Extracted text content as a string
         """
-        logger.info(f"Starting OCR text extraction for {len(image_paths)} images")
+        logger.info("Starting OCR text extraction")
+        start_time = time.time()
+        self.metrics = {
+            "mode": "per_page" if self.per_page else "single_request",
+            "pages": [],
+            "cache_hits": 0,
+            "cache_misses": 0,
+        }
 
-        response = self.openai_client.get_response(
-            prompt="Extract all text visible in this image. \
-                Respond ONLY with the exact text content from the image, nothing more. \
-                No explanations, no additional context, no formatting instructions.",
-            images=image_paths,
-            model="gpt-4o",
-        )
+        with tempfile.TemporaryDirectory() as work_dir:
+            work_dir = Path(work_dir)
+
+            def extract_page(page_number: int, image_path: Path) -> str:
+                text = self.extract_page(page_number, image_path, work_dir)
+                if on_page:
+                    on_page(page_number)
+                return text
+
+            if self.per_page:
+                with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                    futures = []
+                    for page_number, image_path in enumerate(image_paths, start=1):
+                        self.metrics["pages"].append(None)
+                        futures.append(
+                            executor.submit(
+                                contextvars.copy_context().run,
+                                extract_page,
+                                page_number,
+                                image_path,
+                            )
+                        )
+                    pages = [future.result() for future in futures]
+            else:
+                prepared_paths = []
+                for page_number, image_path in enumerate(image_paths, start=1):
+                    prepared_path, page_metrics = self.prepare_page(
+                        page_number, image_path, work_dir
+                    )
+                    prepared_paths.append(prepared_path)
+                    self.metrics["pages"].append({"page": page_number, **page_metrics})
+                pages = prepared_paths
 
-        logger.info(f"OCR extraction completed, extracted {len(response)} characters")
+            if not pages:
+                logger.error("No images were provided for OCR")
+                raise ValueError("No images were provided for OCR")
+
+            if self.per_page:
+                response = "\n\n".join(pages)
+            else:
+                response = self.openai_client.get_response(
+                    prompt=OCR_PROMPT,
+                    images=prepared_paths,
+                    model="gpt-4o",
+                )
+                if on_page:
+                    for page_number in range(1, len(prepared_paths) + 1):
+                        on_page(page_number)
+
+        self.metrics["seconds"] = time.time() - start_time
+        self.metrics["bytes_before"] = sum(
+            page["bytes_before"] for page in self.metrics["pages"]
+        )
+        self.metrics["bytes_after"] = sum(
+            page["bytes_after"] for page in self.metrics["pages"]
+        )
+        logger.info(
+            f"OCR extraction of {len(self.metrics['pages'])} pages completed in "
+            f"{self.metrics['seconds']:.2f} seconds, "
+            f"extracted {len(response)} characters "
+            f"(images shrunk from {self.metrics['bytes_before'] / 1024:.0f} KB "
+            f"to {self.metrics['bytes_after'] / 1024:.0f} KB, "
+            f"{self.metrics['cache_hits']} cache hits, "
+            f"{self.metrics['cache_misses']} cache misses)"
+        )
 
         return response
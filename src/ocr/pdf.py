@@ -0,0 +1,108 @@
+import os
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from utils.logger import logger
+
+
+# Resolution used to render PDF pages for OCR. Handwriting stays legible well
+# below pdf2image's default, and every extra DPI grows the image quadratically.
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "150"))
+
+
+def iter_pdf_pages(
+    pdf_bytes: bytes,
+    output_dir: Path,
+    name: str = "document",
+    dpi: int = PDF_RENDER_DPI,
+) -> Iterator[Path]:
+    """
+    Render a PDF one page at a time, yielding the path of each page image as
+    soon as it is written.
+
+    Only a single page is ever held by the renderer, so memory does not grow
+    with the length of the document.
+
+    Args:
+        pdf_bytes: Content of the PDF file.
+        output_dir: Directory where the page images are written.
+        name: Prefix of the page image file names.
+        dpi: Rendering resolution.
+
+    Yields:
+        Paths of the rendered page images, in page order.
+    """
+    pdf_path = output_dir / f"{name}.pdf"
+    pdf_path.write_bytes(pdf_bytes)
+
+    page_count = pdfinfo_from_path(str(pdf_path))["Pages"]
+    logger.info(f"Rendering {page_count} pages of {name}.pdf at {dpi} DPI")
+
+    for page_number in range(1, page_count + 1):
+        (page_path,) = convert_from_path(
+            str(pdf_path),
+            dpi=dpi,
+            first_page=page_number,
+            last_page=page_number,
+            fmt="png",
+            output_folder=str(output_dir),
+            output_file=f"{name}_page_{page_number}",
+            single_file=True,
+            paths_only=True,
+        )
+        logger.debug(f"Rendered page {page_number} of {name}.pdf")
+        yield Path(page_path)
+
+    pdf_path.unlink()
+
+
+def iter_page_images(
+    files: Iterable[Path],
+    output_dir: Path,
+    on_warning: Optional[Callable[[str], None]] = None,
+) -> Iterator[Path]:
+    """
+    Yield the page images of a submission made of image and PDF files,
+    rendering PDFs page by page into `output_dir`.
+
+    Args:
+        files: Image and PDF files, in submission order.
+        output_dir: Directory where the PDF pages are rendered.
+        on_warning: Optional callback reporting a PDF that cannot be rendered
+            or has no pages; the PDF is then skipped. Without it, rendering
+            errors are raised.
+
+    Yields:
+        Paths of the page images, in order.
+
+    Raises:
+        RuntimeError: When a PDF fails to render after some of its pages were
+            yielded, even with `on_warning`: the pages already yielded are
+            being graded, and the rest of the essay would be missing.
+    """
+    for index, path in enumerate(files):
+        if path.suffix.lower() != ".pdf":
+            yield path
+            continue
+
+        page_count = 0
+        try:
+            for page_path in iter_pdf_pages(
+                path.read_bytes(), output_dir, name=f"{index}_{path.stem}"
+            ):
+                page_count += 1
+                yield page_path
+        except Exception as e:
+            if page_count:
+                raise RuntimeError(
+                    f"Error converting page {page_count + 1} of PDF {path.name}: {e}"
+                ) from e
+            if on_warning is None:
+                raise
+            on_warning(f"Error converting PDF {path.name} for analysis: {e}")
+            continue
+
+        if not page_count and on_warning is not None:
+            on_warning(f"Could not extract any pages from PDF: {path.name}")
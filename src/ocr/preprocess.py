@@ -0,0 +1,174 @@
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, ImageOps, ImageStat
+
+from utils.logger import logger
+
+
+MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", "2000"))
+IMAGE_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("OCR_IMAGE_QUALITY", "80"))
+
+EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+# Pixels darker than this (after autocontrast) are considered ink.
+INK_THRESHOLD = 128
+
+# Largest skew, in degrees, that deskewing tries to correct.
+MAX_SKEW = 5.0
+SKEW_STEP = 0.5
+
+
+@dataclass
+class PreprocessedImage:
+    """An image prepared for OCR and the size of the upload before and after."""
+
+    path: Path
+    bytes_before: int
+    bytes_after: int
+
+
+class ImagePreprocessor:
+    """
+    Shrinks scans and photos before they are sent for OCR.
+
+    The image is rotated according to its EXIF orientation, converted to
+    grayscale, cropped to the written area, deskewed, downscaled so that its
+    longest side is at most `max_dimension` and re-encoded. When the result is
+    not smaller than the original, the original is kept.
+    """
+
+    def __init__(
+        self,
+        max_dimension: int = MAX_DIMENSION,
+        grayscale: bool = True,
+        autocrop: bool = True,
+        deskew: bool = True,
+        image_format: str = IMAGE_FORMAT,
+        quality: int = IMAGE_QUALITY,
+    ):
+        """
+        Args:
+            max_dimension: Maximum length of the longest side, in pixels.
+            grayscale: Whether to drop colour information.
+            autocrop: Whether to crop the margins around the written area.
+            deskew: Whether to straighten slightly rotated pages.
+            image_format: Output format, JPEG or WEBP (PNG keeps the image lossless).
+            quality: Encoder quality for lossy formats.
+        """
+        if image_format not in EXTENSIONS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+
+        self.max_dimension = max_dimension
+        self.grayscale = grayscale
+        self.autocrop = autocrop
+        self.deskew = deskew
+        self.image_format = image_format
+        self.quality = quality
+
+    @staticmethod
+    def ink_mask(image: Image.Image) -> Image.Image:
+        """Binary mask where written pixels are white and the paper is black."""
+        gray = ImageOps.autocontrast(image.convert("L"))
+        return gray.point(lambda value: 255 if value < INK_THRESHOLD else 0)
+
+    @staticmethod
+    def crop_margins(image: Image.Image, padding: float = 0.02) -> Image.Image:
+        """Crop the image to the bounding box of the ink, keeping some padding."""
+        bbox = ImagePreprocessor.ink_mask(image).getbbox()
+        if not bbox:
+            return image
+
+        pad_x = int(image.width * padding)
+        pad_y = int(image.height * padding)
+        left, top, right, bottom = bbox
+        return image.crop(
+            (
+                max(0, left - pad_x),
+                max(0, top - pad_y),
+                min(image.width, right + pad_x),
+                min(image.height, bottom + pad_y),
+            )
+        )
+
+    @staticmethod
+    def skew_angle(image: Image.Image) -> float:
+        """
+        Estimate the skew of the lines of text.
+
+        Lines of text are straight when the ink, summed per row, is the most
+        uneven, so the angle that maximizes the variance of the row profile is
+        picked.
+        """
+        mask = ImagePreprocessor.ink_mask(image)
+        mask.thumbnail((800, 800))
+
+        best_angle, best_variance = 0.0, -1.0
+        steps = int(MAX_SKEW / SKEW_STEP)
+        for step in range(-steps, steps + 1):
+            angle = step * SKEW_STEP
+            rotated = mask.rotate(angle, resample=Image.Resampling.NEAREST)
+            profile = rotated.resize((1, rotated.height), Image.Resampling.BOX)
+            variance = ImageStat.Stat(profile).var[0]
+            if variance > best_variance:
+                best_angle, best_variance = angle, variance
+
+        return best_angle
+
+    def process(self, image_path: Path, output_dir: Path) -> PreprocessedImage:
+        """
+        Preprocess an image and write the result to `output_dir`.
+
+        Returns:
+            The path of the processed image and its size before and after.
+        """
+        bytes_before = image_path.stat().st_size
+
+        with Image.open(image_path) as original:
+            image = ImageOps.exif_transpose(original)
+            image = image.convert("L" if self.grayscale else "RGB")
+
+        if self.autocrop:
+            image = self.crop_margins(image)
+
+        if self.deskew:
+            angle = self.skew_angle(image)
+            if angle:
+                logger.debug(f"Deskewing {image_path.name} by {angle:.1f} degrees")
+                image = image.rotate(
+                    angle,
+                    resample=Image.Resampling.BICUBIC,
+                    expand=True,
+                    fillcolor=255 if image.mode == "L" else (255, 255, 255),
+                )
+
+        image.thumbnail((self.max_dimension, self.max_dimension), Image.Resampling.LANCZOS)
+
+        output_path = output_dir / f"{image_path.stem}{EXTENSIONS[self.image_format]}"
+        save_options = {"optimize": True}
+        if self.image_format != "PNG":
+            save_options["quality"] = self.quality
+        image.save(output_path, self.image_format, **save_options)
+
+        bytes_after = output_path.stat().st_size
+        if bytes_after >= bytes_before:
+            # Already compact uploads (e.g. clean PNG renders) are sent as is.
+            logger.debug(f"Preprocessing did not shrink {image_path.name}, keeping it")
+            return PreprocessedImage(image_path, bytes_before, bytes_before)
+
+        logger.debug(
+            f"Preprocessed {image_path.name}: {bytes_before / 1024:.0f} KB -> {bytes_after / 1024:.0f} KB"
+        )
+        return PreprocessedImage(output_path, bytes_before, bytes_after)
+
+
+def default_preprocessor() -> Optional[ImagePreprocessor]:
+    """
+    The preprocessor used for OCR, or None when disabled with OCR_PREPROCESS=0.
+    """
+    if os.getenv("OCR_PREPROCESS", "1") == "0":
+        return None
+    return ImagePreprocessor()
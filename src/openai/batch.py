@@ -0,0 +1,238 @@
+import json
+import time
+from pathlib import Path
+from typing import List, Optional, Union
+
+from openai import OpenAI
+from openai.types import CompletionUsage
+
+from src.openai.cache import (
+    NoCache,
+    ResponseCache,
+    get_response_cache,
+    resolve_cache,
+    response_cache_key,
+)
+from src.openai.client import OpenAIClient, _cache_response, _resolve_api_key
+from src.openai.usage import record_usage
+from utils.logger import logger
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+POLL_INTERVAL = 30.0
+
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchRequests:
+    """
+    Collects chat completion requests to be sent together as one Batch API job.
+    """
+
+    def __init__(self):
+        self.requests: dict[str, dict] = {}
+        # Requests whose responses are cached by the caller instead
+        self.uncached: set[str] = set()
+
+    def add(
+        self,
+        custom_id: str,
+        prompt: str,
+        model: str = "gpt-4.1",
+        images: Optional[List[Path]] = None,
+        response_format: Optional[dict] = None,
+        use_cache: bool = True,
+    ):
+        """
+        Add a request. Arguments mirror `OpenAIClient.get_response`; requests
+        are always sent with temperature 0.0.
+        """
+        if not use_cache:
+            self.uncached.add(custom_id)
+        self.requests[custom_id] = {
+            "prompt": prompt,
+            "model": model,
+            "images": images,
+            "temperature": 0.0,
+            "response_format": response_format,
+        }
+
+    def __len__(self) -> int:
+        return len(self.requests)
+
+
+class BatchClient:
+    """
+    Runs collections of requests through the OpenAI Batch API, which is
+    cheaper and has separate rate limits from synchronous requests, at the
+    cost of latency (up to the completion window).
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        poll_interval: float = POLL_INTERVAL,
+        completion_window: str = COMPLETION_WINDOW,
+        cache: Union[ResponseCache, NoCache, None] = None,
+    ):
+        """
+        Initialize the batch client.
+
+        Args:
+            api_key: Optional API key. If not provided, it will be loaded from environment variables.
+            base_url: Optional API base URL, e.g. the local stub server.
+                Defaults to OPENAI_BASE_URL or the OpenAI API.
+            poll_interval: Seconds between two checks of a running batch.
+            completion_window: Time frame within which the batch must complete.
+            cache: Optional response cache. Defaults to the process-wide cache;
+                `NO_CACHE` disables caching.
+        """
+        self.client = OpenAI(api_key=_resolve_api_key(api_key), base_url=base_url)
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.cache = resolve_cache(cache, get_response_cache)
+        logger.info("OpenAI batch client initialized successfully")
+
+    def build_jsonl(self, requests: dict[str, dict]) -> bytes:
+        """
+        Serialize requests to the Batch API input format.
+        """
+        lines = []
+        for custom_id, request in requests.items():
+            body = OpenAIClient.build_params(**request)
+            body.pop("timeout", None)
+            lines.append(
+                json.dumps(
+                    {
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": BATCH_ENDPOINT,
+                        "body": body,
+                    }
+                )
+            )
+        return "\n".join(lines).encode("utf-8")
+
+    def submit(self, requests: dict[str, dict]) -> str:
+        """
+        Upload the requests and create a batch.
+
+        Returns:
+            str: The id of the created batch.
+        """
+        input_file = self.client.files.create(
+            file=("batch_input.jsonl", self.build_jsonl(requests)),
+            purpose="batch",
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window,
+        )
+        logger.info(f"Submitted batch {batch.id} with {len(requests)} requests")
+        return batch.id
+
+    def wait(self, batch_id: str):
+        """
+        Poll a batch until it reaches a final status.
+
+        Returns:
+            The final batch object.
+        """
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            logger.info(
+                f"Batch {batch_id} is {batch.status}"
+                + (f" ({counts.completed}/{counts.total} done)" if counts else "")
+            )
+            if batch.status in FINAL_STATUSES:
+                return batch
+            time.sleep(self.poll_interval)
+
+    def fetch_results(self, batch) -> tuple[dict[str, str], dict[str, str]]:
+        """
+        Download the output and error files of a finished batch.
+
+        Returns:
+            The response content of each successful request, by custom id.
+            The error message of each failed request, by custom id.
+        """
+        results: dict[str, str] = {}
+        errors: dict[str, str] = {}
+
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = self.client.files.content(file_id).text
+            for line in content.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                custom_id = record["custom_id"]
+                response = record.get("response") or {}
+                if record.get("error") or response.get("status_code") != 200:
+                    errors[custom_id] = json.dumps(
+                        record.get("error") or response.get("body")
+                    )
+                    continue
+                results[custom_id] = response["body"]["choices"][0]["message"][
+                    "content"
+                ]
+                if usage := response["body"].get("usage"):
+                    record_usage(CompletionUsage.model_validate(usage))
+
+        return results, errors
+
+    def run(self, batch_requests: BatchRequests) -> tuple[dict[str, str], dict[str, str]]:
+        """
+        Send requests through the Batch API and wait for their responses.
+
+        Requests that are already in the response cache are answered from it
+        and are not submitted, unless they were added with `use_cache=False`.
+
+        Returns:
+            The response content of each successful request, by custom id.
+            The error message of each failed request, by custom id.
+        """
+        results: dict[str, str] = {}
+        pending: dict[str, dict] = {}
+        keys: dict[str, str] = {}
+
+        for custom_id, request in batch_requests.requests.items():
+            if self.cache and custom_id not in batch_requests.uncached:
+                keys[custom_id] = response_cache_key(max_tokens=None, **request)
+                if (content := self.cache.get(keys[custom_id])) is not None:
+                    results[custom_id] = content
+                    continue
+            pending[custom_id] = request
+
+        logger.info(
+            f"{len(results)} of {len(batch_requests)} requests answered from cache"
+        )
+        if not pending:
+            return results, {}
+
+        batch = self.wait(self.submit(pending))
+        batch_results, errors = self.fetch_results(batch)
+
+        for custom_id in pending:
+            if custom_id not in batch_results and custom_id not in errors:
+                errors[custom_id] = f"No result (batch {batch.status})"
+
+        for custom_id, content in batch_results.items():
+            if custom_id in keys:
+                _cache_response(
+                    self.cache,
+                    keys[custom_id],
+                    content,
+                    pending[custom_id]["response_format"],
+                )
+            results[custom_id] = content
+
+        if errors:
+            logger.warning(f"{len(errors)} requests of batch {batch.id} failed")
+
+        return results, errors
@@ -0,0 +1,230 @@
+import email
+import email.policy
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+from utils.logger import logger
+
+
+# Answer of the stub to a JSON-mode request: every key read by the pipeline.
+STUB_JSON_RESPONSE = {
+    "task_understanding": "Stub task understanding.",
+    "analysis": "Stub analysis.",
+    "score": 3,
+    "justification": "Stub justification.",
+    "general_comment": "Stub general comment.",
+    "improvement_areas": [
+        {
+            "category": "Language",
+            "text_reference": "Stub text reference.",
+            "issue": "Stub issue.",
+            "suggestions": ["Stub suggestion."],
+        }
+    ],
+}
+
+
+def stub_responder(body: dict) -> str:
+    """
+    Default answer of the stub server to a chat completion request.
+    """
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        return json.dumps(STUB_JSON_RESPONSE)
+    return "Stub response."
+
+
+class BatchStubServer(ThreadingHTTPServer):
+    """
+    A local HTTP server mimicking the parts of the OpenAI API used by
+    `BatchClient` (file upload and download, batch creation and retrieval), so
+    that batch grading can be run offline.
+
+    Batches complete immediately; every request is answered by `responder`.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        responder: Callable[[dict], str] = stub_responder,
+    ):
+        super().__init__((host, port), BatchStubHandler)
+        self.responder = responder
+        self.files: dict[str, dict] = {}
+        self.batches: dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def add_file(self, content: bytes, filename: str, purpose: str) -> dict:
+        file = {
+            "id": f"file-{uuid.uuid4().hex}",
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self.lock:
+            self.files[file["id"]] = {**file, "content": content}
+        return file
+
+    def run_batch(self, input_file_id: str, endpoint: str, completion_window: str) -> dict:
+        lines = self.files[input_file_id]["content"].decode("utf-8").splitlines()
+        output = []
+        for line in filter(str.strip, lines):
+            request = json.loads(line)
+            body = request["body"]
+            content = self.responder(body)
+            output.append(
+                json.dumps(
+                    {
+                        "id": f"batch_req_{uuid.uuid4().hex}",
+                        "custom_id": request["custom_id"],
+                        "response": {
+                            "status_code": 200,
+                            "request_id": uuid.uuid4().hex,
+                            "body": {
+                                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                                "object": "chat.completion",
+                                "created": int(time.time()),
+                                "model": body["model"],
+                                "choices": [
+                                    {
+                                        "index": 0,
+                                        "message": {
+                                            "role": "assistant",
+                                            "content": content,
+                                        },
+                                        "finish_reason": "stop",
+                                    }
+                                ],
+                                "usage": {
+                                    "prompt_tokens": 0,
+                                    "completion_tokens": 0,
+                                    "total_tokens": 0,
+                                },
+                            },
+                        },
+                        "error": None,
+                    }
+                )
+            )
+
+        output_file = self.add_file(
+            "\n".join(output).encode("utf-8"), "batch_output.jsonl", "batch_output"
+        )
+        now = int(time.time())
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": endpoint,
+            "errors": None,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "completed",
+            "output_file_id": output_file["id"],
+            "error_file_id": None,
+            "created_at": now,
+            "completed_at": now,
+            "request_counts": {
+                "total": len(output),
+                "completed": len(output),
+                "failed": 0,
+            },
+        }
+        with self.lock:
+            self.batches[batch["id"]] = batch
+        logger.info(f"Stub completed batch {batch['id']} with {len(output)} requests")
+        return batch
+
+
+class BatchStubHandler(BaseHTTPRequestHandler):
+    server: BatchStubServer
+
+    def log_message(self, format, *args):
+        logger.debug(f"Batch stub: {format % args}")
+
+    def send_json(self, data: dict, status: int = 200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_found(self):
+        self.send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        if self.path == "/v1/files":
+            message = email.message_from_bytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+                + self.read_body(),
+                policy=email.policy.HTTP,
+            )
+            fields = {}
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                fields[name] = (part.get_filename(), part.get_payload(decode=True))
+
+            filename, content = fields["file"]
+            purpose = fields.get("purpose", (None, b"batch"))[1].decode("utf-8")
+            self.send_json(self.server.add_file(content, filename, purpose))
+        elif self.path == "/v1/batches":
+            request = json.loads(self.read_body())
+            if request["input_file_id"] not in self.server.files:
+                self.send_json({"error": {"message": "Unknown input file"}}, 404)
+                return
+            self.send_json(
+                self.server.run_batch(
+                    request["input_file_id"],
+                    request["endpoint"],
+                    request["completion_window"],
+                )
+            )
+        else:
+            self.not_found()
+
+    def do_GET(self):
+        if match := re.fullmatch(r"/v1/batches/([\w-]+)", self.path):
+            batch = self.server.batches.get(match.group(1))
+            self.send_json(batch) if batch else self.not_found()
+        elif match := re.fullmatch(r"/v1/files/([\w-]+)/content", self.path):
+            file = self.server.files.get(match.group(1))
+            if not file:
+                self.not_found()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(file["content"])))
+            self.end_headers()
+            self.wfile.write(file["content"])
+        else:
+            self.not_found()
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, responder: Optional[Callable] = None):
+    """
+    Run the stub server until interrupted.
+    """
+    server = BatchStubServer(host, port, responder or stub_responder)
+    logger.info(f"Batch API stub listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
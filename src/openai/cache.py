@@ -0,0 +1,349 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional, Union
+
+from src.openai.usage import record_cache_lookup
+from utils.logger import logger
+
+
+CACHE_DIR = Path(os.getenv("PROF_REVIEWER_CACHE_DIR", "logs/cache"))
+RESPONSE_CACHE_ENABLED = os.getenv("OPENAI_RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_MAX_MB = float(os.getenv("OPENAI_RESPONSE_CACHE_MAX_MB", "200"))
+RESPONSE_CACHE_TTL_DAYS = float(os.getenv("OPENAI_RESPONSE_CACHE_TTL_DAYS", "30"))
+MEMORY_CACHE_ENTRIES = 256
+# Number of memory hits whose access times are written to disk together.
+TOUCH_BATCH = 32
+# Number of writes after which the size of the stored values is summed up
+# again, to account for the writes of other processes sharing the cache.
+SIZE_RECOUNT_INTERVAL = 256
+
+
+def file_digest(path: Path) -> str:
+    """
+    SHA-256 digest of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(**parts: Any) -> str:
+    """
+    Build a cache key by hashing the given JSON-serializable parts.
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def response_cache_key(
+    prompt: str,
+    model: str,
+    images: Optional[List[Path]] = None,
+    temperature: Optional[float] = 0.0,
+    max_tokens: Optional[int] = None,
+    response_format: Optional[dict] = None,
+) -> str:
+    """
+    Cache key of a chat completion request. Images are identified by the
+    digest of their content rather than by their (temporary) path.
+    """
+    return make_key(
+        prompt=prompt,
+        model=model,
+        images=[file_digest(image_path) for image_path in images or []],
+        temperature=temperature,
+        max_tokens=max_tokens,
+        response_format=response_format,
+    )
+
+
+def is_cacheable_response(content: str, response_format: Optional[dict]) -> bool:
+    """
+    Whether a response may be cached: a response requested in JSON mode is
+    only cached once it parses as JSON, so that a truncated or malformed
+    response is not returned again by every later identical request.
+    """
+    if (response_format or {}).get("type") not in {"json_object", "json_schema"}:
+        return True
+    try:
+        json.loads(content)
+    except ValueError:
+        return False
+    return True
+
+
+class NoCache:
+    """Type of `NO_CACHE`."""
+
+    def __repr__(self) -> str:
+        return "NO_CACHE"
+
+
+# Passed as the `cache` of a client to disable caching, since None means the
+# default cache.
+NO_CACHE = NoCache()
+
+
+def resolve_cache(
+    cache: Union["ResponseCache", NoCache, None],
+    default: Callable[[], Optional["ResponseCache"]],
+) -> Optional["ResponseCache"]:
+    """
+    The cache to use for a `cache` argument: `default()` when it is None, and
+    no cache when it is `NO_CACHE`.
+    """
+    if cache is NO_CACHE:
+        return None
+    return default() if cache is None else cache
+
+
+class ResponseCache:
+    """
+    A two-tier key/value cache for text responses: a small in-memory LRU in
+    front of an SQLite database on disk.
+
+    Entries expire after `ttl` seconds, and the least recently used entries are
+    evicted from disk once the stored values exceed `max_bytes`. The size of
+    the stored values is kept as a running total, summed up from disk every
+    `SIZE_RECOUNT_INTERVAL` writes. Hits on the
+    memory tier are written to disk in batches, so that eviction still sees
+    them as recently used.
+
+    Every lookup is counted in the current `track_usage` block, which reports
+    the hit rate of each cache with the run metrics.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_bytes: Optional[int] = int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+        ttl: Optional[float] = RESPONSE_CACHE_TTL_DAYS * 24 * 3600,
+        memory_entries: int = MEMORY_CACHE_ENTRIES,
+        name: Optional[str] = None,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            path: Location of the SQLite database.
+            max_bytes: Maximum total size of the values kept on disk, or None for no limit.
+            ttl: Time to live of an entry in seconds, or None for no expiry.
+            memory_entries: Number of entries kept in the in-memory tier.
+            name: Name of the cache in the run metrics. Defaults to the file name.
+        """
+        self.path = Path(path)
+        self.name = name or self.path.stem
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        # Guards the memory tier only; SQLite handles concurrent connections
+        self.lock = threading.Lock()
+        # Access times of the memory hits not written to disk yet
+        self.touched: dict[str, float] = {}
+        self.touch_count = 0
+        # Running total of the size of the values on disk, once summed up
+        self.total_bytes: Optional[int] = None
+        self.writes = 0
+        # One connection per thread, reused across operations
+        self.local = threading.local()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)"
+            )
+
+        logger.info(f"Response cache initialized at {self.path}")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """The connection of the current thread, committed when the block succeeds."""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            self.local.connection = connection
+        with connection:
+            yield connection
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def _remember(self, key: str, value: str, created_at: float):
+        self.memory[key] = (value, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _flush_touched(self, connection: sqlite3.Connection):
+        """Write the access times of the memory hits to disk."""
+        with self.lock:
+            touched, self.touched = self.touched, {}
+            self.touch_count = 0
+        if touched:
+            connection.executemany(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in touched.items()],
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Return the cached value for `key`, or None when missing or expired.
+        """
+        value = None
+        flush = False
+        with self.lock:
+            if key in self.memory:
+                value, created_at = self.memory[key]
+                if not self._expired(created_at):
+                    self.memory.move_to_end(key)
+                    self.touched[key] = time.time()
+                    self.touch_count += 1
+                    flush = self.touch_count >= TOUCH_BATCH
+                else:
+                    del self.memory[key]
+                    value = None
+
+        if value is not None:
+            if flush:
+                with self._connect() as connection:
+                    self._flush_touched(connection)
+            record_cache_lookup(self.name, hit=True)
+            return value
+
+        with self._connect() as connection:
+            self._flush_touched(connection)
+            row = connection.execute(
+                "SELECT value, created_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row and self._expired(row[1]):
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+
+            if row is not None:
+                connection.execute(
+                    "UPDATE entries SET accessed_at = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+
+        record_cache_lookup(self.name, hit=row is not None)
+        if row is None:
+            return None
+
+        value, created_at = row
+        with self.lock:
+            self._remember(key, value, created_at)
+        return value
+
+    def set(self, key: str, value: str):
+        """
+        Store `value` under `key`, evicting old entries if the cache is full.
+        """
+        now = time.time()
+        size = len(value.encode("utf-8"))
+
+        with self.lock:
+            self._remember(key, value, now)
+
+        with self._connect() as connection:
+            self._flush_touched(connection)
+            replaced = connection.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            if self.max_bytes is not None:
+                self._evict(connection, size - (replaced[0] if replaced else 0))
+
+    def _evict(self, connection: sqlite3.Connection, added: int):
+        """
+        Evict the least recently used entries once the stored values exceed
+        `max_bytes`, `added` bytes having just been stored.
+        """
+        with self.lock:
+            self.writes += 1
+            recount = (
+                self.total_bytes is None or self.writes % SIZE_RECOUNT_INTERVAL == 0
+            )
+            if not recount:
+                self.total_bytes += added
+                total = self.total_bytes
+        if recount:
+            (total,) = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            with self.lock:
+                self.total_bytes = total
+        if total <= self.max_bytes:
+            return
+
+        evicted = []
+        rows = connection.execute(
+            "SELECT key, size FROM entries ORDER BY accessed_at"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            evicted.append(key)
+            total -= size
+
+        with self.lock:
+            self.total_bytes = total
+            for key in evicted:
+                self.memory.pop(key, None)
+                self.touched.pop(key, None)
+        logger.debug(f"Evicted {len(evicted)} entries from {self.path.name}")
+
+
+_caches: dict[str, ResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name: str, **kwargs: Any) -> ResponseCache:
+    """
+    Return the process-wide cache stored in `<CACHE_DIR>/<name>.sqlite`.
+
+    Keyword arguments are passed to `ResponseCache` when the cache is first
+    created.
+    """
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = ResponseCache(
+                CACHE_DIR / f"{name}.sqlite", name=name, **kwargs
+            )
+        return _caches[name]
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Return the process-wide cache of OpenAI responses, or None when it is
+    disabled with OPENAI_RESPONSE_CACHE=0.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    return get_cache("responses")
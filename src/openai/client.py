@@ -1,37 +1,130 @@
 import os
+import asyncio
 import base64
-from typing import List, Optional
+import mimetypes
+import threading
+import time
+from typing import Any, Iterator, List, Optional, Union
 from utils.logger import logger
 from pathlib import Path
 
-from openai import OpenAI
+from src.openai.cache import (
+    NoCache,
+    ResponseCache,
+    get_response_cache,
+    is_cacheable_response,
+    resolve_cache,
+    response_cache_key,
+)
+from src.openai.rate_limiter import Permit, RateLimiter, estimate_tokens, rate_limiter
+from src.openai.retry import (
+    DEFAULT_RETRY_POLICY,
+    DeadlineExceeded,
+    RetryPolicy,
+    bounded_timeout,
+    call_hedged,
+    hedged_stage,
+    remaining_time,
+)
+from src.openai.usage import record_usage
+
+import httpx
+from openai import (
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+    OpenAI,
+    RateLimitError,
+)
 from openai.types.chat import ChatCompletion
 from dotenv import load_dotenv
 
 
 load_dotenv()
 
+# Connection pool settings shared by every client in the process.
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "50"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "120"))
+
+# Number of times a request rejected with a rate limit error is sent again,
+# after the pause asked by the API. Other transient errors are retried
+# according to the client's `RetryPolicy`. The SDK's own retries are disabled
+# so that every rate limit error reaches the limiter.
+RATE_LIMIT_RETRIES = int(os.getenv("OPENAI_RATE_LIMIT_RETRIES", "5"))
+
+
+def connection_limits() -> httpx.Limits:
+    """
+    Connection pool limits for the HTTP clients used to talk to the OpenAI API.
+    """
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def is_quota_error(error: RateLimitError) -> bool:
+    """
+    Whether a rate limit error is due to an exhausted quota, which waiting
+    does not fix.
+    """
+    return getattr(error, "code", None) == "insufficient_quota"
+
+
+def _resolve_api_key(api_key: Optional[str]) -> str:
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        logger.error(
+            "OpenAI API key not found. Please set the OPENAI_API_KEY environment variable."
+        )
+        raise ValueError("OpenAI API key not found.")
+    return api_key
+
+
+def _cache_response(
+    cache: ResponseCache, cache_key: str, content: str, response_format: Optional[dict]
+):
+    """Cache a response, unless it is not the valid JSON it was asked to be."""
+    if is_cacheable_response(content, response_format):
+        cache.set(cache_key, content)
+    else:
+        logger.warning("Not caching a response that is not valid JSON")
+
 
 class OpenAIClient:
     """
     A class for interacting with the OpenAI API.
     """
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        limiter: Optional[RateLimiter] = None,
+        cache: Union[ResponseCache, NoCache, None] = None,
+        retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    ):
         """
         Initialize the OpenAI client.
 
         Args:
             api_key: Optional API key. If not provided, it will be loaded from environment variables.
+            limiter: Optional rate limiter. Defaults to the process-wide limiter.
+            cache: Optional response cache. Defaults to the process-wide cache;
+                `NO_CACHE` disables caching.
+            retry_policy: How requests failing with a transient error are retried.
         """
-        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
-        if not self.api_key:
-            logger.error(
-                "OpenAI API key not found. Please set the OPENAI_API_KEY environment variable."
-            )
-            raise ValueError("OpenAI API key not found.")
+        self.api_key = _resolve_api_key(api_key)
 
-        self.client = OpenAI(api_key=self.api_key)
+        self.client = OpenAI(
+            api_key=self.api_key,
+            http_client=DefaultHttpxClient(limits=connection_limits()),
+            max_retries=0,
+        )
+        self.limiter = limiter or rate_limiter
+        self.cache = resolve_cache(cache, get_response_cache)
+        self.retry_policy = retry_policy
         logger.info("OpenAI client initialized successfully")
 
     @staticmethod
@@ -54,34 +147,35 @@ class OpenAIClient:
         )
         return encoded
 
-    def get_raw_response(
-        self,
+    @staticmethod
+    def image_mime_type(image_path: Path) -> str:
+        """
+        MIME type of an image file, based on its extension.
+
+        Returns:
+            str: The MIME type, `image/jpeg` when it cannot be determined.
+        """
+        mime_type, _ = mimetypes.guess_type(image_path.name)
+        if mime_type and mime_type.startswith("image/"):
+            return mime_type
+        return "image/jpeg"
+
+    @classmethod
+    def build_params(
+        cls,
         prompt: str,
-        model: str = "gpt-4.1",
+        model: str,
         images: Optional[List[Path]] = None,
         temperature: Optional[float] = 0.0,
         max_tokens: Optional[int] = None,
         response_format: Optional[dict] = None,
         timeout: Optional[float] = 120.0,
-    ) -> ChatCompletion:
+    ) -> dict:
         """
-        Generate a response from OpenAI models and return the raw API response.
-
-        Args:
-            prompt: The text prompt to send to the model.
-            model: The OpenAI model to use.
-            images: Optional list of images to include with the prompt.
-            temperature: Controls randomness.
-            max_tokens: Maximum number of tokens to generate.
-            response_format: Optional response format specification.
-            timeout: Request timeout in seconds (default: 60.0).
+        Build the keyword arguments for a chat completion request.
 
         Returns:
-            ChatCompletion: The raw response from the OpenAI API.
-
-        Raises:
-            Exception: For API errors or connectivity issues.
-            TimeoutError: When the request times out.
+            dict: Parameters for `chat.completions.create`.
         """
         messages = [{"role": "user", "content": [{"type": "text", "text": prompt}]}]
 
@@ -89,13 +183,14 @@ class OpenAIClient:
             try:
                 # Process all images in the list
                 for image_path in images:
-                    base64_image = self.encode_image(image_path)
+                    base64_image = cls.encode_image(image_path)
+                    mime_type = cls.image_mime_type(image_path)
                     # Include the base64 image in a custom structure
                     messages[0]["content"].append(
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
+                                "url": f"data:{mime_type};base64,{base64_image}"
                             },
                         }
                     )
@@ -119,24 +214,239 @@ class OpenAIClient:
         if response_format:
             params["response_format"] = response_format
 
-        # Update tracking params with full info
+        return params
+
+    def get_raw_response(
+        self,
+        prompt: str,
+        model: str = "gpt-4.1",
+        images: Optional[List[Path]] = None,
+        temperature: Optional[float] = 0.0,
+        max_tokens: Optional[int] = None,
+        response_format: Optional[dict] = None,
+        timeout: Optional[float] = 120.0,
+        retry_policy: Optional[RetryPolicy] = None,
+    ) -> ChatCompletion:
+        """
+        Generate a response from OpenAI models and return the raw API response.
+
+        Requests go through the shared rate limiter. Requests rejected with a
+        rate limit error are sent again once the limiter allows it, and other
+        transient errors are retried according to the retry policy. Timeouts
+        and retries never go past the current deadline (see `retry.deadline`).
 
-        logger.info(f"Sending request to OpenAI API with model: {model}")
+        Args:
+            prompt: The text prompt to send to the model.
+            model: The OpenAI model to use.
+            images: Optional list of images to include with the prompt.
+            temperature: Controls randomness.
+            max_tokens: Maximum number of tokens to generate.
+            response_format: Optional response format specification.
+            timeout: Request timeout in seconds (default: 120.0).
+            retry_policy: Optional retry policy. Defaults to the client's policy.
+
+        Returns:
+            ChatCompletion: The raw response from the OpenAI API.
+
+        Raises:
+            Exception: For API errors or connectivity issues.
+            RateLimitError: When the quota is exhausted or the request is still
+                rate limited after `RATE_LIMIT_RETRIES` retries.
+            TimeoutError: When the request times out.
+            DeadlineExceeded: When the current deadline has passed.
+        """
+        params = self.build_params(
+            prompt=prompt,
+            model=model,
+            images=images,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            response_format=response_format,
+            timeout=timeout,
+        )
+        tokens = estimate_tokens(
+            prompt,
+            len(images or []),
+            max_tokens or self.limiter.expected_completion_tokens(model),
+        )
+
+        raw_response, permit = self._send(params, tokens, retry_policy)
+        response = None
         try:
-            response = self.client.chat.completions.create(**params)
-            logger.info(
-                f"Received response from OpenAI API: {response.usage.total_tokens} tokens used"
+            response = raw_response.parse()
+        finally:
+            # Also reached when the response cannot be parsed, which does not
+            # count as a success; the estimate only stands in for a missing usage.
+            parsed = response is not None
+            usage = response.usage if parsed else None
+            self.limiter.release(
+                permit,
+                usage.total_tokens if usage else (tokens if parsed else None),
+                raw_response.headers,
+                completion_tokens=usage.completion_tokens if usage else None,
             )
-            return response
-        except Exception as e:
-            if "timeout" in str(e).lower():
-                logger.error(f"Request timed out after {timeout} seconds: {str(e)}")
-                raise TimeoutError(
-                    f"OpenAI API request timed out after {timeout} seconds"
-                )
-            else:
-                logger.error(f"OpenAI API request failed: {str(e)}")
+        logger.info(
+            f"Received response from OpenAI API: {record_usage(response.usage)}"
+        )
+        return response
+
+    def _send(
+        self, params: dict, tokens: int, retry_policy: Optional[RetryPolicy] = None
+    ) -> tuple[Any, Permit]:
+        """
+        Send a chat completion request through the rate limiter, retrying
+        rate limit and transient errors.
+
+        Returns:
+            The raw response (from `with_raw_response`), and the rate limiter
+            permit, which the caller releases once the response has been read.
+        """
+        model = params["model"]
+        timeout = params["timeout"]
+        policy = retry_policy or self.retry_policy
+        attempt = 0
+        rate_limited = 0
+
+        while True:
+            permit = self.limiter.acquire(model, tokens, timeout=remaining_time())
+            try:
+                params["timeout"] = bounded_timeout(timeout)
+            except DeadlineExceeded:
+                # Passed or cancelled while waiting for the limiter
+                self.limiter.release(permit)
                 raise
+            logger.info(f"Sending request to OpenAI API with model: {model}")
+            try:
+                raw_response = self.client.chat.completions.with_raw_response.create(
+                    **params
+                )
+                return raw_response, permit
+            except RateLimitError as e:
+                if is_quota_error(e):
+                    self.limiter.release(permit)
+                    logger.error(f"OpenAI API quota exceeded: {str(e)}")
+                    raise
+                self.limiter.throttled(permit, e.response.headers)
+                rate_limited += 1
+                if rate_limited > RATE_LIMIT_RETRIES:
+                    logger.error(f"OpenAI API rate limit exceeded: {str(e)}")
+                    raise
+            except Exception as e:
+                self.limiter.release(permit)
+                attempt += 1
+                if policy.should_retry(e, attempt):
+                    delay = policy.next_delay(attempt)
+                    logger.warning(
+                        f"OpenAI API request failed (attempt {attempt}/{policy.max_attempts}), "
+                        f"retrying in {delay:.2f} seconds: {str(e)}"
+                    )
+                    time.sleep(delay)
+                    continue
+                if "timeout" in str(e).lower():
+                    logger.error(
+                        f"Request timed out after {params['timeout']} seconds: {str(e)}"
+                    )
+                    raise TimeoutError(
+                        f"OpenAI API request timed out after {params['timeout']} seconds"
+                    )
+                else:
+                    logger.error(f"OpenAI API request failed: {str(e)}")
+                    raise
+
+    def stream_response(
+        self,
+        prompt: str,
+        model: str = "gpt-4.1",
+        images: Optional[List[Path]] = None,
+        temperature: Optional[float] = 0.0,
+        max_tokens: Optional[int] = None,
+        response_format: Optional[dict] = None,
+        timeout: Optional[float] = 120.0,
+        use_cache: bool = True,
+        retry_policy: Optional[RetryPolicy] = None,
+    ) -> Iterator[str]:
+        """
+        Generate a response from OpenAI models, yielding the text as it is
+        generated.
+
+        Failures before the first token are retried as in `get_raw_response`;
+        once text has been yielded the request cannot be retried transparently.
+        A cached response is yielded in one piece, and a completed response is
+        stored in the cache as with `get_response`.
+
+        Args:
+            See `get_response`.
+
+        Yields:
+            str: The successive pieces of the response text.
+
+        Raises:
+            TimeoutError: When the request times out.
+            ValueError: When no content is returned.
+        """
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = response_cache_key(
+                prompt=prompt,
+                model=model,
+                images=images,
+                temperature=0.0,
+                max_tokens=max_tokens,
+                response_format=response_format,
+            )
+            if (content := self.cache.get(cache_key)) is not None:
+                logger.info(f"Response cache hit for request with model: {model}")
+                yield content
+                return
+
+        params = self.build_params(
+            prompt=prompt,
+            model=model,
+            images=images,
+            temperature=0.0,
+            max_tokens=max_tokens,
+            response_format=response_format,
+            timeout=timeout,
+        )
+        params["stream"] = True
+        params["stream_options"] = {"include_usage": True}
+        tokens = estimate_tokens(
+            prompt,
+            len(images or []),
+            max_tokens or self.limiter.expected_completion_tokens(model),
+        )
+
+        raw_response, permit = self._send(params, tokens, retry_policy)
+        usage = None
+        completed = False
+        chunks = []
+        try:
+            with raw_response.parse() as stream:
+                for chunk in stream:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if chunk.choices and (delta := chunk.choices[0].delta.content):
+                        chunks.append(delta)
+                        yield delta
+            completed = True
+        finally:
+            # Also reached when the consumer stops early or the stream breaks,
+            # which only counts as a success once the usage was reported.
+            self.limiter.release(
+                permit,
+                usage.total_tokens if usage else (tokens if completed else None),
+                raw_response.headers,
+                completion_tokens=usage.completion_tokens if usage else None,
+            )
+
+        content = "".join(chunks)
+        if not content:
+            logger.error("No content returned from OpenAI API")
+            raise ValueError("No content returned from OpenAI API")
+
+        logger.info(f"Streamed response from OpenAI API: {record_usage(usage)}")
+        if cache_key:
+            _cache_response(self.cache, cache_key, content, response_format)
 
     def get_response(
         self,
@@ -147,10 +457,20 @@ class OpenAIClient:
         max_tokens: Optional[int] = None,
         response_format: Optional[dict] = None,
         timeout: Optional[float] = 120.0,
+        use_cache: bool = True,
+        retry_policy: Optional[RetryPolicy] = None,
     ) -> str:
         """
         Generate a response from OpenAI models and return the text content.
 
+        Since requests are always sent with temperature 0.0, responses are
+        cached by content (model, prompt, image digests and response format),
+        and an identical request is answered from the cache.
+
+        Inside a hedged stage (see `retry.hedged`), a second identical request
+        is sent when the first one is slower than usual for the stage, and the
+        first response wins.
+
         Args:
             prompt: The text prompt to send to the model.
             model: The OpenAI model to use (default: gpt-4.1).
@@ -159,6 +479,8 @@ class OpenAIClient:
             max_tokens: Maximum number of tokens to generate.
             response_format: Optional response format specification.
             timeout: Request timeout in seconds (default: 60.0).
+            use_cache: Whether the response cache may be used for this request.
+            retry_policy: Optional retry policy. Defaults to the client's policy.
 
         Returns:
             str: The response text from the OpenAI API.
@@ -175,13 +497,35 @@ class OpenAIClient:
             "max_tokens": max_tokens,
             "response_format": response_format,
             "timeout": timeout,
+            "retry_policy": retry_policy,
         }
 
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = response_cache_key(
+                prompt=prompt,
+                model=model,
+                images=images,
+                temperature=0.0,
+                max_tokens=max_tokens,
+                response_format=response_format,
+            )
+            if (content := self.cache.get(cache_key)) is not None:
+                logger.info(f"Response cache hit for request with model: {model}")
+                return content
+
         try:
-            response = self.get_raw_response(**params)
+            if stage := hedged_stage.get():
+                response = call_hedged(
+                    self.get_raw_response, key=f"{stage}:{model}", **params
+                )
+            else:
+                response = self.get_raw_response(**params)
             content = response.choices[0].message.content
 
             if content:
+                if cache_key:
+                    _cache_response(self.cache, cache_key, content, response_format)
                 return content
             else:
                 logger.error("No content returned from OpenAI API")
@@ -193,3 +537,271 @@ class OpenAIClient:
         except Exception as e:
             logger.error(f"Error getting response from OpenAI API: {str(e)}")
             raise
+
+
+class AsyncOpenAIClient:
+    """
+    An asyncio counterpart of `OpenAIClient` for interacting with the OpenAI API.
+
+    Requests share the rate limiter, retry policy and response cache of the
+    synchronous client, so both can be used side by side.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        limiter: Optional[RateLimiter] = None,
+        cache: Union[ResponseCache, NoCache, None] = None,
+        retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ):
+        """
+        Initialize the async OpenAI client.
+
+        Args:
+            api_key: Optional API key. If not provided, it will be loaded from environment variables.
+            limiter: Optional rate limiter. Defaults to the process-wide limiter.
+            cache: Optional response cache. Defaults to the process-wide cache;
+                `NO_CACHE` disables caching.
+            retry_policy: How requests failing with a transient error are retried.
+            http_client: Optional HTTP client. Defaults to a new pooled client
+                with `connection_limits()`.
+        """
+        self.api_key = _resolve_api_key(api_key)
+
+        self.client = AsyncOpenAI(
+            api_key=self.api_key,
+            http_client=http_client
+            or DefaultAsyncHttpxClient(limits=connection_limits()),
+            max_retries=0,
+        )
+        self.limiter = limiter or rate_limiter
+        self.cache = resolve_cache(cache, get_response_cache)
+        self.retry_policy = retry_policy
+        logger.info("Async OpenAI client initialized successfully")
+
+    async def get_raw_response(
+        self,
+        prompt: str,
+        model: str = "gpt-4.1",
+        images: Optional[List[Path]] = None,
+        temperature: Optional[float] = 0.0,
+        max_tokens: Optional[int] = None,
+        response_format: Optional[dict] = None,
+        timeout: Optional[float] = 120.0,
+        retry_policy: Optional[RetryPolicy] = None,
+    ) -> ChatCompletion:
+        """
+        Generate a response from OpenAI models and return the raw API response.
+
+        See `OpenAIClient.get_raw_response` for the arguments, rate limiting
+        and retries.
+
+        Raises:
+            Exception: For API errors or connectivity issues.
+            RateLimitError: When the quota is exhausted or the request is still
+                rate limited after `RATE_LIMIT_RETRIES` retries.
+            TimeoutError: When the request times out.
+            DeadlineExceeded: When the current deadline has passed.
+        """
+        params = OpenAIClient.build_params(
+            prompt=prompt,
+            model=model,
+            images=images,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            response_format=response_format,
+            timeout=timeout,
+        )
+        tokens = estimate_tokens(
+            prompt,
+            len(images or []),
+            max_tokens or self.limiter.expected_completion_tokens(model),
+        )
+
+        raw_response, permit = await self._send(params, tokens, retry_policy)
+        response = None
+        try:
+            response = raw_response.parse()
+        finally:
+            # Also reached when the response cannot be parsed, which does not
+            # count as a success; the estimate only stands in for a missing usage.
+            parsed = response is not None
+            usage = response.usage if parsed else None
+            self.limiter.release(
+                permit,
+                usage.total_tokens if usage else (tokens if parsed else None),
+                raw_response.headers,
+                completion_tokens=usage.completion_tokens if usage else None,
+            )
+        logger.info(
+            f"Received response from OpenAI API: {record_usage(response.usage)}"
+        )
+        return response
+
+    async def _send(
+        self, params: dict, tokens: int, retry_policy: Optional[RetryPolicy] = None
+    ) -> tuple[Any, Permit]:
+        """
+        Send a chat completion request through the rate limiter, retrying
+        rate limit and transient errors.
+
+        Waiting for the rate limiter happens in a worker thread, so other
+        requests on the event loop go on in the meantime.
+
+        Returns:
+            The raw response (from `with_raw_response`), and the rate limiter
+            permit, which the caller releases once the response has been read.
+        """
+        model = params["model"]
+        timeout = params["timeout"]
+        policy = retry_policy or self.retry_policy
+        attempt = 0
+        rate_limited = 0
+
+        while True:
+            permit = await asyncio.to_thread(
+                self.limiter.acquire, model, tokens, timeout=remaining_time()
+            )
+            try:
+                params["timeout"] = bounded_timeout(timeout)
+            except DeadlineExceeded:
+                # Passed or cancelled while waiting for the limiter
+                self.limiter.release(permit)
+                raise
+            logger.info(f"Sending async request to OpenAI API with model: {model}")
+            try:
+                raw_response = (
+                    await self.client.chat.completions.with_raw_response.create(
+                        **params
+                    )
+                )
+                return raw_response, permit
+            except RateLimitError as e:
+                if is_quota_error(e):
+                    self.limiter.release(permit)
+                    logger.error(f"OpenAI API quota exceeded: {str(e)}")
+                    raise
+                self.limiter.throttled(permit, e.response.headers)
+                rate_limited += 1
+                if rate_limited > RATE_LIMIT_RETRIES:
+                    logger.error(f"OpenAI API rate limit exceeded: {str(e)}")
+                    raise
+            except Exception as e:
+                self.limiter.release(permit)
+                attempt += 1
+                if policy.should_retry(e, attempt):
+                    delay = policy.next_delay(attempt)
+                    logger.warning(
+                        f"OpenAI API request failed (attempt {attempt}/{policy.max_attempts}), "
+                        f"retrying in {delay:.2f} seconds: {str(e)}"
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+                if "timeout" in str(e).lower():
+                    logger.error(
+                        f"Request timed out after {params['timeout']} seconds: {str(e)}"
+                    )
+                    raise TimeoutError(
+                        f"OpenAI API request timed out after {params['timeout']} seconds"
+                    )
+                else:
+                    logger.error(f"OpenAI API request failed: {str(e)}")
+                    raise
+
+    async def get_response(
+        self,
+        prompt: str,
+        model: str = "gpt-4.1",
+        images: Optional[List[Path]] = None,
+        temperature: Optional[float] = 0.0,
+        max_tokens: Optional[int] = None,
+        response_format: Optional[dict] = None,
+        timeout: Optional[float] = 120.0,
+        use_cache: bool = True,
+        retry_policy: Optional[RetryPolicy] = None,
+    ) -> str:
+        """
+        Generate a response from OpenAI models and return the text content.
+
+        See `OpenAIClient.get_response` for the arguments and caching; the
+        two clients read and fill the same cache.
+
+        Raises:
+            TimeoutError: When the request times out.
+            ValueError: When no content is returned.
+        """
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = response_cache_key(
+                prompt=prompt,
+                model=model,
+                images=images,
+                temperature=0.0,
+                max_tokens=max_tokens,
+                response_format=response_format,
+            )
+            if (content := self.cache.get(cache_key)) is not None:
+                logger.info(f"Response cache hit for request with model: {model}")
+                return content
+
+        try:
+            response = await self.get_raw_response(
+                prompt=prompt,
+                model=model,
+                images=images,
+                temperature=0.0,
+                max_tokens=max_tokens,
+                response_format=response_format,
+                timeout=timeout,
+                retry_policy=retry_policy,
+            )
+            content = response.choices[0].message.content
+
+            if content:
+                if cache_key:
+                    _cache_response(self.cache, cache_key, content, response_format)
+                return content
+            else:
+                logger.error("No content returned from OpenAI API")
+                raise ValueError("No content returned from OpenAI API")
+        except TimeoutError as e:
+            logger.error(f"Request timed out: {str(e)}")
+            raise
+        except Exception as e:
+            logger.error(f"Error getting response from OpenAI API: {str(e)}")
+            raise
+
+
+_client: Optional[OpenAIClient] = None
+_async_client: Optional[AsyncOpenAIClient] = None
+_client_lock = threading.Lock()
+
+
+def get_openai_client() -> OpenAIClient:
+    """
+    Return the process-wide `OpenAIClient`.
+
+    The client is created on first use and shared by every pipeline stage and
+    Streamlit session, so requests reuse warm connections from its pool.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAIClient()
+        return _client
+
+
+def get_async_openai_client() -> AsyncOpenAIClient:
+    """
+    Return the process-wide `AsyncOpenAIClient`.
+
+    The client and its connection pool are created on first use and shared by
+    every coroutine, so it is meant to be used from the application's event
+    loop.
+    """
+    global _async_client
+    with _client_lock:
+        if _async_client is None:
+            _async_client = AsyncOpenAIClient()
+        return _async_client
@@ -0,0 +1,447 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator, Mapping, Optional
+
+from src.openai.retry import Cancelled, DeadlineExceeded, current_cancellation
+from utils.logger import logger
+
+
+DEFAULT_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+DEFAULT_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "30000"))
+# Upper bound of the number of requests in flight per model. The actual limit
+# adapts between 1 and this value depending on rate limit errors.
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+
+# Rough token cost of the parts of a request whose size is unknown up front.
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 1000
+# Completion tokens expected from a model before any of its responses is seen.
+# Then, requests without `max_tokens` are expected to use the moving average of
+# the model's completions, weighting each new response by COMPLETION_SMOOTHING.
+COMPLETION_TOKENS = 1000
+COMPLETION_SMOOTHING = 0.2
+
+# Default wait after a rate limit error without a Retry-After header.
+DEFAULT_RETRY_AFTER = 1.0
+# How often queued requests that can be cancelled check whether they were.
+CANCELLATION_CHECK_INTERVAL = 0.5
+
+# Requests are queued fairly between sessions (Streamlit sessions, essays of a
+# batch), so one large analysis cannot starve the others.
+current_session: ContextVar[str] = ContextVar("rate_limit_session", default="default")
+
+
+@contextmanager
+def rate_limit_session(name: str) -> Iterator[None]:
+    """
+    Attribute the requests sent inside the block to the session `name`.
+    """
+    token = current_session.set(name)
+    try:
+        yield
+    finally:
+        current_session.reset(token)
+
+
+def estimate_tokens(
+    prompt: str, image_count: int = 0, max_tokens: Optional[int] = None
+) -> int:
+    """
+    Estimate the number of tokens a request will use, before sending it.
+
+    The estimate is reconciled with the actual usage once the response arrives.
+    `max_tokens` bounds the completion; clients pass the completion size
+    expected by `RateLimiter.expected_completion_tokens` when it is not set.
+    """
+    return (
+        len(prompt) // CHARS_PER_TOKEN
+        + image_count * IMAGE_TOKENS
+        + (max_tokens or COMPLETION_TOKENS)
+    )
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a duration from the rate limit headers, e.g. `1s`, `6m0s` or `120ms`.
+
+    Returns:
+        The duration in seconds, or None if it cannot be parsed.
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts:
+        return None
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+def retry_after(headers: Optional[Mapping[str, str]]) -> float:
+    """
+    Seconds to wait after a rate limit error, from its response headers.
+    """
+    if headers:
+        if (value := headers.get("retry-after-ms")) is not None:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+        if (seconds := parse_duration(headers.get("retry-after"))) is not None:
+            return seconds
+    return DEFAULT_RETRY_AFTER
+
+
+class TokenBucket:
+    """
+    A token bucket refilled continuously at `per_minute / 60` tokens per second.
+
+    Not thread-safe on its own; `RateLimiter` guards every bucket with its lock.
+    """
+
+    def __init__(self, per_minute: int, capacity: Optional[float] = None):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.capacity = float(capacity or per_minute)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available."""
+        self.refill()
+        # A request larger than the bucket only needs a full bucket.
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        """Take tokens; the balance goes negative when more were used than estimated."""
+        self.refill()
+        self.tokens -= amount
+
+    def sync(self, limit: Optional[str], remaining: Optional[str]):
+        """
+        Align the bucket with the rate limit headers of a response.
+
+        The limit replaces the configured one, and the balance never exceeds
+        what the API reports as remaining.
+        """
+        if limit and limit.isdigit() and int(limit) != self.per_minute:
+            capacity_ratio = self.capacity / self.per_minute
+            self.per_minute = int(limit)
+            self.rate = self.per_minute / 60.0
+            self.capacity = max(1.0, self.per_minute * capacity_ratio)
+        if remaining and remaining.isdigit():
+            self.refill()
+            self.tokens = min(self.tokens, float(remaining))
+
+
+@dataclass
+class ModelLimits:
+    """
+    Rate limit state of one model: request and token buckets, the adaptive
+    concurrency limit and the pause after a rate limit error.
+    """
+
+    requests: TokenBucket
+    tokens: TokenBucket
+    max_concurrency: int
+    concurrency: float = 0.0
+    in_flight: int = 0
+    paused_until: float = 0.0
+    decreased_at: float = 0.0
+    # Moving average of the completion tokens of the model's responses
+    completion_tokens: float = COMPLETION_TOKENS
+    # Waiting requests, per session, and the order in which sessions are served.
+    queues: dict[str, deque] = field(default_factory=dict)
+    rotation: deque = field(default_factory=deque)
+
+    def __post_init__(self):
+        self.concurrency = self.concurrency or float(self.max_concurrency)
+
+    def wait_time(self, tokens: int) -> Optional[float]:
+        """
+        Seconds until a request of `tokens` tokens can be sent, or None when it
+        has to wait for a request in flight to finish.
+        """
+        if self.in_flight >= max(1, int(self.concurrency)):
+            return None
+        return max(
+            self.paused_until - time.monotonic(),
+            self.requests.wait_time(1),
+            self.tokens.wait_time(tokens),
+        )
+
+
+@dataclass(eq=False)
+class Permit:
+    """
+    Permission to send one request, returned by `RateLimiter.acquire` and
+    handed back to `release` or `throttled` when the request is over.
+    """
+
+    model: str
+    tokens: int
+    session: str
+
+
+class RateLimiter:
+    """
+    A thread-safe limiter of the requests sent to the OpenAI API, shared by the
+    whole process.
+
+    For each model it enforces:
+
+    - requests per minute and tokens per minute, with token buckets that are
+      reconciled with the actual usage of every response and with the
+      `x-ratelimit-*` headers sent by the API;
+    - an adaptive number of requests in flight, halved on every rate limit
+      error (at most once per second) and increased by one every `limit`
+      successful requests, so that it settles just below what the account
+      allows (additive increase, multiplicative decrease).
+
+    Waiting requests are served round robin between sessions, and in order
+    within a session.
+
+    Completion sizes are learned per model, so that requests without
+    `max_tokens` do not reserve more tokens than they are likely to use.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        burst: Optional[int] = None,
+    ):
+        """
+        Initialize the rate limiter.
+
+        Args:
+            requests_per_minute: Requests allowed per minute and model, until
+                the API reports the actual limit.
+            tokens_per_minute: Tokens allowed per minute and model, until the
+                API reports the actual limit.
+            max_concurrency: Maximum number of requests in flight per model.
+            burst: Maximum number of requests that can be sent back to back.
+                Defaults to one second worth of requests (at least 1).
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.burst = burst or max(1, requests_per_minute // 60)
+        self.models: dict[str, ModelLimits] = {}
+        self.condition = threading.Condition()
+
+    def limits(self, model: str) -> ModelLimits:
+        if model not in self.models:
+            self.models[model] = ModelLimits(
+                requests=TokenBucket(self.requests_per_minute, self.burst),
+                tokens=TokenBucket(self.tokens_per_minute),
+                max_concurrency=self.max_concurrency,
+            )
+        return self.models[model]
+
+    def expected_completion_tokens(self, model: str) -> int:
+        """Completion tokens a request to `model` is expected to use."""
+        with self.condition:
+            return round(self.limits(model).completion_tokens)
+
+    def acquire(
+        self,
+        model: str,
+        tokens: int = 0,
+        session: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Permit:
+        """
+        Block until a request to `model` is allowed to be sent.
+
+        Args:
+            model: The model the request is sent to.
+            tokens: Estimated number of tokens of the request.
+            session: The session the request belongs to. Defaults to the
+                current `rate_limit_session`.
+            timeout: Maximum number of seconds to wait, e.g. until a deadline.
+
+        Returns:
+            Permit: To be passed to `release` or `throttled` afterwards.
+
+        Raises:
+            DeadlineExceeded: When the request could not be sent within `timeout`.
+            Cancelled: When the current work is cancelled while waiting (see
+                `retry.cancellation`).
+        """
+        permit = Permit(model, tokens, session or current_session.get())
+        cancelled = current_cancellation.get()
+        expires_at = None if timeout is None else time.monotonic() + timeout
+
+        with self.condition:
+            limits = self.limits(model)
+            if permit.session not in limits.queues:
+                limits.queues[permit.session] = deque()
+                limits.rotation.append(permit.session)
+            limits.queues[permit.session].append(permit)
+
+            try:
+                waited = False
+                while True:
+                    head = limits.queues[limits.rotation[0]][0]
+                    if head is permit:
+                        wait = limits.wait_time(tokens)
+                        if wait is not None and wait <= 0:
+                            break
+                    else:
+                        wait = None
+
+                    if expires_at is not None:
+                        left = expires_at - time.monotonic()
+                        if left <= 0:
+                            raise DeadlineExceeded(
+                                f"Rate limited on {model} until the deadline"
+                            )
+                        wait = left if wait is None else min(wait, left)
+                    if cancelled is not None:
+                        if cancelled.is_set():
+                            raise Cancelled(f"Cancelled while rate limited on {model}")
+                        if wait is None or wait > CANCELLATION_CHECK_INTERVAL:
+                            wait = CANCELLATION_CHECK_INTERVAL
+
+                    if not waited:
+                        logger.debug(f"Rate limit reached for {model}, request queued")
+                        waited = True
+                    self.condition.wait(timeout=wait)
+            finally:
+                # Leave the queue, also when interrupted while waiting.
+                self._dequeue(limits, permit)
+                self.condition.notify_all()
+
+            limits.requests.consume(1)
+            limits.tokens.consume(tokens)
+            limits.in_flight += 1
+
+        return permit
+
+    @staticmethod
+    def _dequeue(limits: ModelLimits, permit: Permit):
+        queue = limits.queues[permit.session]
+        queue.remove(permit)
+        if limits.rotation[0] == permit.session:
+            # The session was served: it goes to the back of the rotation.
+            limits.rotation.popleft()
+            if queue:
+                limits.rotation.append(permit.session)
+        elif not queue:
+            limits.rotation.remove(permit.session)
+        if not queue:
+            del limits.queues[permit.session]
+
+    def release(
+        self,
+        permit: Permit,
+        used_tokens: Optional[int] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        completion_tokens: Optional[int] = None,
+    ):
+        """
+        Report that a request is over.
+
+        Args:
+            permit: The permit of the request.
+            used_tokens: Actual number of tokens used, from the response usage.
+                None when the request failed without using any.
+            headers: Response headers carrying the current rate limits.
+            completion_tokens: Completion tokens of the response, when known.
+        """
+        with self.condition:
+            limits = self.limits(permit.model)
+            limits.in_flight -= 1
+            limits.tokens.consume((used_tokens or 0) - permit.tokens)
+
+            if completion_tokens is not None:
+                limits.completion_tokens += COMPLETION_SMOOTHING * (
+                    completion_tokens - limits.completion_tokens
+                )
+
+            if headers:
+                limits.requests.sync(
+                    headers.get("x-ratelimit-limit-requests"),
+                    headers.get("x-ratelimit-remaining-requests"),
+                )
+                limits.tokens.sync(
+                    headers.get("x-ratelimit-limit-tokens"),
+                    headers.get("x-ratelimit-remaining-tokens"),
+                )
+
+            if used_tokens is not None and limits.concurrency < limits.max_concurrency:
+                limits.concurrency = min(
+                    limits.max_concurrency, limits.concurrency + 1 / limits.concurrency
+                )
+            self.condition.notify_all()
+
+    def throttled(self, permit: Permit, headers: Optional[Mapping[str, str]] = None):
+        """
+        Report that a request was rejected with a rate limit error.
+
+        Requests to the model are paused for the delay asked by the API, and
+        the number of requests in flight is halved.
+        """
+        delay = retry_after(headers)
+        with self.condition:
+            limits = self.limits(permit.model)
+            limits.in_flight -= 1
+            limits.tokens.consume(-permit.tokens)
+
+            now = time.monotonic()
+            limits.paused_until = max(limits.paused_until, now + delay)
+            # Requests in flight when the limit was hit fail together, and
+            # should only count as one signal.
+            if now - limits.decreased_at >= 1.0:
+                limits.concurrency = max(1.0, limits.concurrency / 2)
+                limits.decreased_at = now
+            logger.warning(
+                f"Rate limited by OpenAI on {permit.model}: pausing {delay:.2f} seconds, "
+                f"concurrency limit now {int(limits.concurrency)}"
+            )
+            self.condition.notify_all()
+
+    def stats(self) -> dict[str, dict]:
+        """Current state of every model, for monitoring."""
+        with self.condition:
+            stats = {}
+            for model, limits in self.models.items():
+                limits.tokens.refill()
+                limits.requests.refill()
+                stats[model] = {
+                    "concurrency": int(limits.concurrency),
+                    "in_flight": limits.in_flight,
+                    "queued": sum(len(queue) for queue in limits.queues.values()),
+                    "requests_per_minute": limits.requests.per_minute,
+                    "tokens_per_minute": limits.tokens.per_minute,
+                    "tokens_available": int(limits.tokens.tokens),
+                    "expected_completion_tokens": round(limits.completion_tokens),
+                }
+            return stats
+
+
+# Shared by every client in the process so that concurrent pipelines and
+# Streamlit sessions draw from the same budget.
+rate_limiter = RateLimiter()
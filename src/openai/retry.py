@@ -0,0 +1,280 @@
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Optional
+
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    RateLimitError,
+)
+
+from utils.logger import logger
+
+
+# Retry settings of requests to the OpenAI API.
+RETRY_MAX_ATTEMPTS = int(os.getenv("OPENAI_RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "20"))
+
+# Hedging: a second, identical request is sent when the first one has been
+# running for longer than this percentile of the recent latencies of its stage.
+HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE", "95"))
+# Latencies needed before a stage is hedged, and how many are kept.
+HEDGE_MIN_SAMPLES = int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = 200
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors.
+RETRYABLE_STATUSES = {408, 409, 429}
+
+# Monotonic time by which the current stage or pipeline must be done.
+current_deadline: ContextVar[Optional[float]] = ContextVar(
+    "current_deadline", default=None
+)
+# Set once the work of the current context is no longer needed, e.g. when a
+# sibling stage failed.
+current_cancellation: ContextVar[Optional[threading.Event]] = ContextVar(
+    "current_cancellation", default=None
+)
+# Name of the latency-critical stage whose requests are hedged, if any.
+hedged_stage: ContextVar[Optional[str]] = ContextVar("hedged_stage", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a stage or pipeline deadline has passed.
+    """
+
+
+class Cancelled(DeadlineExceeded):
+    """
+    Raised when the work of the current context was cancelled, which ends it
+    like a deadline that has passed.
+    """
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Bound the time spent inside the block to `seconds`.
+
+    Deadlines nest: an inner deadline cannot extend an outer one. Requests sent
+    inside the block get their timeouts and retries cut to the time left.
+    """
+    if seconds is None:
+        yield
+        return
+
+    expires_at = time.monotonic() + seconds
+    outer = current_deadline.get()
+    token = current_deadline.set(expires_at if outer is None else min(outer, expires_at))
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+@contextmanager
+def cancellation(event: threading.Event) -> Iterator[None]:
+    """
+    Cancel the requests sent inside the block, including from threads started
+    with a copy of its context, once `event` is set.
+
+    Requests already sent are not interrupted, but no further request, retry
+    or wait for the rate limiter starts.
+    """
+    token = current_cancellation.set(event)
+    try:
+        yield
+    finally:
+        current_cancellation.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """
+    Seconds left before the current deadline, or None without a deadline.
+
+    Raises:
+        Cancelled: When the current work was cancelled.
+        DeadlineExceeded: When the deadline has already passed.
+    """
+    cancelled = current_cancellation.get()
+    if cancelled is not None and cancelled.is_set():
+        raise Cancelled("Cancelled")
+    expires_at = current_deadline.get()
+    if expires_at is None:
+        return None
+    remaining = expires_at - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Deadline exceeded")
+    return remaining
+
+
+def bounded_timeout(timeout: Optional[float]) -> Optional[float]:
+    """
+    A request timeout that does not go past the current deadline.
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+@contextmanager
+def hedged(stage: Optional[str]) -> Iterator[None]:
+    """
+    Hedge the requests sent inside the block, tracking their latencies under
+    the name `stage`.
+    """
+    token = hedged_stage.set(stage)
+    try:
+        yield
+    finally:
+        hedged_stage.reset(token)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Whether a failed request is worth sending again.
+
+    Timeouts, connection errors, rate limits (except an exhausted quota) and
+    server errors are transient; other errors (invalid request, authentication,
+    content) would fail the same way again.
+    """
+    if isinstance(error, DeadlineExceeded):
+        return False
+    if isinstance(error, RateLimitError):
+        return getattr(error, "code", None) != "insufficient_quota"
+    if isinstance(error, (APITimeoutError, APIConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUSES or error.status_code >= 500
+    return False
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How failed requests are retried: up to `max_attempts` attempts in total,
+    waiting a random delay between 0 and `base_delay * 2 ** (attempt - 1)`
+    (capped at `max_delay`) between two attempts ("full jitter", which keeps
+    clients that failed together from retrying together).
+    """
+
+    max_attempts: int = RETRY_MAX_ATTEMPTS
+    base_delay: float = RETRY_BASE_DELAY
+    max_delay: float = RETRY_MAX_DELAY
+    retryable: Callable[[BaseException], bool] = is_retryable
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before retrying after the failed attempt number `attempt`."""
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        )
+
+    def should_retry(self, error: BaseException, attempt: int) -> bool:
+        return attempt < self.max_attempts and self.retryable(error)
+
+    def next_delay(self, attempt: int) -> float:
+        """
+        Delay before the attempt following the failed attempt number `attempt`.
+
+        Raises:
+            DeadlineExceeded: When the deadline would pass before the next attempt.
+        """
+        delay = self.backoff(attempt)
+        remaining = remaining_time()
+        if remaining is not None and remaining <= delay:
+            raise DeadlineExceeded("Deadline exceeded before the next attempt")
+        return delay
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+class LatencyTracker:
+    """
+    Keeps the recent latencies of each hedged stage, to know when a request
+    has become slower than usual.
+    """
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self.latencies: dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self.lock = threading.Lock()
+
+    def record(self, key: str, seconds: float):
+        with self.lock:
+            self.latencies[key].append(seconds)
+
+    def percentile(
+        self, key: str, percentile: float, min_samples: int = HEDGE_MIN_SAMPLES
+    ) -> Optional[float]:
+        """
+        The given percentile of the recent latencies of `key`, or None while
+        fewer than `min_samples` are known.
+        """
+        with self.lock:
+            samples = sorted(self.latencies[key])
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return samples[index]
+
+
+latency_tracker = LatencyTracker()
+# Shared by the hedged requests of the whole process.
+_hedge_executor = ThreadPoolExecutor(thread_name_prefix="hedge")
+
+
+def call_hedged(
+    func: Callable[..., Any],
+    *args,
+    key: str,
+    percentile: float = HEDGE_PERCENTILE,
+    tracker: LatencyTracker = latency_tracker,
+    **kwargs,
+) -> Any:
+    """
+    Call `func`, and call it a second time if the first call is still running
+    after the `percentile` latency of `key`. The first successful result wins;
+    the other call runs to completion in the background and is discarded.
+
+    Until enough latencies of `key` are known, `func` is only called once.
+    """
+    start = time.monotonic()
+    hedge_after = tracker.percentile(key, percentile)
+    if hedge_after is None:
+        result = func(*args, **kwargs)
+        tracker.record(key, time.monotonic() - start)
+        return result
+
+    futures: list[Future] = [
+        _hedge_executor.submit(copy_context().run, func, *args, **kwargs)
+    ]
+    done, _ = wait(futures, timeout=hedge_after)
+    if not done:
+        logger.info(
+            f"Request of {key} slower than {hedge_after:.2f} seconds, sending a hedged request"
+        )
+        futures.append(_hedge_executor.submit(copy_context().run, func, *args, **kwargs))
+
+    pending = set(futures)
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                tracker.record(key, time.monotonic() - start)
+                if len(futures) > 1:
+                    winner = "hedged" if future is futures[1] else "original"
+                    logger.info(f"The {winner} request of {key} finished first")
+                return future.result()
+            error = error or future.exception()
+    raise error
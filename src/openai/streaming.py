@@ -0,0 +1,97 @@
+import re
+
+
+class JsonStringStream:
+    """
+    Extracts the value of a string field from a JSON object while the object
+    is being streamed, so that a JSON-mode response can be shown as it is
+    generated.
+
+    Example:
+        extractor = JsonStringStream("general_comment")
+        for chunk in openai_client.stream_response(prompt, response_format=...):
+            print(extractor.feed(chunk), end="")
+    """
+
+    ESCAPES = {
+        '"': '"',
+        "\\": "\\",
+        "/": "/",
+        "b": "\b",
+        "f": "\f",
+        "n": "\n",
+        "r": "\r",
+        "t": "\t",
+    }
+
+    def __init__(self, key: str):
+        self.pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(key))
+        self.buffer = ""
+        # Position in the buffer of the next character of the value to decode
+        self.position = None
+        self.done = False
+        self.parts: list[str] = []
+
+    @property
+    def value(self) -> str:
+        """The part of the value decoded so far."""
+        return "".join(self.parts)
+
+    def feed(self, chunk: str) -> str:
+        """
+        Add a chunk of the JSON text.
+
+        Returns:
+            str: The newly decoded part of the value, possibly empty.
+        """
+        self.buffer += chunk
+        if self.done:
+            return ""
+
+        if self.position is None:
+            match = self.pattern.search(self.buffer)
+            if not match:
+                return ""
+            self.position = match.end()
+
+        buffer = self.buffer
+        index = self.position
+        decoded = []
+        while index < len(buffer):
+            char = buffer[index]
+            if char == '"':
+                self.done = True
+                index += 1
+                break
+            if char != "\\":
+                decoded.append(char)
+                index += 1
+                continue
+
+            # Escape sequences split across chunks are decoded with the next chunk
+            if index + 1 >= len(buffer):
+                break
+            escape = buffer[index + 1]
+            if escape != "u":
+                decoded.append(self.ESCAPES.get(escape, escape))
+                index += 2
+                continue
+
+            if index + 6 > len(buffer):
+                break
+            code = int(buffer[index + 2 : index + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                # High surrogate, combined with the low surrogate that follows
+                if index + 12 > len(buffer):
+                    break
+                low = int(buffer[index + 8 : index + 12], 16)
+                decoded.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                index += 12
+            else:
+                decoded.append(chr(code))
+                index += 6
+
+        self.position = index
+        text = "".join(decoded)
+        self.parts.append(text)
+        return text
@@ -0,0 +1,132 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Iterator, Optional
+
+
+@dataclass
+class TokenUsage:
+    """
+    Token counts of a set of requests, and the lookups of the response caches
+    that saved requests.
+
+    `cached_tokens` are the prompt tokens served from the API's prompt cache,
+    which happens when a prompt starts with the same 1024+ tokens as a recent
+    one. They are billed at a discount and processed faster.
+    """
+
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    # (hits, misses) of each response cache, by cache name
+    cache_lookups: dict[str, list[int]] = field(default_factory=dict)
+    # Enclosing `track_usage` block, which counts the same requests
+    parent: Optional["TokenUsage"] = field(default=None, repr=False, compare=False)
+    lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    @property
+    def cache_rate(self) -> float:
+        """Fraction of the prompt tokens that were cached."""
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def add(self, prompt_tokens: int, cached_tokens: int, completion_tokens: int):
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.completion_tokens += completion_tokens
+
+    def add_cache_lookup(self, cache: str, hit: bool):
+        with self.lock:
+            lookups = self.cache_lookups.setdefault(cache, [0, 0])
+            lookups[0 if hit else 1] += 1
+
+    def as_dict(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cache_rate": round(self.cache_rate, 4),
+                "response_caches": {
+                    cache: {
+                        "hits": hits,
+                        "misses": misses,
+                        "hit_rate": round(hits / (hits + misses), 4),
+                    }
+                    for cache, (hits, misses) in self.cache_lookups.items()
+                },
+            }
+
+
+# Usage of the requests sent in the current `track_usage` block, if any.
+current_usage: ContextVar[Optional[TokenUsage]] = ContextVar(
+    "current_usage", default=None
+)
+# Usage of every request sent by the process.
+total_usage = TokenUsage()
+
+
+@contextmanager
+def track_usage() -> Iterator[TokenUsage]:
+    """
+    Count the tokens of the requests sent inside the block, including those
+    sent from worker threads that copy the context. Blocks can be nested, the
+    requests of an inner block being counted by the outer ones as well.
+
+    Example:
+        with track_usage() as usage:
+            pipeline.run(...)
+        print(usage.cached_tokens)
+    """
+    usage = TokenUsage(parent=current_usage.get())
+    token = current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        current_usage.reset(token)
+
+
+def record_usage(usage: Any) -> str:
+    """
+    Record the `usage` of an API response (a `CompletionUsage`), in the
+    process totals and in the current `track_usage` block.
+
+    Returns:
+        A description of the usage for the log of the request.
+    """
+    if usage is None:
+        return "no usage reported"
+
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details else 0
+    prompt_tokens = usage.prompt_tokens or 0
+    completion_tokens = usage.completion_tokens or 0
+
+    total_usage.add(prompt_tokens, cached_tokens, completion_tokens)
+    tracked = current_usage.get()
+    while tracked is not None:
+        tracked.add(prompt_tokens, cached_tokens, completion_tokens)
+        tracked = tracked.parent
+
+    return (
+        f"{usage.total_tokens} tokens used "
+        f"({cached_tokens}/{prompt_tokens} prompt tokens cached)"
+    )
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    """
+    Record a lookup of the response cache named `cache`, in the process totals
+    and in the current `track_usage` block.
+    """
+    total_usage.add_cache_lookup(cache, hit)
+    tracked = current_usage.get()
+    while tracked is not None:
+        tracked.add_cache_lookup(cache, hit)
+        tracked = tracked.parent
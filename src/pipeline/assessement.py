@@ -1,15 +1,24 @@
+import contextvars
 import json
-import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable, Optional
 
 from utils.logger import logger
 from src.openai.client import OpenAIClient
-
-PRE_SCORING_PROMPT_PATH = Path(
-    "prompts/stages/2-assessement/pre-scoring-assessement-prompt.md"
+from src.pipeline.prompts import (
+    CRITERIA_DIR,
+    PROMPTS_DIR,
+    PromptRegistry,
+    get_prompt_registry,
 )
-SCORING_PROMPT_PATH = Path("prompts/stages/2-assessement/scoring-assessement-prompt.md")
-GENERAL_COMMENT_PROMPT_PATH = Path("prompts/stages/5-final-comments/general-comment.md")
+
+PRE_SCORING_PROMPT_PATH = CRITERIA_DIR / "pre-scoring-assessement-prompt.md"
+SCORING_PROMPT_PATH = CRITERIA_DIR / "scoring-assessement-prompt.md"
+GENERAL_COMMENT_PROMPT_PATH = PROMPTS_DIR / "5-final-comments/general-comment.md"
+
+# Number of criteria that are sent to the OpenAI API at the same time.
+MAX_CONCURRENCY = 4
 
 
 class Assessment:
@@ -23,6 +32,8 @@ class Assessment:
         pre_scoring_prompt_path: Path = PRE_SCORING_PROMPT_PATH,
         scoring_prompt_path: Path = SCORING_PROMPT_PATH,
         general_comment_prompt_path: Path = GENERAL_COMMENT_PROMPT_PATH,
+        max_concurrency: int = MAX_CONCURRENCY,
+        prompts: Optional[PromptRegistry] = None,
     ):
         self.criterions = [
             "content",
@@ -32,146 +43,204 @@ class Assessment:
         ]
 
         self.task = task
+        self.max_concurrency = max(1, max_concurrency)
 
-        with open(pre_scoring_prompt_path, "r", encoding="utf-8") as file:
-            self.pre_scoring_assessment_prompt = file.read()
-
-        with open(scoring_prompt_path, "r", encoding="utf-8") as file:
-            self.scoring_assessment_prompt = file.read()
-
-        with open(general_comment_prompt_path, "r", encoding="utf-8") as file:
-            self.general_comment_prompt = file.read()
+        # Templates are loaded once per process by the registry, and looked up
+        # on every use so that edited prompts are picked up.
+        self.prompts = prompts or get_prompt_registry()
+        self.pre_scoring_prompt_path = pre_scoring_prompt_path
+        self.scoring_prompt_path = scoring_prompt_path
+        self.general_comment_prompt_path = general_comment_prompt_path
 
         logger.info("Initialized Assessement")
 
-    def pre_scoring_assessment(
+    def build_pre_scoring_prompt(
         self,
+        criterion: str,
         task_understanding: str,
         candidate_solution: str,
-        openai_client: OpenAIClient,
-    ) -> dict[str, str]:
+    ) -> str:
         """
-        Before scoring the assessment, we need to get a detailed analysis of
-        the candidate's performance on each criterion.
-
-        This function will return a dictionary of criterion names as keys and
-        analysis as values.
+        Build the pre-scoring analysis prompt for a single criterion.
         """
+        criterion_definition = self.prompts.get(
+            CRITERIA_DIR / criterion / "definition.md"
+        ).text
+
+        return self.prompts.render(
+            self.pre_scoring_prompt_path,
+            {
+                "Criterion": criterion,
+                "Criterion-definition": criterion_definition,
+                "Task": self.task,
+                "Task-Understanding": task_understanding,
+                "Candidates-Solution": candidate_solution,
+            },
+        )
 
-        pre_scoring_prompt = self.pre_scoring_assessment_prompt
-
-        analysis = {}
-        for criterion in self.criterions:
-            criterion_prompt = pre_scoring_prompt.replace("{Criterion}", criterion)
-
-            criterion_definition_path = Path(
-                f"prompts/stages/2-assessement/{criterion}/definition.md"
-            )
-
-            with open(criterion_definition_path, "r", encoding="utf-8") as file:
-                criterion_definition = file.read()
-
-            criterion_prompt = criterion_prompt.replace(
-                "{Criterion-definition}",
-                criterion_definition,
-            )
-
-            criterion_prompt = criterion_prompt.replace(
-                "{Task}",
-                self.task,
-            )
-
-            criterion_prompt = criterion_prompt.replace(
-                "{Task-Understanding}",
-                task_understanding,
-            )
+    def analyse_criterion(
+        self,
+        criterion: str,
+        task_understanding: str,
+        candidate_solution: str,
+        openai_client: OpenAIClient,
+    ) -> str:
+        """
+        Get the pre-scoring analysis of the candidate's performance on a
+        single criterion.
+        """
+        logger.info(f"Starting pre-scoring analysis for criterion: {criterion}")
 
-            criterion_prompt = criterion_prompt.replace(
-                "{Candidates-Solution}",
-                candidate_solution,
-            )
+        criterion_prompt = self.build_pre_scoring_prompt(
+            criterion=criterion,
+            task_understanding=task_understanding,
+            candidate_solution=candidate_solution,
+        )
 
-            response = openai_client.get_response(
-                criterion_prompt, response_format={"type": "json_object"}
-            )
+        response = openai_client.get_response(
+            criterion_prompt, response_format={"type": "json_object"}
+        )
 
-            response_dict = json.loads(response)
-            analysis[criterion] = response_dict.get("analysis", "No analysis found")
+        response_dict = json.loads(response)
+        return response_dict.get("analysis", "No analysis found")
 
-        return analysis
+    def build_scoring_prompt(
+        self,
+        criterion: str,
+        criterion_analysis: str,
+        task_description: str,
+    ) -> str:
+        """
+        Build the scoring prompt for a single criterion.
+        """
+        criterion_descriptor = self.prompts.get(
+            CRITERIA_DIR / criterion / "descriptor.md"
+        ).text
+
+        return self.prompts.render(
+            self.scoring_prompt_path,
+            {
+                "Task-Description": task_description,
+                "Criterion-descriptor": criterion_descriptor,
+                "Criterion": criterion,
+                "Analysis": criterion_analysis,
+            },
+        )
 
-    def get_criterion_scores(
+    def score_criterion(
         self,
-        analysis: dict[str, str],
+        criterion: str,
+        criterion_analysis: str,
         task_description: str,
         openai_client: OpenAIClient,
         model: str = "gpt-4.1",
-    ) -> dict[str, tuple[int, str]]:
+    ) -> tuple[int, str]:
+        """
+        Get the score and justification for a single criterion from its
+        pre-scoring analysis.
         """
-        Get the score for a specific criterion.
+        logger.info(f"Starting scoring process for criterion: {criterion}")
 
-        This function will return a dictionary of criterion names as keys and
-        scores and justifications as values.
+        criterion_scoring_prompt = self.build_scoring_prompt(
+            criterion=criterion,
+            criterion_analysis=criterion_analysis,
+            task_description=task_description,
+        )
 
-        The idea behind this is that an LLM can infer a score for an analysis of a
-        certain criterion. For this we do not need to provide the tasks context since
-        the score should be based on the analysis alone.
-        """
+        logger.debug(
+            f"Constructed scoring prompt for {criterion} ({len(criterion_scoring_prompt)} chars)"
+        )
+        logger.info(f"Requesting score evaluation for '{criterion}' criterion")
 
-        scoring_prompt = self.scoring_assessment_prompt
-        scoring_prompt = scoring_prompt.replace("{Task-Description}", task_description)
+        response = openai_client.get_response(
+            criterion_scoring_prompt,
+            response_format={"type": "json_object"},
+            model=model,
+        )
 
-        scores = {}
-        for criterion, criterion_analysis in analysis.items():
-            logger.info(f"Starting scoring process for criterion: {criterion}")
+        response_dict = json.loads(response)
+        score = response_dict.get("score", 0)
+        justification = response_dict.get("justification", "No justification found")
 
-            criterion_descriptor_path = Path(
-                f"prompts/stages/2-assessement/{criterion}/descriptor.md"
-            )
+        logger.info(f"Received score for {criterion}: {score}/5")
+        logger.debug(
+            f"Justification length for {criterion}: {len(justification)} chars"
+        )
 
-            with open(criterion_descriptor_path, "r", encoding="utf-8") as file:
-                criterion_descriptor = file.read()
-                logger.debug(
-                    f"Loaded descriptor for {criterion} ({len(criterion_descriptor)} chars)"
-                )
+        return score, justification
 
-            criterion_scoring_prompt = scoring_prompt.replace(
-                "{Criterion-descriptor}",
-                criterion_descriptor,
-            )
+    def assess_criteria(
+        self,
+        task_understanding: str,
+        candidate_solution: str,
+        openai_client: OpenAIClient,
+        model: str = "gpt-4.1",
+        on_assessed: Optional[Callable[[str], None]] = None,
+    ) -> tuple[dict[str, str], dict[str, tuple[int, str]]]:
+        """
+        Analyse and score every criterion.
 
-            criterion_scoring_prompt = criterion_scoring_prompt.replace(
-                "{Criterion}", criterion
-            )
+        Each criterion is handled by its own worker, so its scoring starts as
+        soon as its own analysis is ready instead of waiting for the analyses
+        of the other criteria. `on_assessed` is called with the name of each
+        criterion once it is scored, from the worker that scored it.
 
-            criterion_scoring_prompt = criterion_scoring_prompt.replace(
-                "{Analysis}", criterion_analysis
-            )
+        Returns:
+            A dictionary with the analysis for each criterion.
+            A dictionary with the score and justification for each criterion.
+        """
 
-            logger.debug(
-                f"Constructed scoring prompt for {criterion} ({len(criterion_scoring_prompt)} chars)"
+        def assess(criterion: str) -> tuple[str, tuple[int, str]]:
+            criterion_analysis = self.analyse_criterion(
+                criterion=criterion,
+                task_understanding=task_understanding,
+                candidate_solution=candidate_solution,
+                openai_client=openai_client,
             )
-            logger.info(f"Requesting score evaluation for '{criterion}' criterion")
-
-            response = openai_client.get_response(
-                criterion_scoring_prompt,
-                response_format={"type": "json_object"},
+            criterion_score = self.score_criterion(
+                criterion=criterion,
+                criterion_analysis=criterion_analysis,
+                task_description=self.task,
+                openai_client=openai_client,
                 model=model,
             )
+            if on_assessed:
+                on_assessed(criterion)
+            return criterion_analysis, criterion_score
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {
+                criterion: executor.submit(
+                    contextvars.copy_context().run, assess, criterion
+                )
+                for criterion in self.criterions
+            }
 
-            response_dict = json.loads(response)
-            score = response_dict.get("score", 0)
-            justification = response_dict.get("justification", "No justification found")
+            analysis = {}
+            scores = {}
+            for criterion, future in futures.items():
+                analysis[criterion], scores[criterion] = future.result()
 
-            logger.info(f"Received score for {criterion}: {score}/5")
-            logger.debug(
-                f"Justification length for {criterion}: {len(justification)} chars"
-            )
+        return analysis, scores
 
-            scores[criterion] = (score, justification)
-            time.sleep(1)
-
-        return scores
+    def build_general_comment_prompt(
+        self,
+        task_understanding: str,
+        candidate_solution: str,
+        criterion_scores: dict[str, tuple[int, str]],
+    ) -> str:
+        """
+        Build the general comment prompt from the criterion scores.
+        """
+        return self.prompts.render(
+            self.general_comment_prompt_path,
+            {
+                "Task": self.task,
+                "Candidates-Solution": candidate_solution,
+                "Task-Understanding": task_understanding,
+                "Criterion-Scores": json.dumps(criterion_scores),
+            },
+        )
 
     def get_general_comment(
         self,
@@ -185,26 +254,10 @@ class Assessment:
         criterion scores.
         """
 
-        general_comment_prompt = self.general_comment_prompt
-
-        general_comment_prompt = general_comment_prompt.replace(
-            "{Task}",
-            self.task,
-        )
-
-        general_comment_prompt = general_comment_prompt.replace(
-            "{Candidates-Solution}",
-            candidate_solution,
-        )
-
-        general_comment_prompt = general_comment_prompt.replace(
-            "{Task-Understanding}",
-            task_understanding,
-        )
-
-        general_comment_prompt = general_comment_prompt.replace(
-            "{Criterion-Scores}",
-            json.dumps(criterion_scores),
+        general_comment_prompt = self.build_general_comment_prompt(
+            task_understanding=task_understanding,
+            candidate_solution=candidate_solution,
+            criterion_scores=criterion_scores,
         )
 
         response = openai_client.get_response(
@@ -0,0 +1,350 @@
+import json
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+
+from src.ocr.ocr import OCR, OCR_PROMPT
+from src.ocr.pdf import iter_page_images
+from src.openai.batch import BatchClient, BatchRequests
+from src.pipeline.assessement import Assessment
+from src.pipeline.main_pipe import Pipeline
+from utils.logger import log_time, logger
+
+# Every other custom id starts with `<student_id>/`, so this one cannot clash.
+TASK_UNDERSTANDING_ID = "task_understanding"
+
+
+class BatchPipelineRunner:
+    """
+    Grades many essays answering the same task through the OpenAI Batch API.
+
+    Instead of running each essay's pipeline on its own, every request a stage
+    would send is collected for all essays and sent as one batch job, stage
+    after stage:
+
+    1. OCR of every page (and the shared task understanding)
+    2. Pre-scoring analysis of every criterion
+    3. Scoring of every criterion
+    4. General comment and detailed analysis
+    5. Encouraging comment
+
+    The prompts are built by `Pipeline` and `Assessment`, and each essay's
+    outputs are logged through its own `PipelineLogger` as usual.
+    """
+
+    def __init__(self, task: str, batch_client: Optional[BatchClient] = None):
+        self.task = task
+        self.batch_client = batch_client or BatchClient()
+        self.assessment = Assessment(task=task)
+        self.pipelines: dict[str, Pipeline] = {}
+        self.values: dict[str, dict[str, Any]] = {}
+        self.errors: dict[str, str] = {}
+
+    @property
+    def active(self) -> list[str]:
+        """Students whose grading has not failed so far."""
+        return [student for student in self.pipelines if student not in self.errors]
+
+    def fail(self, student_id: str, message: str):
+        logger.error(f"Grading failed for {student_id}: {message}")
+        self.errors.setdefault(student_id, message)
+
+    def send(self, stage: str, requests: BatchRequests) -> dict[str, str]:
+        """
+        Run the requests of one stage and record failed students.
+
+        Custom ids are `<student_id>/<stage>[/<item>]`. A failed task
+        understanding request fails every student.
+        """
+        with log_time(f"Batch stage {stage} ({len(requests)} requests)"):
+            results, errors = self.batch_client.run(requests)
+
+        for custom_id, error in errors.items():
+            if custom_id == TASK_UNDERSTANDING_ID:
+                for student_id in self.active:
+                    self.fail(student_id, f"Task understanding failed: {error}")
+                continue
+            student_id = custom_id.split("/")[0]
+            self.fail(student_id, f"{stage} request {custom_id} failed: {error}")
+
+        return results
+
+    def parse(
+        self, student_id: str, response: Optional[str], key: str, default: Any
+    ) -> Any:
+        """Read `key` from a JSON response, failing the student when it is invalid."""
+        if response is None:
+            return default
+        try:
+            return json.loads(response).get(key, default)
+        except (json.JSONDecodeError, AttributeError) as e:
+            self.fail(student_id, f"Invalid JSON response: {str(e)}")
+            return default
+
+    def run(self, submissions: dict[str, list[Path]]) -> dict[str, dict[str, Any]]:
+        """
+        Grade every submission.
+
+        Args:
+            submissions: A dictionary mapping student ids to their files.
+
+        Returns:
+            For each student, either the pipeline outputs (`general_comment`,
+            `criterion_scores`, `detailed_analysis`, `encouraging_comment` and
+            `run_id`) or an `error`.
+        """
+        for student_id in submissions:
+            if "/" in student_id:
+                raise ValueError(f"Student ids cannot contain '/': {student_id}")
+            self.pipelines[student_id] = Pipeline(task=self.task)
+            self.values[student_id] = {}
+
+        with tempfile.TemporaryDirectory() as work_dir:
+            task_understanding = self.understand_solutions(submissions, Path(work_dir))
+
+        self.assess(task_understanding)
+        self.comment(task_understanding)
+        self.encourage()
+
+        results = {}
+        for student_id, pipeline in self.pipelines.items():
+            if student_id in self.errors:
+                results[student_id] = {"error": self.errors[student_id]}
+                continue
+            pipeline.pipeline_logger.complete_run()
+            values = self.values[student_id]
+            results[student_id] = {
+                "run_id": pipeline.pipeline_logger.run_id,
+                "general_comment": values["general_comment"],
+                "criterion_scores": values["criterion_scores"],
+                "detailed_analysis": values["detailed_analysis"],
+                "encouraging_comment": values["encouraging_comment"],
+            }
+        return results
+
+    def understand_solutions(
+        self, submissions: dict[str, list[Path]], work_dir: Path
+    ) -> str:
+        """
+        OCR every page and get the task understanding in the same batch.
+
+        Pages are prepared and cached as in `OCR`: only the pages missing from
+        the OCR cache are sent.
+
+        Returns:
+            The task understanding, serialized as in `Pipeline.run`.
+        """
+        requests = BatchRequests()
+        # Text of each page, or None until its request is answered
+        pages: dict[str, list[Optional[str]]] = {}
+        page_keys: dict[str, str] = {}
+        # Only the page preparation and the cache of `OCR` are used
+        ocr = OCR(openai_client=None)
+
+        for student_id, files in submissions.items():
+            student_dir = work_dir / str(len(pages))
+            student_dir.mkdir()
+            pages[student_id] = []
+            try:
+                for page_number, image_path in enumerate(
+                    iter_page_images(files, student_dir), start=1
+                ):
+                    image_path, _ = ocr.prepare_page(
+                        page_number, image_path, student_dir
+                    )
+                    custom_id = f"{student_id}/ocr/{page_number}"
+                    if ocr.cache:
+                        page_keys[custom_id] = ocr.page_cache_key(image_path)
+                        if (text := ocr.cache.get(page_keys[custom_id])) is not None:
+                            pages[student_id].append(text)
+                            continue
+                    requests.add(
+                        custom_id,
+                        prompt=OCR_PROMPT,
+                        images=[image_path],
+                        model="gpt-4o",
+                        use_cache=False,
+                    )
+                    pages[student_id].append(None)
+            except Exception as e:
+                self.fail(student_id, f"Could not prepare pages: {str(e)}")
+
+        pipeline = next(iter(self.pipelines.values()))
+        task_cache_key = pipeline.task_understanding_key(self.task)
+        cache = pipeline.task_understanding_cache
+        cached = cache.get(task_cache_key) if cache is not None else None
+        if cached is None:
+            requests.add(
+                TASK_UNDERSTANDING_ID,
+                prompt=pipeline.build_task_understanding_prompt(self.task),
+                response_format={"type": "json_object"},
+            )
+
+        results = self.send("ocr", requests)
+
+        for custom_id, key in page_keys.items():
+            if custom_id in results:
+                ocr.cache.set(key, results[custom_id])
+
+        if cached is not None:
+            task_understanding_obj = json.loads(cached)
+        elif TASK_UNDERSTANDING_ID not in results:
+            # Every student failed in `send`
+            return ""
+        else:
+            try:
+                response_dict = json.loads(results[TASK_UNDERSTANDING_ID])
+                task_understanding_obj = response_dict.get(
+                    "task_understanding", "No task understanding found"
+                )
+            except (json.JSONDecodeError, AttributeError) as e:
+                for student_id in self.active:
+                    self.fail(
+                        student_id, f"Invalid task understanding response: {str(e)}"
+                    )
+                return ""
+            if cache is not None and "task_understanding" in response_dict:
+                cache.set(task_cache_key, json.dumps(task_understanding_obj))
+
+        for student_id in self.active:
+            texts = [
+                results.get(f"{student_id}/ocr/{page_number}", text)
+                for page_number, text in enumerate(pages[student_id], start=1)
+            ]
+            if not texts:
+                self.fail(student_id, "No pages found")
+                continue
+            if None in texts:
+                continue
+
+            students_solution = "\n\n".join(texts)
+            self.values[student_id]["students_solution"] = students_solution
+            pipeline_logger = self.pipelines[student_id].pipeline_logger
+            pipeline_logger.log_student_solution(students_solution)
+            pipeline_logger.log_task_understanding(task_understanding_obj)
+
+        return json.dumps(task_understanding_obj)
+
+    def assess(self, task_understanding: str):
+        """Analyse, then score, every criterion of every essay."""
+        requests = BatchRequests()
+        for student_id in self.active:
+            for criterion in self.assessment.criterions:
+                requests.add(
+                    f"{student_id}/analysis/{criterion}",
+                    prompt=self.assessment.build_pre_scoring_prompt(
+                        criterion=criterion,
+                        task_understanding=task_understanding,
+                        candidate_solution=self.values[student_id]["students_solution"],
+                    ),
+                    response_format={"type": "json_object"},
+                )
+        results = self.send("analysis", requests)
+
+        requests = BatchRequests()
+        for student_id in self.active:
+            analysis = {
+                criterion: self.parse(
+                    student_id,
+                    results.get(f"{student_id}/analysis/{criterion}"),
+                    "analysis",
+                    "No analysis found",
+                )
+                for criterion in self.assessment.criterions
+            }
+            self.values[student_id]["analysis"] = analysis
+            self.pipelines[student_id].pipeline_logger.log_analysis(analysis)
+
+            for criterion, criterion_analysis in analysis.items():
+                requests.add(
+                    f"{student_id}/score/{criterion}",
+                    prompt=self.assessment.build_scoring_prompt(
+                        criterion=criterion,
+                        criterion_analysis=criterion_analysis,
+                        task_description=self.task,
+                    ),
+                    response_format={"type": "json_object"},
+                )
+        results = self.send("criterion_scoring", requests)
+
+        for student_id in self.active:
+            criterion_scores = {}
+            for criterion in self.assessment.criterions:
+                response = results.get(f"{student_id}/score/{criterion}")
+                criterion_scores[criterion] = (
+                    self.parse(student_id, response, "score", 0),
+                    self.parse(
+                        student_id, response, "justification", "No justification found"
+                    ),
+                )
+            self.values[student_id]["criterion_scores"] = criterion_scores
+            self.pipelines[student_id].pipeline_logger.log_criterion_scores(
+                criterion_scores
+            )
+
+    def comment(self, task_understanding: str):
+        """Get the general comment and detailed analysis of every essay."""
+        requests = BatchRequests()
+        for student_id in self.active:
+            values = self.values[student_id]
+            requests.add(
+                f"{student_id}/general_comment",
+                prompt=self.assessment.build_general_comment_prompt(
+                    task_understanding=task_understanding,
+                    candidate_solution=values["students_solution"],
+                    criterion_scores=values["criterion_scores"],
+                ),
+                response_format={"type": "json_object"},
+            )
+            requests.add(
+                f"{student_id}/detailed_analysis",
+                prompt=self.pipelines[student_id].build_detailed_analysis_prompt(
+                    task_understanding=task_understanding,
+                    students_solution=values["students_solution"],
+                    analysis=json.dumps(values["analysis"]),
+                ),
+                response_format={"type": "json_object"},
+            )
+        results = self.send("comments", requests)
+
+        for student_id in self.active:
+            values = self.values[student_id]
+            pipeline_logger = self.pipelines[student_id].pipeline_logger
+
+            values["general_comment"] = self.parse(
+                student_id,
+                results.get(f"{student_id}/general_comment"),
+                "general_comment",
+                "No general comment found",
+            )
+            pipeline_logger.log_general_comment(values["general_comment"])
+
+            values["detailed_analysis"] = self.parse(
+                student_id,
+                results.get(f"{student_id}/detailed_analysis"),
+                "improvement_areas",
+                "No detailed analysis found",
+            )
+            pipeline_logger.log_detailed_analysis(values["detailed_analysis"])
+
+    def encourage(self):
+        """Get the encouraging comment of every essay."""
+        requests = BatchRequests()
+        for student_id in self.active:
+            pipeline = self.pipelines[student_id]
+            requests.add(
+                f"{student_id}/encouraging_comment",
+                prompt=pipeline.build_encouraging_comment_prompt(
+                    pipeline.join_detailed_analysis(
+                        self.values[student_id]["detailed_analysis"]
+                    )
+                ),
+            )
+        results = self.send("encouraging_comment", requests)
+
+        for student_id in self.active:
+            encouraging_comment = results[f"{student_id}/encouraging_comment"]
+            self.values[student_id]["encouraging_comment"] = encouraging_comment
+            self.pipelines[student_id].pipeline_logger.log_encouraging_comment(
+                encouraging_comment
+            )
@@ -1,22 +1,169 @@
 import json
+import os
+import time
+from dataclasses import dataclass, replace
 from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional, Union
 from src.ocr.ocr import OCR
-from src.openai.client import OpenAIClient
+from src.openai.cache import (
+    NO_CACHE,
+    NoCache,
+    ResponseCache,
+    get_cache,
+    make_key,
+    resolve_cache,
+)
+from src.openai.client import OpenAIClient, get_openai_client
+from src.openai.rate_limiter import rate_limiter
+from src.openai.streaming import JsonStringStream
+from src.openai.usage import track_usage
 from src.pipeline.assessement import Assessment
-from utils.logger import PipelineLogger, log_time
+from src.pipeline.prompts import PROMPTS_DIR, PromptRegistry, get_prompt_registry
+from src.pipeline.scheduler import (
+    Stage,
+    StageListener,
+    StageScheduler,
+    has_listener,
+    report_partial_output,
+    report_progress,
+)
+from utils.logger import PipelineLogger, log_time, logger
 
 
-TASK_UNDERSTANDING_PROMPT_PATH = Path(
-    "prompts/stages/1-task-understanding/task-understanding.md"
-)
-DETAILED_ANALYSIS_PROMPT_PATH = Path(
-    "prompts/stages/4-detailed-analysis/detailed-analysis.md"
+TASK_UNDERSTANDING_PROMPT_PATH = (
+    PROMPTS_DIR / "1-task-understanding/task-understanding.md"
 )
+DETAILED_ANALYSIS_PROMPT_PATH = PROMPTS_DIR / "4-detailed-analysis/detailed-analysis.md"
 
-ENCOURAGING_COMMENT_PROMPT_PATH = Path(
-    "prompts/stages/6-encouraging-comment/encouraging-comment.md"
+ENCOURAGING_COMMENT_PROMPT_PATH = (
+    PROMPTS_DIR / "6-encouraging-comment/encouraging-comment.md"
 )
 
+# Maximum duration of a whole pipeline run, in seconds.
+PIPELINE_DEADLINE = float(os.getenv("PIPELINE_DEADLINE", "600"))
+
+# Maximum duration of each stage, in seconds. Each can be set with the
+# environment variable PIPELINE_STAGE_DEADLINE_<STAGE>, e.g.
+# PIPELINE_STAGE_DEADLINE_GENERAL_COMMENT.
+STAGE_DEADLINES = {
+    stage: float(os.getenv(f"PIPELINE_STAGE_DEADLINE_{stage.upper()}", seconds))
+    for stage, seconds in {
+        "understand_solution": 300.0,
+        "task_understanding": 120.0,
+        "criterion_assessment": 300.0,
+        "general_comment": 120.0,
+        "detailed_analysis": 180.0,
+        "encouraging_comment": 120.0,
+    }.items()
+}
+
+# Stages the user waits on at the end of a run, whose slow requests are hedged.
+HEDGED_STAGES = {"general_comment", "encouraging_comment"}
+
+
+@dataclass
+class PipelineResult:
+    """
+    Everything produced by a pipeline run.
+    """
+
+    run_id: str
+    students_solution: str
+    task_understanding: Any
+    criterion_scores: dict[str, tuple[int, str]]
+    analysis: dict[str, str]
+    general_comment: str
+    detailed_analysis: list[dict[str, str]]
+    encouraging_comment: str
+
+    def as_tuple(
+        self,
+    ) -> tuple[str, dict[str, tuple[int, str]], list[dict[str, str]], str]:
+        """The values returned by `Pipeline.run`."""
+        return (
+            self.general_comment,
+            self.criterion_scores,
+            self.detailed_analysis,
+            self.encouraging_comment,
+        )
+
+
+def get_task_understanding_cache() -> ResponseCache:
+    """
+    The process-wide cache of task understandings.
+
+    Task understandings only depend on the task, so they are kept without
+    expiry and shared by every essay answering the same task.
+    """
+    return get_cache("task_understanding", ttl=None)
+
+
+def task_understanding_key(
+    task: str,
+    prompts: Optional[PromptRegistry] = None,
+    prompt_path: Path = TASK_UNDERSTANDING_PROMPT_PATH,
+) -> str:
+    """
+    Cache key of the task understanding of `task`.
+
+    The task is normalized (whitespace collapsed, case folded) and combined
+    with a hash of the prompt template, so editing `task-understanding.md`
+    invalidates every cached task understanding.
+    """
+    template = (prompts or get_prompt_registry()).get(prompt_path)
+    return make_key(
+        task=" ".join(task.split()).casefold(),
+        template_version=template.digest,
+    )
+
+
+def understand_task(
+    task: str,
+    openai_client: OpenAIClient,
+    prompts: Optional[PromptRegistry] = None,
+    prompt_path: Path = TASK_UNDERSTANDING_PROMPT_PATH,
+    cache: Union[ResponseCache, NoCache, None] = None,
+) -> Any:
+    """
+    Get the detailed understanding of a task, memoized per task.
+
+    Unlike `Pipeline.task_understanding`, no run is logged, so a task
+    understanding shared by many essays can be computed up front.
+
+    Args:
+        task: The task to be assessed.
+        openai_client: Client sending the request.
+        prompts: Registry of the prompt templates. Defaults to the process-wide one.
+        prompt_path: Template of the task understanding prompt.
+        cache: Optional cache of task understandings. Defaults to
+            `get_task_understanding_cache()`; `NO_CACHE` disables caching.
+
+    Returns:
+        The task understanding.
+    """
+    prompts = prompts or get_prompt_registry()
+    cache = resolve_cache(cache, get_task_understanding_cache)
+
+    cache_key = task_understanding_key(task, prompts, prompt_path)
+    if cache is not None and (cached := cache.get(cache_key)) is not None:
+        logger.info("Reusing cached task understanding")
+        return json.loads(cached)
+
+    response = openai_client.get_response(
+        prompts.render(prompt_path, {"Task": task}),
+        response_format={"type": "json_object"},
+    )
+
+    response_dict = json.loads(response)
+    task_understanding = response_dict.get(
+        "task_understanding", "No task understanding found"
+    )
+
+    if cache is not None and "task_understanding" in response_dict:
+        cache.set(cache_key, json.dumps(task_understanding))
+
+    return task_understanding
+
 
 class Pipeline:
     def __init__(
@@ -25,25 +172,50 @@ class Pipeline:
         task_understanding_prompt_path: Path = TASK_UNDERSTANDING_PROMPT_PATH,
         detailed_analysis_prompt_path: Path = DETAILED_ANALYSIS_PROMPT_PATH,
         encouraging_comment_prompt_path: Path = ENCOURAGING_COMMENT_PROMPT_PATH,
+        task_understanding_cache: Union[ResponseCache, NoCache, None] = None,
+        deadline: Optional[float] = PIPELINE_DEADLINE,
+        stage_deadlines: Optional[dict[str, float]] = None,
+        hedged_stages: Optional[set[str]] = None,
+        pipeline_logger: Optional[PipelineLogger] = None,
+        prompts: Optional[PromptRegistry] = None,
     ):
         self.task = task
-        self.pipeline_logger = PipelineLogger(task)
-
-        with open(task_understanding_prompt_path, "r", encoding="utf-8") as file:
-            self.task_understanding_prompt = file.read()
-
-        with open(detailed_analysis_prompt_path, "r", encoding="utf-8") as file:
-            self.detailed_analysis_prompt = file.read()
-
-        with open(encouraging_comment_prompt_path, "r", encoding="utf-8") as file:
-            self.encouraging_comment_prompt = file.read()
-
-    def task_understanding(self, task: str, openai_client: OpenAIClient) -> str:
+        self.deadline = deadline
+        self.stage_deadlines = (
+            STAGE_DEADLINES if stage_deadlines is None else stage_deadlines
+        )
+        self.hedged_stages = HEDGED_STAGES if hedged_stages is None else hedged_stages
+        self.pipeline_logger = pipeline_logger or PipelineLogger(task)
+        self.task_understanding_cache = resolve_cache(
+            task_understanding_cache, get_task_understanding_cache
+        )
+
+        # Templates are loaded once per process by the registry, and looked up
+        # on every use so that edited prompts are picked up.
+        self.prompts = prompts or get_prompt_registry()
+        self.task_understanding_prompt_path = task_understanding_prompt_path
+        self.detailed_analysis_prompt_path = detailed_analysis_prompt_path
+        self.encouraging_comment_prompt_path = encouraging_comment_prompt_path
+
+    def task_understanding_key(self, task: str) -> str:
+        """Cache key of the task understanding of `task` (see `task_understanding_key`)."""
+        return task_understanding_key(
+            task, self.prompts, self.task_understanding_prompt_path
+        )
+
+    def build_task_understanding_prompt(self, task: str) -> str:
+        """Build the task understanding prompt."""
+        return self.prompts.render(self.task_understanding_prompt_path, {"Task": task})
+
+    def task_understanding(self, task: str, openai_client: OpenAIClient) -> Any:
         """
         The purpose of this step of the pipeline is to have a detailed understanding
         of the task. This is to be able to assess the student's solution in the
         context of the task.
 
+        The result is memoized per task, so essays answering the same task share
+        a single task understanding across runs, sessions and restarts.
+
         Args:
             task: The task to be assessed.
 
@@ -51,66 +223,66 @@ class Pipeline:
             A string representing the detailed understanding of the task.
         """
         with self.pipeline_logger.step_timing("task_understanding"):
-            task_understanding_prompt = self.task_understanding_prompt.replace(
-                "{Task}", task
-            )
-
-            response = openai_client.get_response(
-                task_understanding_prompt, response_format={"type": "json_object"}
+            return understand_task(
+                task,
+                openai_client,
+                prompts=self.prompts,
+                prompt_path=self.task_understanding_prompt_path,
+                cache=self.task_understanding_cache or NO_CACHE,
             )
 
-            response_dict = json.loads(response)
-            task_understanding = response_dict.get(
-                "task_understanding", "No task understanding found"
-            )
-
-            return task_understanding
-
-    def assessment(
+    def criterion_assessment(
         self,
         task_understanding: str,
         students_solution: str,
         openai_client: OpenAIClient,
-    ) -> tuple[str, dict[str, tuple[int, str]], dict[str, str]]:
+    ) -> tuple[dict[str, tuple[int, str]], dict[str, str]]:
         """
-        The purpose of this step of the pipeline is to assess the student's solution
-        in the context of the task.
-
-        The assessement works in a two-step fashion:
-
-        1. Make a thourough analysis on the student's solution for each criterion.
-        2. Using the analysis, make a comparison between the student's solution
-        and the criterion descriptors from the Cambridge English Scale in order
-        to determine the score for each criterion.
+        The purpose of this step of the pipeline is to analyse and score the
+        student's solution on each criterion.
 
         Args:
-            overview: The overview of the student's solution.
             task_understanding: The detailed understanding of the task.
             students_solution: The student's solution to the task.
 
         Returns:
-            A general comment on the student's solution.
             A dictionary with the score for each criterion.
             A dictionary with the analysis for each criterion.
         """
-        assessment = Assessment(task=self.task)
+        assessment = Assessment(task=self.task, prompts=self.prompts)
+        assessed = []
+
+        def on_assessed(criterion: str):
+            assessed.append(criterion)
+            report_progress(len(assessed), len(assessment.criterions))
 
-        with self.pipeline_logger.step_timing("analysis"):
-            analysis = assessment.pre_scoring_assessment(
+        # Each criterion is scored as soon as its own analysis is ready, so
+        # analysis and scoring are timed as a single step.
+        with self.pipeline_logger.step_timing("criterion_assessment"):
+            analysis, criterion_scores = assessment.assess_criteria(
                 task_understanding=task_understanding,
                 candidate_solution=students_solution,
                 openai_client=openai_client,
+                on_assessed=on_assessed,
             )
             self.pipeline_logger.log_analysis(analysis)
-
-        with self.pipeline_logger.step_timing("criterion_scoring"):
-            criterion_scores = assessment.get_criterion_scores(
-                analysis=analysis,
-                task_description=self.task,
-                openai_client=openai_client,
-            )
             self.pipeline_logger.log_criterion_scores(criterion_scores)
 
+        return criterion_scores, analysis
+
+    def general_comment(
+        self,
+        task_understanding: str,
+        students_solution: str,
+        criterion_scores: dict[str, tuple[int, str]],
+        openai_client: OpenAIClient,
+    ) -> str:
+        """
+        The purpose of this step of the pipeline is to write a general comment
+        on the student's solution based on the criterion scores.
+        """
+        assessment = Assessment(task=self.task, prompts=self.prompts)
+
         with self.pipeline_logger.step_timing("general_comment"):
             general_comment = assessment.get_general_comment(
                 task_understanding=task_understanding,
@@ -120,7 +292,76 @@ class Pipeline:
             )
             self.pipeline_logger.log_general_comment(general_comment)
 
-        return general_comment, criterion_scores, analysis
+        return general_comment
+
+    def stream_general_comment(
+        self,
+        task_understanding: str,
+        students_solution: str,
+        criterion_scores: dict[str, tuple[int, str]],
+        openai_client: OpenAIClient,
+    ) -> Iterator[str]:
+        """
+        Streaming counterpart of `general_comment`: yields the general comment
+        as it is generated, extracted from the JSON response as it arrives.
+        """
+        assessment = Assessment(task=self.task, prompts=self.prompts)
+        general_comment_prompt = assessment.build_general_comment_prompt(
+            task_understanding=task_understanding,
+            candidate_solution=students_solution,
+            criterion_scores=criterion_scores,
+        )
+
+        with self.pipeline_logger.step_timing("general_comment"):
+            extractor = JsonStringStream("general_comment")
+            chunks = []
+            for chunk in self.timed_stream(
+                "general_comment",
+                openai_client.stream_response(
+                    general_comment_prompt, response_format={"type": "json_object"}
+                ),
+            ):
+                chunks.append(chunk)
+                if text := extractor.feed(chunk):
+                    yield text
+
+            response_dict = json.loads("".join(chunks))
+            general_comment = response_dict.get(
+                "general_comment", "No general comment found"
+            )
+            self.pipeline_logger.log_general_comment(general_comment)
+
+    def timed_stream(self, step_name: str, chunks: Iterator[str]) -> Iterator[str]:
+        """
+        Pass a response stream through, logging the time to its first chunk as
+        the time to first token of the step.
+        """
+        start_time = time.time()
+        first = True
+        for chunk in chunks:
+            if first:
+                self.pipeline_logger.log_time_to_first_token(
+                    step_name, time.time() - start_time
+                )
+                first = False
+            yield chunk
+
+    def build_detailed_analysis_prompt(
+        self,
+        task_understanding: str,
+        students_solution: str,
+        analysis: str,
+    ) -> str:
+        """Build the detailed analysis prompt."""
+        return self.prompts.render(
+            self.detailed_analysis_prompt_path,
+            {
+                "Task": self.task,
+                "Task-Undestanding": task_understanding,
+                "Candidates-Solution": students_solution,
+                "Analysis": analysis,
+            },
+        )
 
     def detailed_analysis(
         self,
@@ -134,20 +375,10 @@ class Pipeline:
         of the student's solution.
         """
         with self.pipeline_logger.step_timing("detailed_analysis"):
-            detailed_analysis_prompt = self.detailed_analysis_prompt.replace(
-                "{Task}", self.task
-            )
-
-            detailed_analysis_prompt = detailed_analysis_prompt.replace(
-                "{Task-Undestanding}", task_understanding
-            )
-
-            detailed_analysis_prompt = detailed_analysis_prompt.replace(
-                "{Candidates-Solution}", students_solution
-            )
-
-            detailed_analysis_prompt = detailed_analysis_prompt.replace(
-                "{Analysis}", analysis
+            detailed_analysis_prompt = self.build_detailed_analysis_prompt(
+                task_understanding=task_understanding,
+                students_solution=students_solution,
+                analysis=analysis,
             )
 
             response = openai_client.get_response(
@@ -165,7 +396,7 @@ class Pipeline:
 
     def understand_solution(
         self,
-        image_paths: list[Path],
+        image_paths: Iterable[Path],
         openai_client: OpenAIClient,
     ) -> str:
         """
@@ -173,13 +404,30 @@ class Pipeline:
         that the student has uploaded.
 
         Args:
-            prompt: The prompt to be used to understand the image.
+            image_paths: The page images, in page order. Pages are sent for OCR
+                as soon as they are yielded, so a generator rendering a PDF page
+                by page can be passed.
         """
+        extracted = []
+
+        def on_page(page_number: int):
+            # The number of pages is only known once they have all been read
+            extracted.append(page_number)
+            report_progress(len(extracted))
+
         with self.pipeline_logger.step_timing("understand_solution"):
             ocr = OCR(openai_client=openai_client)
-            solution = ocr.extract_text(image_paths=image_paths)
+            solution = ocr.extract_text(image_paths=image_paths, on_page=on_page)
+            self.pipeline_logger.log_ocr_metrics(ocr.metrics)
             return solution
 
+    def build_encouraging_comment_prompt(self, detailed_analysis: str) -> str:
+        """Build the encouraging comment prompt."""
+        return self.prompts.render(
+            self.encouraging_comment_prompt_path,
+            {"Detailed-Analysis": detailed_analysis},
+        )
+
     def encouraging_comment(
         self,
         detailed_analysis: str,
@@ -196,83 +444,415 @@ class Pipeline:
             A string representing the encouraging comment.
         """
         with self.pipeline_logger.step_timing("encouraging_comment"):
-            encouraging_comment_prompt = self.encouraging_comment_prompt.replace(
-                "{Detailed-Analysis}", detailed_analysis
+            encouraging_comment_prompt = self.build_encouraging_comment_prompt(
+                detailed_analysis
             )
 
             response = openai_client.get_response(
                 prompt=encouraging_comment_prompt,
                 model="gpt-4.1",
             )
+            self.pipeline_logger.log_encouraging_comment(response)
 
         return response
 
+    def stream_encouraging_comment(
+        self,
+        detailed_analysis: str,
+        openai_client: OpenAIClient,
+    ) -> Iterator[str]:
+        """
+        Streaming counterpart of `encouraging_comment`: yields the encouraging
+        comment as it is generated.
+        """
+        with self.pipeline_logger.step_timing("encouraging_comment"):
+            encouraging_comment_prompt = self.build_encouraging_comment_prompt(
+                detailed_analysis
+            )
+
+            chunks = []
+            for chunk in self.timed_stream(
+                "encouraging_comment",
+                openai_client.stream_response(
+                    prompt=encouraging_comment_prompt,
+                    model="gpt-4.1",
+                ),
+            ):
+                chunks.append(chunk)
+                yield chunk
+
+            self.pipeline_logger.log_encouraging_comment("".join(chunks))
+
+    @staticmethod
+    def join_detailed_analysis(detailed_analysis: list[dict[str, str]]) -> str:
+        """
+        Serialize the detailed analysis items for the encouraging comment prompt.
+        """
+        full_analysis = ""
+        for analysis in detailed_analysis:
+            analysis_str = json.dumps(analysis)
+            full_analysis += analysis_str + "\n\n"
+        return full_analysis
+
+    def stages(self, openai_client: OpenAIClient) -> list[Stage]:
+        """
+        The pipeline expressed as a DAG of stages with declared inputs and
+        outputs, to be executed by a `StageScheduler`.
+
+        When the run is listened to, the comments are streamed and reported as
+        partial outputs while they are generated (streamed requests are not
+        hedged).
+        """
+
+        def stream(chunks: Iterator[str]) -> str:
+            text = ""
+            for chunk in chunks:
+                report_partial_output(chunk)
+                text += chunk
+            return text
+
+        def understand_solution(image_paths: Iterable[Path]) -> str:
+            students_solution = self.understand_solution(
+                image_paths=image_paths, openai_client=openai_client
+            )
+            self.pipeline_logger.log_student_solution(students_solution)
+            return students_solution
+
+        def task_understanding(task: str) -> str:
+            task_understanding_obj = self.task_understanding(
+                task=task, openai_client=openai_client
+            )
+            self.pipeline_logger.log_task_understanding(task_understanding_obj)
+            return json.dumps(task_understanding_obj)
+
+        def criterion_assessment(
+            task_understanding: str, students_solution: str
+        ) -> tuple[dict[str, tuple[int, str]], str]:
+            criterion_scores, analysis = self.criterion_assessment(
+                task_understanding=task_understanding,
+                students_solution=students_solution,
+                openai_client=openai_client,
+            )
+            return criterion_scores, json.dumps(analysis)
+
+        def general_comment(
+            task_understanding: str,
+            students_solution: str,
+            criterion_scores: dict[str, tuple[int, str]],
+        ) -> str:
+            if has_listener():
+                return stream(
+                    self.stream_general_comment(
+                        task_understanding=task_understanding,
+                        students_solution=students_solution,
+                        criterion_scores=criterion_scores,
+                        openai_client=openai_client,
+                    )
+                ) or "No general comment found"
+            return self.general_comment(
+                task_understanding=task_understanding,
+                students_solution=students_solution,
+                criterion_scores=criterion_scores,
+                openai_client=openai_client,
+            )
+
+        def detailed_analysis(
+            task_understanding: str, students_solution: str, analysis: str
+        ) -> list[dict[str, str]]:
+            return self.detailed_analysis(
+                task_understanding=task_understanding,
+                students_solution=students_solution,
+                analysis=analysis,
+                openai_client=openai_client,
+            )
+
+        def encouraging_comment(detailed_analysis: list[dict[str, str]]) -> str:
+            if has_listener():
+                return stream(
+                    self.stream_encouraging_comment(
+                        detailed_analysis=self.join_detailed_analysis(
+                            detailed_analysis
+                        ),
+                        openai_client=openai_client,
+                    )
+                )
+            return self.encouraging_comment(
+                detailed_analysis=self.join_detailed_analysis(detailed_analysis),
+                openai_client=openai_client,
+            )
+
+        stages = [
+            Stage(
+                name="understand_solution",
+                func=understand_solution,
+                inputs=("image_paths",),
+                outputs=("students_solution",),
+            ),
+            Stage(
+                name="task_understanding",
+                func=task_understanding,
+                inputs=("task",),
+                outputs=("task_understanding",),
+            ),
+            Stage(
+                name="criterion_assessment",
+                func=criterion_assessment,
+                inputs=("task_understanding", "students_solution"),
+                outputs=("criterion_scores", "analysis"),
+            ),
+            Stage(
+                name="general_comment",
+                func=general_comment,
+                inputs=("task_understanding", "students_solution", "criterion_scores"),
+                outputs=("general_comment",),
+            ),
+            Stage(
+                name="detailed_analysis",
+                func=detailed_analysis,
+                inputs=("task_understanding", "students_solution", "analysis"),
+                outputs=("detailed_analysis",),
+            ),
+            Stage(
+                name="encouraging_comment",
+                func=encouraging_comment,
+                inputs=("detailed_analysis",),
+                outputs=("encouraging_comment",),
+            ),
+        ]
+        return [
+            replace(
+                stage,
+                deadline=self.stage_deadlines.get(stage.name),
+                hedge=stage.name in self.hedged_stages,
+            )
+            for stage in stages
+        ]
+
     def run(
         self,
-        image_paths: list[Path],
+        image_paths: Iterable[Path],
+        task_understanding: Optional[Any] = None,
     ) -> tuple[str, dict[str, tuple[int, str]], list[dict[str, str]], str]:
         """
-        Execute the complete assessment pipeline.
+        Execute the complete assessment pipeline (see `execute`).
 
-        This method orchestrates the entire assessment process by:
-        1. Converting the student's image to text
-        2. Creating an overview of the solution
-        3. Developing a detailed understanding of the task
-        4. Performing the assessment based on Cambridge English criteria
+        Args:
+            image_paths: The page images of the student's solution.
+            task_understanding: Optional task understanding computed earlier for
+                the same task (e.g. shared by a batch of essays). When given, the
+                task understanding stage is skipped.
 
         Returns:
             - str: A general comment on the student's solution
             - dict[str, tuple[int, str]]: A dictionary mapping criterion names to
                 tuples of (score, justification)
+            - list[dict[str, str]]: The detailed analysis
+            - str: An encouraging comment for the student
         """
-        with log_time("Complete pipeline execution"):
-            try:
-                openai_client = OpenAIClient()
+        return self.execute(
+            image_paths=image_paths, task_understanding=task_understanding
+        ).as_tuple()
 
-                students_solution = self.understand_solution(
-                    image_paths=image_paths, openai_client=openai_client
-                )
-                self.pipeline_logger.log_student_solution(students_solution)
+    def execute(
+        self,
+        image_paths: Optional[Iterable[Path]] = None,
+        students_solution: Optional[str] = None,
+        task_understanding: Optional[Any] = None,
+        listener: Optional[StageListener] = None,
+    ) -> PipelineResult:
+        """
+        Execute the complete assessment pipeline.
 
-                task_understanding_obj = self.task_understanding(
-                    task=self.task, openai_client=openai_client
-                )
-                task_understanding = json.dumps(task_understanding_obj)
-                self.pipeline_logger.log_task_understanding(task_understanding_obj)
+        The stages are run by a `StageScheduler`, so stages that do not depend
+        on each other run concurrently:
+        1. Converting the student's image to text, alongside
+           developing a detailed understanding of the task
+        2. Performing the assessment based on Cambridge English criteria
+        3. Writing the general comment, alongside the detailed analysis
+        4. Writing the encouraging comment from the detailed analysis
 
-                general_comment, criterion_scores, analysis = self.assessment(
-                    task_understanding=task_understanding,
-                    students_solution=students_solution,
-                    openai_client=openai_client,
-                )
+        The run and each of its stages are bounded by their deadlines, and the
+        requests of the final stages are hedged when they are slower than usual.
 
-                analysis = json.dumps(analysis)
+        Args:
+            image_paths: The page images of the student's solution.
+            students_solution: The text of the student's solution, instead of
+                its images. The text extraction stage is then skipped.
+            task_understanding: Optional task understanding computed earlier for
+                the same task. When given, the task understanding stage is skipped.
+            listener: Optional function receiving a `StageEvent` whenever a
+                stage starts, progresses, generates text or finishes.
 
-                detailed_analysis = self.detailed_analysis(
-                    task_understanding=task_understanding,
-                    students_solution=students_solution,
-                    analysis=analysis,
-                    openai_client=openai_client,
-                )
+        Returns:
+            The outputs of every stage.
 
-                full_analysis = ""
-                for analysis in detailed_analysis:
-                    analysis_str = json.dumps(analysis)
-                    full_analysis += analysis_str + "\n\n"
+        Raises:
+            ValueError: When neither `image_paths` nor `students_solution` is given.
+        """
+        initial: dict[str, Any] = {"task": self.task}
+        if students_solution is not None:
+            self.pipeline_logger.log_student_solution(students_solution)
+            initial["students_solution"] = students_solution
+        elif image_paths is not None:
+            initial["image_paths"] = image_paths
+        else:
+            raise ValueError("Either image_paths or students_solution is required")
+
+        if task_understanding is not None:
+            self.pipeline_logger.log_task_understanding(task_understanding)
+            initial["task_understanding"] = json.dumps(task_understanding)
 
-                encouraging_comment = self.encouraging_comment(
-                    detailed_analysis=full_analysis,
-                    openai_client=openai_client,
-                )
+        with log_time("Complete pipeline execution"):
+            return self._execute(initial, listener)
 
-                self.pipeline_logger.complete_run()
+    def _execute(
+        self, initial: dict[str, Any], listener: Optional[StageListener] = None
+    ) -> PipelineResult:
+        """
+        Run the stages whose outputs are not in `initial`.
+        """
+        openai_client = get_openai_client()
+
+        scheduler = StageScheduler(
+            stages=self.stages(openai_client),
+            pipeline_logger=self.pipeline_logger,
+            listener=listener,
+        )
+        with track_usage() as usage:
+            values = scheduler.run(initial, timeout=self.deadline)
+        self.pipeline_logger.log_token_usage(usage.as_dict())
+        self.pipeline_logger.log_rate_limits(rate_limiter.stats())
+
+        self.pipeline_logger.complete_run()
+
+        return PipelineResult(
+            run_id=self.pipeline_logger.run_id,
+            students_solution=values["students_solution"],
+            task_understanding=json.loads(values["task_understanding"]),
+            criterion_scores=values["criterion_scores"],
+            analysis=json.loads(values["analysis"]),
+            general_comment=values["general_comment"],
+            detailed_analysis=values["detailed_analysis"],
+            encouraging_comment=values["encouraging_comment"],
+        )
+
+    def checkpoint_values(self) -> dict[str, Any]:
+        """
+        Stage outputs that can be reused from the pipeline log.
 
-                return (
-                    general_comment,
-                    criterion_scores,
-                    detailed_analysis,
-                    encouraging_comment,
-                )
+        A stage's outputs are reused only when all of them are present and
+        valid (fallback texts such as "No analysis found" are not), and when
+        every stage it depends on is reused as well: a stage that runs again
+        may produce different outputs, so everything downstream of it runs
+        again too.
 
-            except Exception as e:
-                raise e
+        Returns:
+            The reusable values, keyed by stage output name.
+        """
+        data = self.pipeline_logger.pipeline_data
+        criterions = Assessment(task=self.task, prompts=self.prompts).criterions
+
+        def text(value: Any, fallback: str) -> Optional[str]:
+            if isinstance(value, str) and value.strip() and value != fallback:
+                return value
+            return None
+
+        task_understanding = data.get("task_understanding")
+        if task_understanding in ("", None, "No task understanding found"):
+            task_understanding = None
+        else:
+            task_understanding = json.dumps(task_understanding)
+
+        analysis = data.get("analysis") or {}
+        criterion_scores = data.get("criterion_scores") or {}
+        assessment_valid = (
+            all(
+                text(analysis.get(criterion), "No analysis found")
+                for criterion in criterions
+            )
+            and all(
+                criterion in criterion_scores
+                and isinstance(criterion_scores[criterion][0], int)
+                for criterion in criterions
+            )
+        )
+
+        detailed_analysis = data.get("detailed_analysis")
+        candidates = {
+            "students_solution": text(data.get("students_solution"), ""),
+            "task_understanding": task_understanding,
+            "criterion_scores": criterion_scores if assessment_valid else None,
+            "analysis": json.dumps(analysis) if assessment_valid else None,
+            "general_comment": text(
+                data.get("general_comment"), "No general comment found"
+            ),
+            "detailed_analysis": (
+                detailed_analysis
+                if isinstance(detailed_analysis, list) and detailed_analysis
+                else None
+            ),
+            "encouraging_comment": text(data.get("encouraging_comment"), ""),
+        }
+
+        values: dict[str, Any] = {"task": self.task, "image_paths": None}
+        for stage in self.stages(openai_client=None):
+            if all(name in values for name in stage.inputs) and all(
+                candidates.get(name) is not None for name in stage.outputs
+            ):
+                values.update((name, candidates[name]) for name in stage.outputs)
+
+        del values["task"], values["image_paths"]
+        return values
+
+    @classmethod
+    def resume(
+        cls,
+        run_id: str,
+        image_paths: Optional[Iterable[Path]] = None,
+        listener: Optional[StageListener] = None,
+        **kwargs,
+    ) -> tuple[str, dict[str, tuple[int, str]], list[dict[str, str]], str]:
+        """
+        Resume an interrupted run from its pipeline log, executing only the
+        stages whose outputs were not saved (see `checkpoint_values`).
+
+        Args:
+            run_id: The id of the run to resume.
+            image_paths: The page images of the student's solution. Only
+                needed when the text of the solution was not saved.
+            listener: Optional listener of the stage events (see `execute`).
+            **kwargs: Other arguments of `Pipeline`.
+
+        Returns:
+            The same values as `run`.
+
+        Raises:
+            FileNotFoundError: When there is no log file for `run_id`.
+            ValueError: When the solution has to be extracted again but no
+                `image_paths` are given.
+        """
+        pipeline_logger = PipelineLogger.load(run_id)
+        pipeline = cls(
+            task=pipeline_logger.pipeline_data["task"],
+            pipeline_logger=pipeline_logger,
+            **kwargs,
+        )
+
+        initial = pipeline.checkpoint_values()
+        if "students_solution" not in initial:
+            if image_paths is None:
+                raise ValueError(
+                    f"Run {run_id} has no extracted solution, image_paths are required"
+                )
+            initial["image_paths"] = image_paths
+        initial["task"] = pipeline.task
+
+        skipped = [
+            stage.name
+            for stage in pipeline.stages(openai_client=None)
+            if stage.outputs and all(name in initial for name in stage.outputs)
+        ]
+        pipeline_logger.log_resume(skipped)
+
+        with log_time(f"Resumed pipeline execution of run {run_id}"):
+            return pipeline._execute(initial, listener).as_tuple()
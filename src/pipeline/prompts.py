@@ -0,0 +1,237 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Mapping, Optional
+
+from utils.logger import logger
+
+PROMPTS_DIR = Path("prompts/stages")
+CRITERIA_DIR = PROMPTS_DIR / "2-assessement"
+
+# Seconds between two checks of a template file for changes (set to -1 to
+# never reload templates once loaded).
+PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", "2"))
+
+# Placeholders look like `{Task}` or `{Candidates-Solution}`; other braces in
+# the templates (e.g. JSON examples) are left alone.
+PLACEHOLDER_PATTERN = re.compile(r"\{([A-Za-z][A-Za-z-]*)\}")
+
+# Placeholders each stage template must contain, relative to PROMPTS_DIR.
+# Criterion definitions and descriptors are plain text without placeholders.
+EXPECTED_PLACEHOLDERS = {
+    "1-task-understanding/task-understanding.md": {"Task"},
+    "2-assessement/pre-scoring-assessement-prompt.md": {
+        "Criterion",
+        "Criterion-definition",
+        "Task",
+        "Task-Understanding",
+        "Candidates-Solution",
+    },
+    "2-assessement/scoring-assessement-prompt.md": {
+        "Task-Description",
+        "Criterion-descriptor",
+        "Criterion",
+        "Analysis",
+    },
+    "4-detailed-analysis/detailed-analysis.md": {
+        "Task",
+        "Task-Undestanding",
+        "Candidates-Solution",
+        "Analysis",
+    },
+    "5-final-comments/general-comment.md": {
+        "Task",
+        "Candidates-Solution",
+        "Task-Understanding",
+        "Criterion-Scores",
+    },
+    "6-encouraging-comment/encouraging-comment.md": {"Detailed-Analysis"},
+}
+
+
+# Placeholders whose values change with every essay. They must come after the
+# instructions, reference texts and task in every template: the API caches
+# prompt prefixes, so requests for the essays of a class answering the same
+# task then share a long cached prefix and only the end of each prompt differs.
+PER_ESSAY_PLACEHOLDERS = {
+    "Candidates-Solution",
+    "Analysis",
+    "Criterion-Scores",
+    "Detailed-Analysis",
+}
+
+
+class PromptTemplate:
+    """
+    A prompt template, split once into its literal text and placeholders so
+    that rendering is a single join.
+
+    Values are inserted in one pass, so a value that happens to contain a
+    placeholder (e.g. a student writing `{Task}`) is never substituted again.
+    """
+
+    def __init__(self, path: Path, text: str):
+        self.path = path
+        self.text = text
+        self.digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        # Literal text at even positions, placeholder names at odd positions
+        self.parts = PLACEHOLDER_PATTERN.split(text)
+        self.placeholders = frozenset(self.parts[1::2])
+
+    def render(self, values: Mapping[str, str]) -> str:
+        """
+        Fill the placeholders of the template.
+
+        Args:
+            values: The value of each placeholder, by name (without braces).
+                Values for placeholders the template does not use are ignored.
+
+        Raises:
+            ValueError: When a placeholder of the template has no value.
+        """
+        missing = self.placeholders - values.keys()
+        if missing:
+            raise ValueError(
+                f"Missing values for placeholders {sorted(missing)} of {self.path}"
+            )
+        parts = list(self.parts)
+        parts[1::2] = [values[name] for name in self.parts[1::2]]
+        return "".join(parts)
+
+
+class PromptRegistry:
+    """
+    Loads the prompt templates once per process and keeps them compiled.
+
+    Every template under `root` is loaded up front and checked against
+    `expected` placeholders; other paths are loaded on first use. A template
+    whose file changes on disk is reloaded when it is next used (files are
+    checked at most every `reload_interval` seconds). A reloaded template that
+    fails validation is ignored, and the previous version is kept.
+    """
+
+    def __init__(
+        self,
+        root: Path = PROMPTS_DIR,
+        expected: Optional[Mapping[str, set[str]]] = None,
+        reload_interval: float = PROMPT_RELOAD_INTERVAL,
+    ):
+        self.root = root
+        self.expected = EXPECTED_PLACEHOLDERS if expected is None else expected
+        self.reload_interval = reload_interval
+        self.templates: dict[Path, PromptTemplate] = {}
+        # (mtime, size) of each loaded file, and when it was last checked
+        self.versions: dict[Path, tuple[int, int]] = {}
+        self.checked_at: dict[Path, float] = {}
+        self.lock = threading.Lock()
+
+        if root.is_dir():
+            for path in sorted(root.rglob("*.md")):
+                self.get(path)
+            logger.info(f"Loaded {len(self.templates)} prompt templates from {root}")
+
+    def validate(self, template: PromptTemplate):
+        """
+        Raises:
+            ValueError: When the template's placeholders are not the expected
+                ones, or when a per-essay placeholder comes before a placeholder
+                that is the same for every essay.
+        """
+        try:
+            name = template.path.relative_to(self.root.resolve()).as_posix()
+        except ValueError:
+            return
+        expected = self.expected.get(name)
+        if expected is not None and template.placeholders != expected:
+            raise ValueError(
+                f"Prompt template {name} has placeholders "
+                f"{sorted(template.placeholders)}, expected {sorted(expected)}"
+            )
+
+        placeholders = template.parts[1::2]
+        first = next(
+            (
+                i
+                for i, placeholder in enumerate(placeholders)
+                if placeholder in PER_ESSAY_PLACEHOLDERS
+            ),
+            len(placeholders),
+        )
+        late = [
+            placeholder
+            for placeholder in placeholders[first:]
+            if placeholder not in PER_ESSAY_PLACEHOLDERS
+        ]
+        if late:
+            raise ValueError(
+                f"Prompt template {name} has {{{late[0]}}} after per-essay content, "
+                "which prevents prompt prefix caching"
+            )
+
+    def get(self, path: Path) -> PromptTemplate:
+        """
+        Return the template stored at `path`, loading or reloading it if needed.
+
+        Raises:
+            FileNotFoundError: When the template was never loaded and does not exist.
+            ValueError: When the template was never loaded and is not valid.
+        """
+        path = Path(path).resolve()
+        now = time.monotonic()
+        with self.lock:
+            template = self.templates.get(path)
+            if template is not None and (
+                self.reload_interval < 0
+                or now - self.checked_at[path] < self.reload_interval
+            ):
+                return template
+
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                if template is None:
+                    raise
+                # Keep serving the last version while the file is being replaced
+                return template
+            self.checked_at[path] = now
+            version = (stat.st_mtime_ns, stat.st_size)
+            if template is not None and self.versions[path] == version:
+                return template
+
+            new_template = PromptTemplate(path, path.read_text(encoding="utf-8"))
+            try:
+                self.validate(new_template)
+            except ValueError as e:
+                if template is None:
+                    raise
+                logger.error(f"Keeping the previous version of {path}: {str(e)}")
+                self.versions[path] = version
+                return template
+
+            if template is not None:
+                logger.info(f"Reloaded prompt template {path}")
+            self.templates[path] = new_template
+            self.versions[path] = version
+            return new_template
+
+    def render(self, path: Path, values: Mapping[str, str]) -> str:
+        """Render the template stored at `path` (see `PromptTemplate.render`)."""
+        return self.get(path).render(values)
+
+
+_registry: Optional[PromptRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_prompt_registry() -> PromptRegistry:
+    """
+    Return the process-wide `PromptRegistry`, shared by every pipeline.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = PromptRegistry()
+        return _registry
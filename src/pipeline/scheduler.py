@@ -0,0 +1,309 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from src.openai.retry import (
+    DeadlineExceeded,
+    cancellation,
+    deadline,
+    hedged,
+    remaining_time,
+)
+from utils.logger import PipelineLogger, logger
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    A pipeline stage with declared inputs and outputs.
+
+    The stage function is called with its inputs as keyword arguments. A stage
+    with a single output returns the value itself, a stage with several outputs
+    returns a tuple in the same order as `outputs`.
+
+    A stage can have a `deadline` in seconds, which bounds the requests it
+    sends, and latency-critical stages can be `hedge`d (see `retry.call_hedged`).
+    """
+
+    name: str
+    func: Callable[..., Any]
+    inputs: tuple[str, ...] = ()
+    outputs: tuple[str, ...] = ()
+    deadline: Optional[float] = None
+    hedge: bool = False
+
+
+@dataclass(frozen=True)
+class StageEvent:
+    """
+    Something that happened to a stage during a run, reported to the listener
+    of the `StageScheduler`. The `kind` of event, and its `data`, are one of:
+
+    - "skipped": the stage's outputs were provided up front.
+    - "started": the stage began to run.
+    - "progress": a `(completed, total)` tuple of the stage's work items (pages,
+      criteria...), `total` being None while unknown.
+    - "partial_output": the next chunk of text generated by the stage.
+    - "finished": a dictionary of the stage's outputs.
+    - "failed": the exception raised by the stage.
+    """
+
+    kind: str
+    stage: str
+    data: Any = None
+
+
+StageListener = Callable[[StageEvent], None]
+
+# The stage being executed and the listener of its scheduler, so that code
+# running inside a stage can report its progress.
+current_stage: ContextVar[Optional[tuple[str, StageListener]]] = ContextVar(
+    "current_stage", default=None
+)
+
+
+def has_listener() -> bool:
+    """Whether the events of the current stage are listened to."""
+    return current_stage.get() is not None
+
+
+def notify(listener: Optional[StageListener], event: StageEvent):
+    """
+    Send an event to a listener. Listener errors are logged and ignored, so
+    that a broken progress display cannot fail the run.
+    """
+    if listener is None:
+        return
+    try:
+        listener(event)
+    except Exception as e:
+        logger.warning(
+            f"Stage listener failed on {event.kind} event of {event.stage}: {str(e)}"
+        )
+
+
+def emit(kind: str, data: Any = None):
+    """Report an event of the current stage to its listener, if any."""
+    stage = current_stage.get()
+    if stage is not None:
+        name, listener = stage
+        notify(listener, StageEvent(kind=kind, stage=name, data=data))
+
+
+def report_progress(completed: int, total: Optional[int] = None):
+    """Report that `completed` work items of the current stage are done."""
+    emit("progress", (completed, total))
+
+
+def report_partial_output(text: str):
+    """Report the next chunk of text generated by the current stage."""
+    emit("partial_output", text)
+
+
+class StageScheduler:
+    """
+    Runs a DAG of stages, starting every stage as soon as all of its inputs
+    are available so that independent stages execute concurrently.
+
+    When a stage fails, the stages that have not started are cancelled, and
+    the running ones are stopped before their next request (see
+    `retry.cancellation`).
+
+    An optional `listener` receives a `StageEvent` when each stage starts,
+    reports progress or partial output, and finishes. It is called from the
+    threads running the stages, so it must be thread-safe and return quickly.
+    """
+
+    def __init__(
+        self,
+        stages: list[Stage],
+        pipeline_logger: Optional[PipelineLogger] = None,
+        max_workers: int = 4,
+        listener: Optional[StageListener] = None,
+    ):
+        self.stages = {stage.name: stage for stage in stages}
+        self.pipeline_logger = pipeline_logger
+        self.max_workers = max_workers
+        self.listener = listener
+
+        if len(self.stages) != len(stages):
+            raise ValueError("Stage names must be unique")
+
+        self.producers: dict[str, str] = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(
+                        f"Output '{output}' is produced by both "
+                        f"'{self.producers[output]}' and '{stage.name}'"
+                    )
+                self.producers[output] = stage.name
+
+    def dependencies(self, stage: Stage) -> set[str]:
+        """Names of the stages whose outputs `stage` consumes."""
+        return {
+            self.producers[name] for name in stage.inputs if name in self.producers
+        }
+
+    def run(
+        self, initial: dict[str, Any], timeout: Optional[float] = None
+    ) -> dict[str, Any]:
+        """
+        Execute every stage and return all values, initial ones included.
+
+        Args:
+            initial: Values that are available before any stage runs. Stages
+                whose outputs are all among them are skipped.
+            timeout: Optional deadline of the whole run in seconds, which also
+                bounds every stage.
+
+        Raises:
+            ValueError: When an input is neither provided nor produced by a stage,
+                or when the stages contain a cycle.
+            DeadlineExceeded: When the run or a stage exceeds its deadline.
+        """
+        values = dict(initial)
+
+        # Stages whose outputs were all provided up front do not need to run.
+        skipped = [
+            stage.name
+            for stage in self.stages.values()
+            if stage.outputs and all(name in values for name in stage.outputs)
+        ]
+        if skipped:
+            logger.info(f"Skipping stages with provided outputs: {skipped}")
+        for name in skipped:
+            notify(self.listener, StageEvent(kind="skipped", stage=name))
+
+        pending = {
+            name: stage for name, stage in self.stages.items() if name not in skipped
+        }
+
+        for stage in pending.values():
+            missing = [
+                name
+                for name in stage.inputs
+                if name not in values and name not in self.producers
+            ]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' has unresolved inputs: {missing}")
+
+        running: dict[Future, Stage] = {}
+        windows: dict[str, tuple[float, float]] = {}
+        origin = time.time()
+
+        def execute(stage: Stage) -> Any:
+            start = time.time()
+            if self.listener:
+                current_stage.set((stage.name, self.listener))
+            emit("started")
+            try:
+                with deadline(stage.deadline), hedged(
+                    stage.name if stage.hedge else None
+                ):
+                    result = stage.func(
+                        **{name: values[name] for name in stage.inputs}
+                    )
+            except Exception as e:
+                emit("failed", e)
+                raise
+            finally:
+                windows[stage.name] = (start - origin, time.time() - origin)
+
+            outputs = result if len(stage.outputs) > 1 else (result,)
+            emit("finished", dict(zip(stage.outputs, outputs)))
+            return result
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        cancelled = threading.Event()
+        try:
+            with deadline(timeout), cancellation(cancelled):
+                self._execute(executor, execute, pending, running, values)
+        except BaseException:
+            # Do not wait for stages that are still running, and keep them
+            # from sending more requests.
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+        self._log_critical_path(windows)
+        return values
+
+    def _execute(
+        self,
+        executor: ThreadPoolExecutor,
+        execute: Callable[[Stage], Any],
+        pending: dict[str, Stage],
+        running: dict[Future, Stage],
+        values: dict[str, Any],
+    ):
+        """Submit stages as their inputs become available, until all are done."""
+        while pending or running:
+            ready = [
+                stage
+                for stage in pending.values()
+                if all(name in values for name in stage.inputs)
+            ]
+            for stage in ready:
+                del pending[stage.name]
+                logger.debug(f"Scheduling stage: {stage.name}")
+                # Stages run with the caller's context (e.g. its rate limit
+                # session and deadline), which worker threads do not inherit.
+                running[
+                    executor.submit(contextvars.copy_context().run, execute, stage)
+                ] = stage
+
+            if not running:
+                raise ValueError(
+                    f"Stages can never run (cyclic dependencies): {list(pending)}"
+                )
+
+            done, _ = wait(
+                running, timeout=remaining_time(), return_when=FIRST_COMPLETED
+            )
+            if not done:
+                names = [stage.name for stage in running.values()]
+                raise DeadlineExceeded(f"Deadline exceeded while running {names}")
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+
+                if len(stage.outputs) == 1:
+                    values[stage.outputs[0]] = result
+                elif stage.outputs:
+                    values.update(zip(stage.outputs, result))
+
+    def _log_critical_path(self, windows: dict[str, tuple[float, float]]):
+        """Find the chain of dependent stages that determined the total run time."""
+        finish: dict[str, float] = {}
+        previous: dict[str, Optional[str]] = {}
+
+        def longest(name: str) -> float:
+            if name not in finish:
+                start, end = windows[name]
+                dependencies = self.dependencies(self.stages[name]) & windows.keys()
+                parent = max(dependencies, key=longest, default=None)
+                previous[name] = parent
+                finish[name] = (end - start) + (longest(parent) if parent else 0.0)
+            return finish[name]
+
+        last = max(windows, key=longest, default=None)
+        path = []
+        while last:
+            path.append(last)
+            last = previous[last]
+        path.reverse()
+
+        logger.info(f"Critical path: {' -> '.join(path)}")
+        if self.pipeline_logger:
+            self.pipeline_logger.log_critical_path(path)
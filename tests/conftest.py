@@ -0,0 +1,13 @@
+import pytest
+
+import src.openai.cache as cache
+import utils.logger as pipeline_logs
+
+
+@pytest.fixture(autouse=True)
+def isolated_logs(tmp_path, monkeypatch):
+    """Keep the run logs and caches of every test in its own directory."""
+    monkeypatch.setattr(pipeline_logs, "LOG_DIR", tmp_path / "logs")
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path / "logs" / "cache")
+    monkeypatch.setattr(cache, "_caches", {})
+    return tmp_path / "logs"
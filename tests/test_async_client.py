@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from src.openai.cache import ResponseCache
+from src.openai.client import AsyncOpenAIClient
+from src.openai.rate_limiter import RateLimiter
+from src.openai.retry import RetryPolicy
+
+
+def completion(content: str) -> dict:
+    return {
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4.1",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+
+class Responder:
+    """Answers chat completions, failing the first `failures` requests."""
+
+    def __init__(self, failures: int = 0, status: int = 503, content=None):
+        self.failures = failures
+        self.status = status
+        self.content = content
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append(body)
+        if len(self.requests) <= self.failures:
+            return httpx.Response(
+                self.status,
+                headers={"retry-after-ms": "1"},
+                json={"error": {"message": "unavailable"}},
+            )
+        content = self.content or f"answer to {body['model']}"
+        return httpx.Response(200, json=completion(content))
+
+
+@pytest.fixture
+def make_client(tmp_path):
+    def make_client(responder: Responder) -> AsyncOpenAIClient:
+        return AsyncOpenAIClient(
+            api_key="test",
+            limiter=RateLimiter(),
+            cache=ResponseCache(tmp_path / "responses.sqlite"),
+            retry_policy=RetryPolicy(base_delay=0.001, max_delay=0.001),
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(responder)),
+        )
+
+    return make_client
+
+
+def test_responses_are_cached_across_requests(make_client):
+    responder = Responder()
+    client = make_client(responder)
+
+    async def run():
+        first = await client.get_response("prompt")
+        second = await client.get_response("prompt")
+        return first, second
+
+    assert asyncio.run(run()) == ("answer to gpt-4.1", "answer to gpt-4.1")
+    assert len(responder.requests) == 1
+
+
+def test_invalid_json_responses_are_not_cached(make_client):
+    responder = Responder(content='{"score": 3')
+    client = make_client(responder)
+
+    async def run():
+        for _ in range(2):
+            await client.get_response("prompt", response_format={"type": "json_object"})
+
+    asyncio.run(run())
+    assert len(responder.requests) == 2
+
+
+def test_transient_errors_are_retried_and_reported_to_the_limiter(make_client):
+    responder = Responder(failures=2)
+    client = make_client(responder)
+
+    content = asyncio.run(client.get_response("prompt", use_cache=False))
+
+    assert content == "answer to gpt-4.1"
+    assert len(responder.requests) == 3
+    stats = client.limiter.stats()["gpt-4.1"]
+    assert stats["in_flight"] == 0
+
+
+def test_rate_limited_requests_wait_for_the_limiter(make_client):
+    responder = Responder(failures=1, status=429)
+    client = make_client(responder)
+
+    content = asyncio.run(client.get_response("prompt", use_cache=False))
+
+    assert content == "answer to gpt-4.1"
+    assert len(responder.requests) == 2
+    stats = client.limiter.stats()["gpt-4.1"]
+    assert stats["concurrency"] < client.limiter.max_concurrency
+
+
+def test_concurrent_requests_share_the_client(make_client):
+    responder = Responder()
+    client = make_client(responder)
+
+    async def run():
+        return await asyncio.gather(
+            *(client.get_response(f"prompt {i}") for i in range(5))
+        )
+
+    assert asyncio.run(run()) == ["answer to gpt-4.1"] * 5
+    assert len(responder.requests) == 5
@@ -0,0 +1,108 @@
+import json
+import threading
+
+import pytest
+from PIL import Image
+
+from src.openai.batch import BatchClient
+from src.openai.batch_stub import BatchStubServer, stub_responder
+from src.openai.cache import NO_CACHE
+from src.pipeline.batch_runner import BatchPipelineRunner
+
+TASK = "Write an essay about cities."
+
+
+class Responder:
+    """Stub answers, counting OCR requests and optionally breaking one prompt."""
+
+    def __init__(self, invalid_marker=None):
+        self.invalid_marker = invalid_marker
+        self.ocr_requests = 0
+
+    def __call__(self, body: dict) -> str:
+        content = json.dumps(body["messages"])
+        if "image_url" in content:
+            self.ocr_requests += 1
+            return "Page text."
+        if self.invalid_marker and self.invalid_marker in content:
+            return "not json"
+        return stub_responder(body)
+
+
+@pytest.fixture
+def stub():
+    responder = Responder()
+    server = BatchStubServer(port=0, responder=responder)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, responder
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def submissions(tmp_path):
+    pages = []
+    for index in range(3):
+        page = tmp_path / f"page_{index}.png"
+        Image.new("RGB", (400, 300), (255, 255, 255 - index)).save(page)
+        pages.append(page)
+    return {"alice": pages[:2], "bob": pages[2:]}
+
+
+def run(server, submissions):
+    runner = BatchPipelineRunner(
+        task=TASK,
+        batch_client=BatchClient(
+            api_key="test", base_url=server.base_url, poll_interval=0.01, cache=NO_CACHE
+        ),
+    )
+    return runner.run(submissions)
+
+
+def test_grades_every_student(stub, submissions, tmp_path):
+    server, responder = stub
+    results = run(server, submissions)
+
+    assert set(results) == {"alice", "bob"}
+    for student_id, result in results.items():
+        assert "error" not in result
+        assert result["general_comment"] == "Stub general comment."
+        assert result["encouraging_comment"] == "Stub response."
+        assert all(score == 3 for score, _ in result["criterion_scores"].values())
+        assert result["detailed_analysis"][0]["category"] == "Language"
+        log = json.loads(
+            (tmp_path / "logs" / f"pipeline_run_{result['run_id']}.json").read_text()
+        )
+        assert log["completed"]
+        assert log["students_solution"] == "\n\n".join(
+            ["Page text."] * len(submissions[student_id])
+        )
+    assert responder.ocr_requests == 3
+
+
+def test_pages_are_served_from_the_ocr_cache(stub, submissions):
+    server, responder = stub
+    run(server, submissions)
+    results = run(server, submissions)
+
+    assert all("error" not in result for result in results.values())
+    assert responder.ocr_requests == 3
+
+
+def test_unreadable_pages_fail_only_their_student(stub, submissions, tmp_path):
+    server, _ = stub
+    submissions["bob"] = [tmp_path / "missing.png"]
+    results = run(server, submissions)
+
+    assert "error" not in results["alice"]
+    assert results["bob"]["error"].startswith("Could not prepare pages")
+
+
+def test_invalid_task_understanding_fails_every_student(stub, submissions):
+    server, responder = stub
+    responder.invalid_marker = TASK
+    results = run(server, submissions)
+
+    for result in results.values():
+        assert result["error"].startswith("Invalid task understanding response")
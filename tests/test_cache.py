@@ -0,0 +1,37 @@
+import src.openai.cache as cache
+from src.openai.cache import ResponseCache, is_cacheable_response
+
+
+def test_only_valid_json_is_cacheable_in_json_mode():
+    json_mode = {"type": "json_object"}
+    assert is_cacheable_response('{"score": 3}', json_mode)
+    assert not is_cacheable_response('{"score": 3', json_mode)
+    assert is_cacheable_response('{"score": 3', None)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    response_cache = ResponseCache(tmp_path / "cache.sqlite", max_bytes=30)
+    for key in "abc":
+        response_cache.set(key, "x" * 10)
+    # Replacing an entry does not count its old value
+    response_cache.set("c", "y" * 10)
+    assert response_cache.get("a") == "x" * 10
+
+    response_cache.set("d", "x" * 10)
+    response_cache.memory.clear()
+    assert response_cache.get("b") is None
+    assert [response_cache.get(key) for key in "acd"] == ["x" * 10, "y" * 10, "x" * 10]
+
+
+def test_size_is_summed_up_again_from_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "SIZE_RECOUNT_INTERVAL", 2)
+    path = tmp_path / "cache.sqlite"
+    response_cache = ResponseCache(path, max_bytes=30)
+    response_cache.set("a", "x" * 10)
+    # Another process fills the cache
+    ResponseCache(path, max_bytes=None).set("b", "x" * 20)
+
+    response_cache.set("c", "x" * 10)
+    response_cache.memory.clear()
+    assert response_cache.get("a") is None
+    assert response_cache.total_bytes == 30
@@ -0,0 +1,240 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.history.store import HistoryStore, parse_score, task_hash
+
+START = datetime(2026, 1, 1, 9, 0)
+
+
+def make_entry(task: str, scores: list[int]) -> dict:
+    criteria = ["Content", "Communicative Achievement", "Organisation", "Language"]
+    return {
+        "task_description": task,
+        "criterion_scores": {
+            criterion: [score, f"Justification of {score}"]
+            for criterion, score in zip(criteria, scores)
+        },
+        "total_score": sum(scores),
+        "max_score": 20,
+        "general_comment": "Comment",
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(tmp_path / "history.db", directory=tmp_path / "history")
+
+
+@pytest.fixture
+def filled_store(store):
+    # Day i holds an entry of task A scoring 4 + i, and a later one of task B
+    # scoring 10
+    for day in range(10):
+        timestamp = START + timedelta(days=day)
+        store.add(make_entry("Task A", [1, 1, 1, 1 + day]), timestamp=timestamp)
+        store.add(
+            make_entry("Task B", [2, 2, 3, 3]), timestamp=timestamp + timedelta(hours=1)
+        )
+    return store
+
+
+def test_entry_is_saved_and_loaded(store):
+    entry = make_entry("Task A", [3, 4, 4, 5])
+    entry_id = store.add(entry, timestamp=START)
+
+    loaded = store.get(entry_id)
+    assert loaded["id"] == entry_id
+    assert loaded["timestamp"] == START
+    assert loaded["general_comment"] == "Comment"
+    assert loaded["criterion_scores"]["Language"] == [5, "Justification of 5"]
+    assert store.get("missing") is None
+
+    (summary,) = store.query().entries
+    assert summary.total_score == 16
+    assert summary.criterion_scores["Content"] == 3
+    assert summary.score_percentage == 80
+
+
+def test_query_filters_on_task_time_and_score(filled_store):
+    assert filled_store.query(limit=100).total == 20
+    assert filled_store.query(task_hash=task_hash("Task B")).total == 10
+
+    page = filled_store.query(
+        start=START + timedelta(days=2), end=START + timedelta(days=5)
+    )
+    assert page.total == 6
+    assert {entry.timestamp.day for entry in page.entries} == {3, 4, 5}
+
+    page = filled_store.query(min_score=8, max_score=10, limit=100)
+    scores = sorted(entry.total_score for entry in page.entries)
+    assert scores == [8, 9] + [10] * 11
+
+
+def test_query_sorts_and_paginates(filled_store):
+    highest = filled_store.query(sort="highest_score", limit=1).entries[0]
+    assert highest.total_score == 13
+    oldest = filled_store.query(sort="oldest", limit=1).entries[0]
+    assert oldest.timestamp == START
+
+    seen = []
+    for offset in range(0, 20, 6):
+        page = filled_store.query(sort="lowest_score", limit=6, offset=offset)
+        assert page.total == 20
+        seen.extend(entry.id for entry in page.entries)
+    assert len(seen) == len(set(seen)) == 20
+
+    with pytest.raises(ValueError):
+        filled_store.query(sort="random")
+
+
+def test_delete_removes_the_entry(store):
+    entry_id = store.add(make_entry("Task A", [3, 3, 3, 3]))
+    assert store.delete(entry_id)
+    assert store.get(entry_id) is None
+    assert store.query().total == 0
+    assert not store.delete(entry_id)
+
+
+def test_scores_are_parsed_leniently(store):
+    entry = make_entry("Task A", [3, 3, 3, 3])
+    entry["criterion_scores"] = {
+        "Content": ["4", "text score"],
+        "Communicative Achievement": [4.6, "float score"],
+        "Organisation": [None, "no score"],
+        "Language": "3/5",
+    }
+    entry["total_score"] = "n/a"
+    entry_id = store.add(entry)
+
+    (summary,) = store.query().entries
+    assert summary.criterion_scores == {
+        "Content": 4,
+        "Communicative Achievement": 5,
+        "Language": 3,
+    }
+    assert summary.total_score == 12
+    assert summary.max_score == 20
+    assert store.get(entry_id)["criterion_scores"]["Organisation"] == [None, "no score"]
+
+
+@pytest.mark.parametrize(
+    "value, score",
+    [
+        (4, 4),
+        ("4", 4),
+        (" 4/5", 4),
+        (4.6, 5),
+        ([3, "ok"], 3),
+        (None, None),
+        ("n/a", None),
+    ],
+)
+def test_parse_score(value, score):
+    assert parse_score(value) == score
+
+
+def test_json_files_are_imported_once_per_version(store):
+    store.directory.mkdir()
+    path = store.directory / "1767258000_analysis.json"
+    path.write_text(json.dumps(make_entry("Task A", [2, 2, 2, 2])))
+
+    assert store.import_json_files() == 1
+    assert store.import_json_files() == 0
+    assert store.get("1767258000_analysis")["total_score"] == 8
+
+    # A modified file replaces its entry
+    path.write_text(json.dumps(make_entry("Task A", [4, 4, 4, 4])))
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10**9))
+    assert store.import_json_files() == 1
+    assert store.get("1767258000_analysis")["total_score"] == 16
+    assert store.query().total == 1
+
+    # A broken file is reported once, and the others are still imported
+    (store.directory / "broken.json").write_text("{")
+    (store.directory / "other.json").write_text(
+        json.dumps(make_entry("Task B", [1, 1, 1, 1]))
+    )
+    assert store.import_json_files() == 1
+    assert store.import_json_files() == 0
+
+    # A new store knows what was imported
+    reopened = HistoryStore(store.path, directory=store.directory)
+    assert reopened.import_json_files() == 0
+
+
+def test_tasks_are_counted_and_searched(filled_store):
+    assert filled_store.tasks() == [
+        (task_hash("Task B"), "Task B", 10),
+        (task_hash("Task A"), "Task A", 10),
+    ]
+    assert filled_store.tasks(limit=1) == [(task_hash("Task B"), "Task B", 10)]
+    assert [task for _, task, _ in filled_store.tasks(search="task a")] == ["Task A"]
+    assert filled_store.tasks(search="%") == []
+
+    # The most recent entry of task A is now newer than any of task B
+    later = START + timedelta(days=30)
+    filled_store.add(make_entry("Task A", [1, 1, 1, 1]), timestamp=later)
+    assert filled_store.tasks()[0] == (task_hash("Task A"), "Task A", 11)
+
+
+def test_tasks_follow_replaced_and_deleted_entries(store):
+    first = store.add(make_entry("Task A", [1, 1, 1, 1]), timestamp=START)
+    second = store.add(
+        make_entry("Task A", [1, 1, 1, 1]), timestamp=START + timedelta(days=1)
+    )
+    assert store.tasks() == [(task_hash("Task A"), "Task A", 2)]
+
+    # Replacing an entry moves it to its new task
+    store.add(make_entry("Task B", [1, 1, 1, 1]), entry_id=second, timestamp=START)
+    assert sorted(store.tasks()) == sorted(
+        [(task_hash("Task A"), "Task A", 1), (task_hash("Task B"), "Task B", 1)]
+    )
+
+    store.delete(first)
+    assert store.tasks() == [(task_hash("Task B"), "Task B", 1)]
+    store.delete(second)
+    assert store.tasks() == []
+
+
+def test_tasks_are_backfilled_in_older_databases(filled_store):
+    with filled_store.connect() as connection:
+        connection.execute("DELETE FROM tasks")
+
+    reopened = HistoryStore(filled_store.path, directory=filled_store.directory)
+    assert {task: count for _, task, count in reopened.tasks()} == {
+        "Task A": 10,
+        "Task B": 10,
+    }
+
+
+def test_sync_finds_new_files_and_files_modified_in_place(tmp_path):
+    store = HistoryStore(
+        tmp_path / "history.db",
+        directory=tmp_path / "history",
+        scan_interval=0,
+        full_scan_interval=3600,
+    )
+    store.directory.mkdir()
+    path = store.directory / "1767258000_analysis.json"
+    path.write_text(json.dumps(make_entry("Task A", [2, 2, 2, 2])))
+    assert store.sync_json_files() == 1
+    assert store.sync_json_files() == 0
+
+    # Editing a file in place leaves the directory unchanged, until the next
+    # full scan
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(make_entry("Task A", [4, 4, 4, 4]), f)
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10**9))
+    assert store.sync_json_files() == 0
+    store.scanned_at -= 3600
+    assert store.sync_json_files() == 1
+    assert store.get("1767258000_analysis")["total_score"] == 16
+
+    # New files change the directory
+    (store.directory / "other.json").write_text(
+        json.dumps(make_entry("Task B", [1, 1, 1, 1]))
+    )
+    assert store.sync_json_files() == 1
@@ -0,0 +1,157 @@
+import json
+import threading
+import time
+
+import pytest
+
+from utils.logger import PipelineLogger, apply_event
+from utils.run_store import file_lock
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def test_events_update_the_run_data():
+    data = {}
+    for event in [
+        {"init": {"task": "t", "analysis": {}}},
+        {"set": "general_comment", "value": "good"},
+        {"set": "analysis", "field": "Content", "value": "a"},
+        {"merge": "analysis", "value": {"Language": "b"}},
+        {"append": "resumes", "value": 1},
+        {"set": "completed", "value": True},
+        {"delete": "completed"},
+    ]:
+        apply_event(data, event)
+
+    assert data == {
+        "task": "t",
+        "analysis": {"Content": "a", "Language": "b"},
+        "general_comment": "good",
+        "resumes": [1],
+    }
+
+
+def log_run(pipeline_logger: PipelineLogger):
+    pipeline_logger.log_student_solution("My essay")
+    pipeline_logger.log_criterion_scores({"Content": (4, "Relevant")})
+    pipeline_logger.log_general_comment("Well written")
+    pipeline_logger.writer.flush()
+
+
+def test_run_is_loaded_from_its_event_log(isolated_logs):
+    pipeline_logger = PipelineLogger("Write an essay")
+    log_run(pipeline_logger)
+    assert pipeline_logger.events_file.exists()
+    assert not pipeline_logger.log_file.exists()
+
+    loaded = PipelineLogger.load(pipeline_logger.run_id)
+    assert loaded.pipeline_data["task"] == "Write an essay"
+    assert loaded.pipeline_data["students_solution"] == "My essay"
+    assert loaded.pipeline_data["criterion_scores"] == {"Content": (4, "Relevant")}
+    assert loaded.pipeline_data["general_comment"] == "Well written"
+
+
+def test_torn_last_line_is_dropped(isolated_logs):
+    pipeline_logger = PipelineLogger("Write an essay")
+    log_run(pipeline_logger)
+    # The process died while writing an event
+    with open(pipeline_logger.events_file, "a", encoding="utf-8") as f:
+        f.write('{"set": "encouraging_comment", "val')
+
+    loaded = PipelineLogger.load(pipeline_logger.run_id)
+    assert loaded.pipeline_data["general_comment"] == "Well written"
+    assert loaded.pipeline_data["encouraging_comment"] == ""
+
+    # Events logged after the resume are kept
+    loaded.log_encouraging_comment("Keep going")
+    loaded.writer.flush()
+    reloaded = PipelineLogger.load(pipeline_logger.run_id)
+    assert reloaded.pipeline_data["encouraging_comment"] == "Keep going"
+
+
+def test_completed_run_is_compacted(isolated_logs):
+    pipeline_logger = PipelineLogger("Write an essay")
+    log_run(pipeline_logger)
+    pipeline_logger.complete_run()
+
+    assert not pipeline_logger.events_file.exists()
+    with open(pipeline_logger.log_file, encoding="utf-8") as f:
+        data = json.load(f)
+    assert data["completed"] is True
+    assert data["criterion_scores"] == {
+        "Content": {"score": 4, "justification": "Relevant"}
+    }
+
+    loaded = PipelineLogger.load(pipeline_logger.run_id)
+    assert loaded.pipeline_data["criterion_scores"] == {"Content": (4, "Relevant")}
+
+
+def test_events_after_compaction_are_applied_on_top(isolated_logs):
+    pipeline_logger = PipelineLogger("Write an essay")
+    log_run(pipeline_logger)
+    pipeline_logger.complete_run()
+
+    resumed = PipelineLogger.load(pipeline_logger.run_id)
+    resumed.log_general_comment("Rewritten")
+    resumed.writer.flush()
+
+    loaded = PipelineLogger.load(pipeline_logger.run_id)
+    assert loaded.pipeline_data["general_comment"] == "Rewritten"
+    assert loaded.pipeline_data["students_solution"] == "My essay"
+
+
+def test_missing_run_raises(isolated_logs):
+    with pytest.raises(FileNotFoundError):
+        PipelineLogger.load("01ARZ3NDEKTSV4RRFFQ69G5FAV")
+
+
+def test_lock_files_are_removed_with_the_event_log(isolated_logs):
+    pipeline_logger = PipelineLogger("Write an essay")
+    log_run(pipeline_logger)
+    assert (isolated_logs / f"{pipeline_logger.events_file.name}.lock").exists()
+
+    pipeline_logger.complete_run()
+    PipelineLogger.load(pipeline_logger.run_id)
+    assert sorted(path.name for path in isolated_logs.iterdir()) == [
+        pipeline_logger.log_file.name
+    ]
+
+
+@pytest.mark.skipif(fcntl is None, reason="lock files are only removed with flock")
+def test_removed_lock_file_still_excludes_waiting_processes(tmp_path):
+    path = tmp_path / "events.jsonl"
+    lock_path = tmp_path / "events.jsonl.lock"
+    first_locked = threading.Event()
+    release_first = threading.Event()
+    second_locked = threading.Event()
+    release_second = threading.Event()
+
+    def first():
+        with file_lock(path, remove=True):
+            first_locked.set()
+            release_first.wait(5)
+
+    def second():
+        # Opens the lock file that the first holder deletes on release
+        with file_lock(path):
+            second_locked.set()
+            release_second.wait(5)
+
+    threads = [threading.Thread(target=first), threading.Thread(target=second)]
+    threads[0].start()
+    assert first_locked.wait(5)
+    threads[1].start()
+    time.sleep(0.2)
+    release_first.set()
+    assert second_locked.wait(5)
+
+    # A newcomer opens the current lock file, and must not get the lock
+    with open(lock_path, "a+b") as lock_file:
+        with pytest.raises(BlockingIOError):
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    release_second.set()
+    for thread in threads:
+        thread.join(5)
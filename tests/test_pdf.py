@@ -0,0 +1,41 @@
+import pytest
+
+import src.ocr.pdf as pdf
+from src.ocr.pdf import iter_page_images
+
+
+def failing_pdf(pages_before_failure: int):
+    def iter_pdf_pages(pdf_bytes, output_dir, name="document", dpi=150):
+        for page_number in range(1, pages_before_failure + 1):
+            yield output_dir / f"{name}_page_{page_number}.png"
+        raise OSError("Unable to render page")
+
+    return iter_pdf_pages
+
+
+@pytest.fixture
+def submission(tmp_path):
+    image = tmp_path / "cover.jpg"
+    image.write_bytes(b"jpeg")
+    document = tmp_path / "essay.pdf"
+    document.write_bytes(b"%PDF-1.4")
+    return [image, document]
+
+
+def test_unreadable_pdf_is_skipped_with_a_warning(tmp_path, submission, monkeypatch):
+    monkeypatch.setattr(pdf, "iter_pdf_pages", failing_pdf(0))
+    warnings = []
+
+    pages = list(iter_page_images(submission, tmp_path, on_warning=warnings.append))
+
+    assert pages == [submission[0]]
+    assert len(warnings) == 1 and "essay.pdf" in warnings[0]
+
+
+def test_pdf_failing_partway_fails_the_submission(tmp_path, submission, monkeypatch):
+    monkeypatch.setattr(pdf, "iter_pdf_pages", failing_pdf(2))
+    warnings = []
+
+    with pytest.raises(RuntimeError, match="page 3 of PDF essay.pdf"):
+        list(iter_page_images(submission, tmp_path, on_warning=warnings.append))
+    assert warnings == []
@@ -0,0 +1,206 @@
+import threading
+import time
+
+import pytest
+
+import src.openai.rate_limiter as rate_limiter_module
+from src.openai.cache import NO_CACHE
+from src.openai.client import OpenAIClient
+from src.openai.retry import Cancelled, cancellation
+from src.openai.rate_limiter import (
+    COMPLETION_TOKENS,
+    RateLimiter,
+    TokenBucket,
+    estimate_tokens,
+    rate_limit_session,
+)
+
+
+class Clock:
+    """A monotonic clock advanced by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter_module.time, "monotonic", clock)
+    return clock
+
+
+def test_bucket_refills_continuously_up_to_its_capacity(clock):
+    bucket = TokenBucket(per_minute=60, capacity=10)
+    bucket.consume(10)
+    assert bucket.wait_time(5) == pytest.approx(5.0)
+
+    clock.advance(2)
+    assert bucket.wait_time(5) == pytest.approx(3.0)
+
+    clock.advance(100)
+    bucket.refill()
+    assert bucket.tokens == 10
+    # A request larger than the bucket only waits for a full bucket
+    assert bucket.wait_time(50) == 0.0
+
+
+def test_bucket_follows_rate_limit_headers(clock):
+    bucket = TokenBucket(per_minute=60)
+    bucket.sync(limit="120", remaining="30")
+    assert bucket.per_minute == 120
+    assert bucket.capacity == 120
+    assert bucket.tokens == 30
+
+
+def test_concurrency_is_halved_once_per_second_when_throttled(clock):
+    limiter = RateLimiter(6000, 10**6, max_concurrency=8)
+    # Requests in flight together are throttled together
+    permits = [limiter.acquire("model") for _ in range(2)]
+    for permit in permits:
+        limiter.throttled(permit)
+    assert limiter.models["model"].concurrency == 4
+
+    clock.advance(1)
+    limiter.throttled(limiter.acquire("model"))
+    assert limiter.models["model"].concurrency == 2
+    assert limiter.models["model"].in_flight == 0
+
+
+def test_concurrency_grows_by_one_per_window_of_successes(clock):
+    limiter = RateLimiter(6000, 10**6, max_concurrency=8)
+    limiter.throttled(limiter.acquire("model"))
+    clock.advance(1)
+    limiter.throttled(limiter.acquire("model"))
+    clock.advance(1)
+    assert limiter.models["model"].concurrency == 2
+
+    for _ in range(2):
+        limiter.release(limiter.acquire("model"), used_tokens=10)
+    assert limiter.models["model"].concurrency == pytest.approx(2.9)
+
+    # Failed requests are no signal
+    limiter.release(limiter.acquire("model"))
+    assert limiter.models["model"].concurrency == pytest.approx(2.9)
+
+
+def test_waiting_requests_are_served_round_robin_between_sessions():
+    limiter = RateLimiter(60000, 10**9, max_concurrency=1, burst=100)
+    held = limiter.acquire("model", session="held")
+    served = []
+
+    def request(session: str, label: str):
+        with rate_limit_session(session):
+            permit = limiter.acquire("model")
+        served.append(label)
+        limiter.release(permit, used_tokens=0)
+
+    threads = []
+    for session, label in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1")]:
+        queued = sum(map(len, limiter.models["model"].queues.values()))
+        thread = threading.Thread(target=request, args=(session, label))
+        thread.start()
+        threads.append(thread)
+        while sum(map(len, limiter.models["model"].queues.values())) == queued:
+            time.sleep(0.001)
+
+    limiter.release(held, used_tokens=0)
+    for thread in threads:
+        thread.join(timeout=5)
+    assert served == ["a1", "b1", "a2", "a3"]
+
+
+def test_queued_request_stops_waiting_when_cancelled():
+    limiter = RateLimiter(max_concurrency=1)
+    permit = limiter.acquire("gpt-4.1", 10)
+    cancelled = threading.Event()
+    errors = []
+
+    def queued():
+        with cancellation(cancelled):
+            try:
+                limiter.acquire("gpt-4.1", 10)
+            except Cancelled as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=queued)
+    thread.start()
+    time.sleep(0.1)
+    cancelled.set()
+    thread.join(5)
+
+    assert len(errors) == 1
+    assert limiter.stats()["gpt-4.1"]["queued"] == 0
+    limiter.release(permit, 10)
+
+
+def test_completion_estimate_follows_observed_completions():
+    limiter = RateLimiter()
+    assert limiter.expected_completion_tokens("model") == COMPLETION_TOKENS
+
+    for _ in range(40):
+        permit = limiter.acquire("model")
+        limiter.release(permit, used_tokens=300, completion_tokens=200)
+    assert limiter.expected_completion_tokens("model") == pytest.approx(200, abs=1)
+    assert limiter.stats()["model"]["expected_completion_tokens"] == 200
+
+    assert estimate_tokens("x" * 400, image_count=1, max_tokens=50) == 100 + 1000 + 50
+
+
+def test_permit_is_released_when_the_response_cannot_be_parsed(monkeypatch):
+    limiter = RateLimiter()
+    client = OpenAIClient(api_key="test", limiter=limiter)
+    limiter.limits("gpt-4.1").concurrency = 2.0
+
+    class Unparseable:
+        headers = {}
+
+        def parse(self):
+            raise ValueError("invalid response")
+
+    def send(params, tokens, retry_policy):
+        return Unparseable(), limiter.acquire(params["model"], tokens)
+
+    monkeypatch.setattr(client, "_send", send)
+    with pytest.raises(ValueError):
+        client.get_raw_response("prompt")
+    assert limiter.models["gpt-4.1"].in_flight == 0
+    # A failed request is no sign that more requests can be sent at once
+    assert limiter.models["gpt-4.1"].concurrency == 2.0
+
+
+def test_broken_stream_does_not_raise_the_concurrency(monkeypatch):
+    limiter = RateLimiter()
+    client = OpenAIClient(api_key="test", limiter=limiter, cache=NO_CACHE)
+    limiter.limits("gpt-4.1").concurrency = 2.0
+
+    class BrokenStream:
+        headers = {}
+
+        def parse(self):
+            return self
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+        def __iter__(self):
+            raise ConnectionError("stream broken")
+            yield
+
+    def send(params, tokens, retry_policy):
+        return BrokenStream(), limiter.acquire(params["model"], tokens)
+
+    monkeypatch.setattr(client, "_send", send)
+    with pytest.raises(ConnectionError):
+        list(client.stream_response("prompt"))
+    assert limiter.models["gpt-4.1"].in_flight == 0
+    assert limiter.models["gpt-4.1"].concurrency == 2.0
@@ -0,0 +1,149 @@
+import threading
+import time
+
+import httpx
+import pytest
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AuthenticationError,
+    BadRequestError,
+    RateLimitError,
+)
+
+import src.openai.retry as retry
+from src.openai.retry import (
+    DeadlineExceeded,
+    LatencyTracker,
+    RetryPolicy,
+    bounded_timeout,
+    call_hedged,
+    deadline,
+    is_retryable,
+    remaining_time,
+)
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def status_error(error_class, status: int, code=None):
+    return error_class(
+        "error",
+        response=httpx.Response(status, request=REQUEST),
+        body={"code": code} if code else None,
+    )
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        APITimeoutError(request=REQUEST),
+        APIConnectionError(request=REQUEST),
+        TimeoutError(),
+        status_error(RateLimitError, 429),
+        status_error(APIStatusError, 500),
+        status_error(APIStatusError, 503),
+        status_error(APIStatusError, 409),
+    ],
+)
+def test_transient_errors_are_retried(error):
+    assert is_retryable(error)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        status_error(RateLimitError, 429, code="insufficient_quota"),
+        status_error(BadRequestError, 400),
+        status_error(AuthenticationError, 401),
+        DeadlineExceeded(),
+        ValueError("invalid JSON"),
+    ],
+)
+def test_permanent_errors_are_not_retried(error):
+    assert not is_retryable(error)
+
+
+def test_retries_stop_after_max_attempts():
+    policy = RetryPolicy(max_attempts=3)
+    error = TimeoutError()
+    assert policy.should_retry(error, 1)
+    assert policy.should_retry(error, 2)
+    assert not policy.should_retry(error, 3)
+    assert not policy.should_retry(ValueError(), 1)
+
+
+def test_timeouts_are_bounded_by_the_innermost_deadline():
+    assert remaining_time() is None
+    assert bounded_timeout(120.0) == 120.0
+
+    with deadline(10):
+        assert bounded_timeout(120.0) <= 10
+        assert bounded_timeout(5.0) == 5.0
+        assert bounded_timeout(None) <= 10
+        # An inner deadline cannot extend the outer one
+        with deadline(60):
+            assert bounded_timeout(120.0) <= 10
+        with deadline(1):
+            assert bounded_timeout(120.0) <= 1
+
+    assert bounded_timeout(120.0) == 120.0
+
+
+def test_passed_deadline_raises():
+    with deadline(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded):
+            bounded_timeout(120.0)
+
+
+def test_no_retry_is_scheduled_past_the_deadline(monkeypatch):
+    # Always wait the longest backoff
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: high)
+    policy = RetryPolicy(base_delay=1.0, max_delay=10.0)
+    assert policy.next_delay(3) == 4.0
+
+    with deadline(2):
+        assert policy.next_delay(1) == 1.0
+        with pytest.raises(DeadlineExceeded):
+            policy.next_delay(3)
+
+
+def test_hedge_is_sent_once_the_tracked_latency_has_passed():
+    tracker = LatencyTracker()
+    for _ in range(retry.HEDGE_MIN_SAMPLES):
+        tracker.record("stage", 0.05)
+
+    release = threading.Event()
+    calls = []
+
+    def request():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            release.wait(timeout=5)
+            return "original"
+        return "hedged"
+
+    start = time.monotonic()
+    try:
+        assert call_hedged(request, key="stage", tracker=tracker) == "hedged"
+    finally:
+        release.set()
+    assert len(calls) == 2
+    assert calls[1] - start >= 0.05
+    assert time.monotonic() - start < 1
+
+
+def test_requests_are_not_hedged_until_enough_latencies_are_known():
+    tracker = LatencyTracker()
+    calls = []
+
+    def request():
+        calls.append(1)
+        time.sleep(0.01)
+        return "original"
+
+    assert call_hedged(request, key="stage", tracker=tracker) == "original"
+    assert len(calls) == 1
+    assert len(tracker.latencies["stage"]) == 1
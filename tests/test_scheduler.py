@@ -0,0 +1,186 @@
+import threading
+import time
+
+import pytest
+
+from src.openai.retry import DeadlineExceeded, remaining_time
+from src.pipeline.scheduler import Stage, StageScheduler, report_progress
+
+
+class Recorder:
+    """Listener keeping the events of a run, in order."""
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        with self.lock:
+            self.events.append((event.kind, event.stage))
+
+    def kinds(self, stage: str) -> list[str]:
+        return [kind for kind, name in self.events if name == stage]
+
+
+def diamond(calls: list[str]) -> list[Stage]:
+    """text -> (words, letters) -> summary, words and letters being independent."""
+
+    def stage(name, func):
+        def run(**inputs):
+            calls.append(name)
+            return func(**inputs)
+
+        return run
+
+    return [
+        Stage(
+            "summary",
+            stage(
+                "summary",
+                lambda words, letters: f"{words} words, {letters} letters",
+            ),
+            inputs=("words", "letters"),
+            outputs=("summary",),
+        ),
+        Stage(
+            "split",
+            stage("split", lambda text: (text.split(), text.replace(" ", ""))),
+            inputs=("text",),
+            outputs=("tokens", "characters"),
+        ),
+        Stage(
+            "words",
+            stage("words", lambda tokens: len(tokens)),
+            inputs=("tokens",),
+            outputs=("words",),
+        ),
+        Stage(
+            "letters",
+            stage("letters", lambda characters: len(characters)),
+            inputs=("characters",),
+            outputs=("letters",),
+        ),
+    ]
+
+
+def test_stages_run_in_dependency_order():
+    calls = []
+    values = StageScheduler(diamond(calls)).run({"text": "to be or not"})
+
+    assert values["summary"] == "4 words, 9 letters"
+    assert values["tokens"] == ["to", "be", "or", "not"]
+    assert calls[0] == "split"
+    assert set(calls[1:3]) == {"words", "letters"}
+    assert calls[3] == "summary"
+
+
+def test_independent_stages_run_concurrently():
+    both_started = threading.Barrier(2, timeout=5)
+
+    def branch():
+        both_started.wait()
+        return 1
+
+    stages = [
+        Stage("a", branch, outputs=("a",)),
+        Stage("b", branch, outputs=("b",)),
+    ]
+    assert StageScheduler(stages).run({}) == {"a": 1, "b": 1}
+
+
+def test_stages_with_provided_outputs_are_skipped():
+    calls = []
+    listener = Recorder()
+    values = StageScheduler(diamond(calls), listener=listener).run(
+        {"text": "to be", "tokens": ["a", "b", "c"], "characters": "abc"}
+    )
+
+    assert "split" not in calls
+    assert values["summary"] == "3 words, 3 letters"
+    assert listener.kinds("split") == ["skipped"]
+    assert listener.kinds("words") == ["started", "finished"]
+
+
+def test_failed_stage_stops_the_run():
+    calls = []
+    listener = Recorder()
+
+    def fail(tokens):
+        raise RuntimeError("boom")
+
+    stages = diamond(calls)
+    stages[2] = Stage("words", fail, inputs=("tokens",), outputs=("words",))
+
+    with pytest.raises(RuntimeError, match="boom"):
+        StageScheduler(stages, listener=listener).run({"text": "to be"})
+    assert "summary" not in calls
+    assert listener.kinds("words") == ["started", "failed"]
+    assert listener.kinds("summary") == []
+
+
+def test_failed_stage_stops_its_siblings_from_sending_requests():
+    listener = Recorder()
+    sibling_started = threading.Event()
+    calls = []
+
+    def sibling():
+        sibling_started.set()
+        for _ in range(500):
+            # Every request checks the time left before it is sent
+            remaining_time()
+            calls.append(time.monotonic())
+            time.sleep(0.01)
+
+    def fail():
+        sibling_started.wait(5)
+        raise RuntimeError("boom")
+
+    stages = [
+        Stage("sibling", sibling, outputs=("a",)),
+        Stage("fail", fail, outputs=("b",)),
+    ]
+    with pytest.raises(RuntimeError, match="boom"):
+        StageScheduler(stages, listener=listener).run({})
+    time.sleep(0.1)
+    calls_after_failure = len(calls)
+    time.sleep(0.2)
+
+    assert len(calls) == calls_after_failure
+    assert listener.kinds("sibling") == ["started", "failed"]
+
+
+def test_progress_is_reported_to_the_listener():
+    listener = Recorder()
+
+    def pages():
+        for page in range(1, 3):
+            report_progress(page, 2)
+        return "text"
+
+    StageScheduler([Stage("ocr", pages, outputs=("text",))], listener=listener).run({})
+    assert listener.kinds("ocr") == ["started", "progress", "progress", "finished"]
+
+
+def test_unresolved_inputs_and_cycles_are_rejected():
+    with pytest.raises(ValueError, match="unresolved inputs"):
+        StageScheduler([Stage("a", len, inputs=("missing",), outputs=("a",))]).run({})
+
+    cycle = [
+        Stage("a", lambda b: b, inputs=("b",), outputs=("a",)),
+        Stage("b", lambda a: a, inputs=("a",), outputs=("b",)),
+    ]
+    with pytest.raises(ValueError, match="cyclic"):
+        StageScheduler(cycle).run({})
+
+
+def test_stage_deadline_bounds_the_stage():
+    seen = []
+
+    def slow():
+        seen.append(remaining_time())
+        time.sleep(1)
+
+    stages = [Stage("slow", slow, outputs=("x",), deadline=0.5)]
+    with pytest.raises(DeadlineExceeded):
+        StageScheduler(stages).run({}, timeout=0.1)
+    assert seen[0] <= 0.1
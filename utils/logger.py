@@ -1,14 +1,19 @@
+import atexit
 import sys
 import time
 import json
 import os
+import queue
+import threading
 from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from loguru import logger
 
+from utils.run_store import append_text, atomic_write_json, file_lock, new_run_id
+
 
 def setup_logger(log_level: str = "INFO"):
     """
@@ -61,106 +66,386 @@ def log_time(task_name: str, level: str = "INFO"):
         logger.log(level, f"Completed {task_name} in {elapsed:.2f} seconds")
 
 
+LOG_DIR = Path("logs")
+
+# Seconds the event writer waits to gather events before writing them.
+LOG_FLUSH_INTERVAL = float(os.getenv("PIPELINE_LOG_FLUSH_INTERVAL", "0.5"))
+
+
+def apply_event(data: Dict[str, Any], event: Dict[str, Any]):
+    """
+    Apply an event of a pipeline log to the run data. Events are one of:
+
+    - {"init": data}: the initial data of the run.
+    - {"set": key, "value": value}: set a value.
+    - {"set": key, "field": field, "value": value}: set a field of a dictionary.
+    - {"merge": key, "value": dictionary}: update a dictionary.
+    - {"append": key, "value": value}: append to a list.
+    - {"delete": key}: remove a value.
+    """
+    if "init" in event:
+        data.clear()
+        data.update(event["init"])
+    elif "set" in event and "field" in event:
+        data.setdefault(event["set"], {})[event["field"]] = event["value"]
+    elif "set" in event:
+        data[event["set"]] = event["value"]
+    elif "merge" in event:
+        data.setdefault(event["merge"], {}).update(event["value"])
+    elif "append" in event:
+        data.setdefault(event["append"], []).append(event["value"])
+    elif "delete" in event:
+        data.pop(event["delete"], None)
+
+
+class EventWriter:
+    """
+    Appends the events of every pipeline log from a single background thread.
+
+    Events are serialized by the caller, so logging costs the size of the
+    event, and the writer gathers the events of `flush_interval` seconds into
+    a single write per file.
+    """
+
+    def __init__(self, flush_interval: float = LOG_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.queue: queue.Queue = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def write(self, path: Path, event: Dict[str, Any]):
+        """Queue an event to be appended to the JSONL file at `path`."""
+        line = json.dumps(event) + "\n"
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name="pipeline-log-writer", daemon=True
+                )
+                self.thread.start()
+        self.queue.put((path, line))
+
+    def flush(self):
+        """Wait until every queued event is written."""
+        with self.lock:
+            if self.thread is None:
+                return
+        done = threading.Event()
+        self.queue.put((None, done))
+        done.wait()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            # Gather the events of the next interval, unless a flush is waiting
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1][0] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            lines: Dict[Path, List[str]] = {}
+            flushes = []
+            for path, item in batch:
+                if path is None:
+                    flushes.append(item)
+                else:
+                    lines.setdefault(path, []).append(item)
+
+            for path, path_lines in lines.items():
+                try:
+                    append_text(path, "".join(path_lines))
+                except OSError as e:
+                    logger.error(f"Could not write pipeline log {path}: {str(e)}")
+
+            for done in flushes:
+                done.set()
+
+
+event_writer = EventWriter()
+atexit.register(event_writer.flush)
+
+
 class PipelineLogger:
     """
     Logger class for pipeline runs that handles structured logging to a single file.
+
+    While the run goes on, every update is appended as an event to
+    `pipeline_run_<run_id>.jsonl`. When the run completes, the events are
+    compacted into `pipeline_run_<run_id>.json` and the event log is removed.
+
+    The log doubles as a checkpoint of the run: `PipelineLogger.load` reads it
+    back so that an interrupted run can be resumed.
+
+    New runs get a ULID as run id, so that runs started at the same time, in
+    this process or another, never write to the same log.
     """
 
-    def __init__(self, task: str):
-        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.log_dir = Path("logs")
+    def __init__(
+        self,
+        task: str,
+        run_id: Optional[str] = None,
+        pipeline_data: Optional[Dict[str, Any]] = None,
+        writer: EventWriter = event_writer,
+    ):
+        self.lock = threading.RLock()
+        self.started_at = time.time()
+        self.run_id = run_id or new_run_id()
+        self.log_dir = LOG_DIR
         self.log_file = self.log_dir / f"pipeline_run_{self.run_id}.json"
-        self.pipeline_data = {
-            "run_id": self.run_id,
-            "task": task,
-            "timestamp": datetime.now().isoformat(),
-            "students_solution": "",
-            "task_understanding": "",
-            "analysis": {},
-            "criterion_scores": {},
-            "general_comment": "",
-            "detailed_analysis": [],
-        }
+        self.events_file = self.log_dir / f"pipeline_run_{self.run_id}.jsonl"
+        self.writer = writer
 
         # Create logs directory if it doesn't exist
         os.makedirs(self.log_dir, exist_ok=True)
 
+        if pipeline_data is not None:
+            # Loaded from the log, which already holds this data
+            self.pipeline_data = pipeline_data
+        else:
+            self.pipeline_data = {}
+            self.record(
+                {
+                    "init": {
+                        "run_id": self.run_id,
+                        "task": task,
+                        "timestamp": datetime.now().isoformat(),
+                        "students_solution": "",
+                        "task_understanding": "",
+                        "analysis": {},
+                        "criterion_scores": {},
+                        "general_comment": "",
+                        "detailed_analysis": [],
+                        "encouraging_comment": "",
+                    }
+                }
+            )
+
         logger.info(f"Initialized Pipeline Logger with run_id: {self.run_id}")
-        self.save()
-
-    def save(self):
-        """Save the current pipeline data to the log file."""
-        # Convert tuple values in criterion_scores to dictionaries for JSON serialization
-        json_data = self.pipeline_data.copy()
-        if "criterion_scores" in json_data and json_data["criterion_scores"]:
-            json_data["criterion_scores"] = {
-                criterion: {"score": score, "justification": justification}
-                for criterion, (score, justification) in json_data[
-                    "criterion_scores"
-                ].items()
-            }
 
-        with open(self.log_file, "w", encoding="utf-8") as f:
-            json.dump(json_data, f, indent=4)
-        logger.debug(f"Pipeline data saved to {self.log_file}")
+    @classmethod
+    def load(cls, run_id: str) -> "PipelineLogger":
+        """
+        Load the log of an earlier run, to continue logging into it.
+
+        The compacted log file of the run is read first, if any, and the
+        events that were logged after it are applied on top.
+
+        Raises:
+            FileNotFoundError: When there is no log for `run_id`.
+        """
+        log_file = LOG_DIR / f"pipeline_run_{run_id}.json"
+        events_file = LOG_DIR / f"pipeline_run_{run_id}.jsonl"
+        event_writer.flush()
+
+        if not log_file.exists() and not events_file.exists():
+            raise FileNotFoundError(f"No pipeline log found for run {run_id}")
+        if events_file.exists():
+            # Not compacted by another process while the two files are read
+            with file_lock(events_file):
+                pipeline_data = cls._read_log(log_file, events_file)
+        else:
+            pipeline_data = cls._read_log(log_file, events_file)
+
+        # Criterion scores are saved as dictionaries (or lists in events), but
+        # logged as tuples
+        pipeline_data["criterion_scores"] = {
+            criterion: (
+                (value["score"], value["justification"])
+                if isinstance(value, dict)
+                else tuple(value)
+            )
+            for criterion, value in (pipeline_data.get("criterion_scores") or {}).items()
+        }
+
+        logger.info(f"Loaded pipeline run {run_id} from {LOG_DIR}")
+        return cls(pipeline_data["task"], run_id=run_id, pipeline_data=pipeline_data)
+
+    @staticmethod
+    def _read_log(log_file: Path, events_file: Path) -> Dict[str, Any]:
+        """Read the compacted log of a run, then apply its event log on top."""
+        pipeline_data: Dict[str, Any] = {}
+        if log_file.exists():
+            with open(log_file, "r", encoding="utf-8") as f:
+                pipeline_data = json.load(f)
+
+        if events_file.exists():
+            content = events_file.read_bytes()
+            complete = content[: content.rfind(b"\n") + 1]
+            if len(complete) < len(content):
+                # The last line is cut short when the process died while writing
+                # it. It is dropped, so that the next event does not get
+                # appended to it.
+                logger.warning(f"Dropping a truncated event in {events_file}")
+                os.truncate(events_file, len(complete))
+
+            for line in complete.decode("utf-8").splitlines():
+                try:
+                    apply_event(pipeline_data, json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping an invalid event in {events_file}")
+
+        return pipeline_data
+
+    def record(self, event: Dict[str, Any]):
+        """Apply an event to the run data, and append it to the event log."""
+        with self.lock:
+            apply_event(self.pipeline_data, event)
+        self.writer.write(self.events_file, event)
+
+    def compact(self):
+        """
+        Write the run data to the log file, replacing the event log.
+        """
+        self.writer.flush()
+        with self.lock, file_lock(self.events_file, remove=True):
+            # Convert tuple values in criterion_scores to dictionaries for JSON serialization
+            json_data = self.pipeline_data.copy()
+            if "criterion_scores" in json_data and json_data["criterion_scores"]:
+                json_data["criterion_scores"] = {
+                    criterion: {"score": score, "justification": justification}
+                    for criterion, (score, justification) in json_data[
+                        "criterion_scores"
+                    ].items()
+                }
+
+            atomic_write_json(self.log_file, json_data, indent=4)
+            self.events_file.unlink(missing_ok=True)
+        logger.debug(f"Pipeline data compacted to {self.log_file}")
 
     def log_student_solution(self, solution: str):
         """Log the student's solution."""
-        self.pipeline_data["students_solution"] = solution
+        self.record({"set": "students_solution", "value": solution})
         logger.info("Student solution extracted and logged")
-        self.save()
+
+    def log_ocr_metrics(self, metrics: Dict[str, Any]):
+        """Log the OCR metrics (per-page timings, cache use, sizes)."""
+        self.record({"merge": "ocr_metrics", "value": metrics})
+        logger.info("OCR metrics logged")
 
     def log_task_understanding(self, understanding: Any):
         """Log the task understanding."""
-        self.pipeline_data["task_understanding"] = understanding
+        self.record({"set": "task_understanding", "value": understanding})
         logger.info("Task understanding completed and logged")
-        self.save()
 
     def log_analysis(self, analysis: Dict[str, str]):
         """Log the analysis results."""
-        self.pipeline_data["analysis"] = analysis
+        self.record({"set": "analysis", "value": analysis})
         logger.info("Pre-scoring analysis completed and logged")
-        self.save()
 
     def log_criterion_scores(self, scores: Dict[str, Tuple[int, str]]):
         """Log the criterion scores."""
-        self.pipeline_data["criterion_scores"] = scores
+        self.record({"set": "criterion_scores", "value": scores})
         logger.info("Criterion scoring completed and logged")
-        self.save()
 
     def log_general_comment(self, comment: str):
         """Log the general comment."""
-        self.pipeline_data["general_comment"] = comment
+        self.record({"set": "general_comment", "value": comment})
         logger.info("General comment generated and logged")
-        self.save()
 
     def log_detailed_analysis(self, detailed_analysis: list[dict[str, str]]):
         """Log the detailed analysis of the student's solution."""
-        self.pipeline_data["detailed_analysis"] = detailed_analysis
+        self.record({"set": "detailed_analysis", "value": detailed_analysis})
         logger.info("Detailed analysis completed and logged")
-        self.save()
+
+    def log_encouraging_comment(self, comment: str):
+        """Log the encouraging comment."""
+        self.record({"set": "encouraging_comment", "value": comment})
+        logger.info("Encouraging comment generated and logged")
+
+    def log_resume(self, skipped_stages: List[str]):
+        """Log that the run was resumed, reusing the outputs of `skipped_stages`."""
+        self.record({"delete": "completed"})
+        self.record(
+            {
+                "append": "resumes",
+                "value": {
+                    "timestamp": datetime.now().isoformat(),
+                    "skipped_stages": skipped_stages,
+                },
+            }
+        )
+        logger.info(f"Pipeline run {self.run_id} resumed, skipping {skipped_stages}")
+
+    def log_time_to_first_token(self, step_name: str, seconds: float):
+        """Log how long a streamed step took to produce its first token."""
+        self.record(
+            {"set": "time_to_first_token", "field": step_name, "value": seconds}
+        )
+        logger.info(f"First token of {step_name} after {seconds:.2f} seconds")
+
+    def log_token_usage(self, usage: Dict[str, Any]):
+        """
+        Log the tokens used by the run, how many were prompt cache hits, and
+        the hit rate of the response caches.
+        """
+        self.record({"set": "token_usage", "value": usage})
+        logger.info(
+            f"Run used {usage['prompt_tokens']} prompt tokens, "
+            f"{usage['cached_tokens']} of them cached"
+        )
+        for cache, lookups in usage.get("response_caches", {}).items():
+            logger.info(
+                f"Response cache {cache}: {lookups['hits']} hits, "
+                f"{lookups['misses']} misses ({lookups['hit_rate']:.0%})"
+            )
+
+    def log_rate_limits(self, stats: Dict[str, Dict[str, Any]]):
+        """Log the state of the rate limiter of each model at the end of the run."""
+        self.record({"set": "rate_limits", "value": stats})
+        for model, limits in stats.items():
+            logger.info(
+                f"Rate limits of {model}: concurrency {limits['concurrency']}, "
+                f"{limits['tokens_available']}/{limits['tokens_per_minute']} tokens "
+                f"available, {limits['expected_completion_tokens']} completion "
+                f"tokens expected per request"
+            )
+
+    def log_critical_path(self, path: List[str]):
+        """Log the chain of stages that determined the run's duration."""
+        self.record({"set": "critical_path", "value": path})
+        logger.info("Critical path logged")
 
     def complete_run(self):
-        """Mark the pipeline run as completed."""
-        self.pipeline_data["completed"] = True
-        self.pipeline_data["completion_time"] = datetime.now().isoformat()
-        self.save()
+        """Mark the pipeline run as completed, and compact its log."""
+        self.record({"set": "completed", "value": True})
+        self.record({"set": "completion_time", "value": datetime.now().isoformat()})
+        self.compact()
         logger.info(f"Pipeline run {self.run_id} completed. Log file: {self.log_file}")
 
     @contextmanager
     def step_timing(self, step_name: str):
-        """Context manager to time and log a pipeline step."""
+        """
+        Context manager to time and log a pipeline step.
+
+        Besides the duration, the start and end of the step (in seconds since
+        the run started) are recorded in `step_windows`, so that overlapping
+        steps and the critical path can be seen in the log file.
+        """
         logger.info(f"Starting pipeline step: {step_name}")
         start_time = time.time()
         try:
             yield
         finally:
-            elapsed = time.time() - start_time
-            self.pipeline_data.setdefault("step_timings", {})[step_name] = elapsed
+            end_time = time.time()
+            elapsed = end_time - start_time
+            self.record({"set": "step_timings", "field": step_name, "value": elapsed})
+            self.record(
+                {
+                    "set": "step_windows",
+                    "field": step_name,
+                    "value": {
+                        "start": start_time - self.started_at,
+                        "end": end_time - self.started_at,
+                    },
+                }
+            )
             logger.info(
                 f"Completed pipeline step: {step_name} in {elapsed:.2f} seconds"
             )
-            self.save()
 
 
 logger = setup_logger()  # noqa F811
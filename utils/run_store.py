@@ -0,0 +1,170 @@
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Crockford's base32, as used by ULIDs
+ULID_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ULID_LENGTH = 26
+
+_last_ulid = (0, 0)
+_ulid_lock = threading.Lock()
+
+
+def new_run_id() -> str:
+    """
+    Return a new ULID: 26 characters encoding the current time in milliseconds,
+    followed by 80 random bits.
+
+    ULIDs sort by creation time, and ids created in the same millisecond by
+    this process still increase, so runs started together never share an id.
+    """
+    global _last_ulid
+    with _ulid_lock:
+        timestamp = time.time_ns() // 1_000_000
+        last_timestamp, last_randomness = _last_ulid
+        if timestamp <= last_timestamp:
+            timestamp = last_timestamp
+            randomness = last_randomness + 1
+        else:
+            randomness = secrets.randbits(80)
+        _last_ulid = (timestamp, randomness)
+
+    value = (timestamp << 80) | randomness
+    chars = []
+    for _ in range(ULID_LENGTH):
+        chars.append(ULID_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def run_id_timestamp(run_id: str) -> Optional[datetime]:
+    """
+    Return when a run was created, from its id.
+
+    Besides ULIDs, the ids of older runs are understood: `%Y%m%d_%H%M%S`
+    timestamps (pipeline logs) and Unix timestamps in seconds (history files).
+
+    Returns:
+        The local creation time, or None when the id encodes no time.
+    """
+    if len(run_id) == ULID_LENGTH and all(
+        char in ULID_ALPHABET for char in run_id.upper()
+    ):
+        timestamp = 0
+        for char in run_id[:10].upper():
+            timestamp = timestamp * 32 + ULID_ALPHABET.index(char)
+        return datetime.fromtimestamp(timestamp / 1000)
+
+    try:
+        return datetime.strptime(run_id, "%Y%m%d_%H%M%S")
+    except ValueError:
+        pass
+    if run_id.isdigit():
+        return datetime.fromtimestamp(int(run_id))
+    return None
+
+
+@contextmanager
+def file_lock(path: Path, remove: bool = False) -> Iterator[None]:
+    """
+    Hold an exclusive lock on `path` across processes, e.g. Streamlit sessions
+    and CLI runs writing the same run.
+
+    The lock is taken on a `<name>.lock` file next to `path`, so that `path`
+    itself can be replaced or removed while the lock is held.
+
+    Args:
+        path: The file to lock.
+        remove: Delete the lock file on release, once `path` is gone for good.
+            A process that was waiting on the deleted file notices it is no
+            longer the lock file once it gets it, and locks the current one.
+    """
+    lock_path = Path(path).with_name(f"{Path(path).name}.lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    while True:
+        lock_file = open(lock_path, "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                if not _is_current_file(lock_file, lock_path):
+                    # Deleted (and maybe recreated) by the previous holder
+                    continue
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if remove and fcntl is not None:
+                    # Windows cannot delete a file that is open
+                    lock_path.unlink(missing_ok=True)
+                if fcntl is None:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            return
+        finally:
+            # Closing the file also releases the flock
+            lock_file.close()
+
+
+def _is_current_file(opened, path: Path) -> bool:
+    """Whether the open file `opened` is still the file found at `path`."""
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened_stat = os.fstat(opened.fileno())
+    return (opened_stat.st_dev, opened_stat.st_ino) == (current.st_dev, current.st_ino)
+
+
+def atomic_write_text(path: Path, text: str):
+    """
+    Write `text` to `path` so that readers see either the previous or the new
+    content, never a partly written file.
+
+    The text is written to a temporary file in the same directory, flushed to
+    disk, then renamed over `path`.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+def atomic_write_json(path: Path, data: Any, indent: Optional[int] = None):
+    """Write `data` as JSON to `path` (see `atomic_write_text`)."""
+    atomic_write_text(path, json.dumps(data, indent=indent))
+
+
+def append_text(path: Path, text: str):
+    """
+    Append `text` to `path` under its file lock, so that appends of several
+    processes are never interleaved.
+    """
+    with file_lock(path):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(text)
+